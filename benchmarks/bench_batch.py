@@ -0,0 +1,71 @@
+"""
+Benchmark `drivereader.batch.run_batch` with one process and with many.
+
+Every tenant crawls its own `FakeDriveBackend`, so the runs are bound by
+the classification and report writing rather than the network. Run with:
+
+    python benchmarks/bench_batch.py --tenants 8 --processes 1 4
+"""
+
+from argparse import ArgumentParser
+from json import dumps
+from os import chdir, makedirs
+from tempfile import TemporaryDirectory
+
+from openpyxl import Workbook
+
+from drivereader.batch import run_batch
+
+
+def prepare(tenants: int, folders: int, files: int):
+    """Make the directory of every tenant and return the tenants."""
+    configs = []
+    for number in range(tenants):
+        directory = f"tenant{number}"
+        makedirs(f"{directory}/data")
+        workbook = Workbook()
+        worksheet = workbook.active
+        worksheet.title = "NAAC Quantitative"
+        worksheet.append(["NAAC"])
+        worksheet.append(["Category", "Classification", "Code", "Name"])
+        worksheet.append(["RESEARCH", "3.3.1", "RPIF", "Research paper"])
+        worksheet.append([None, "3.3.2", "CONF", "Conference"])
+        worksheet.append(["PUBLICATION", "3.4.1", "JOUR", "Journal"])
+        workbook.save(f"{directory}/data/doc_classification.xlsx")
+        with open(f"{directory}/data/folders.json", "w") as file:
+            file.write(dumps([f"Folder {i}" for i in range(folders)]))
+        configs.append({
+            "name": directory,
+            "directory": directory,
+            "backend": "drivereader.fakedrive:FakeDriveBackend.generate",
+            "backend_options": {"folders": folders,
+                                "files_per_folder": files, "seed": number},
+            "rate": 1e6,
+            "streaming": True
+        })
+    return configs
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tenants", type=int, default=8)
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--files", type=int, default=2000,
+                        help="files per folder")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        tenants = prepare(args.tenants, args.folders, args.files)
+        for processes in args.processes:
+            summary = run_batch(tenants, processes, None)
+            files = sum(tenant["files"] for tenant in summary["tenants"])
+            print(f"processes={processes:<3} {summary['seconds']:8.2f}s "
+                  f"wall {summary['tenant_seconds']:8.2f}s summed "
+                  f"{files / summary['seconds']:10.0f} files/s "
+                  f"{len(summary['failed'])} failed")
+
+
+if __name__ == "__main__":
+    main()
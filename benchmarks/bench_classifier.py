@@ -0,0 +1,87 @@
+"""
+Benchmark `FileClassifier.classify` against the per-call
+`DriveReader.classify_file` path on synthetic file names.
+
+The names are classified a page at a time, 1000 names by default like the
+pages of a listing, and both paths must give identical counts and exempted
+names. Run with:
+
+    python benchmarks/bench_classifier.py --names 1000000 --page-size 1000
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from json import dumps
+from random import Random
+from time import perf_counter
+
+from drivereader.classifier import FileClassifier
+from drivereader.drivereader import DriveReader
+from drivereader.fakedrive import FakeDriveBackend
+
+CATEGORIES = ["RESEARCH", "PUBLICATION", "EXTENSION", "STUDENT"]
+
+
+def synthetic(count: int, codes: list[str], seed: int = 0):
+    """Names in the naming convention, with some that cannot be classified."""
+    random = Random(seed)
+    names = []
+    for index in range(count):
+        roll = random.random()
+        code = random.choice(codes)
+        if roll < 0.05:
+            names.append(f"scan_{index}.pdf")
+        elif roll < 0.08:
+            names.append(f"2023{random.randint(1, 12):02d}01_XXXX_{index}")
+        elif roll < 0.1:
+            names.append(f"{code.lower()}_{index}_notes.docx")
+        else:
+            names.append(f"{random.randint(2012, 2023)}"
+                         f"{random.randint(1, 12):02d}{random.randint(1, 28)}"
+                         f"_{code if roll < 0.9 else code.lower()}_{index}.pdf")
+    return names
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--names", type=int, default=1_000_000)
+    parser.add_argument("--codes", type=int, default=120)
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    codes = [f"C{number:03d}" for number in range(args.codes)]
+    code_list = {code: [f"Code {code}", CATEGORIES[i % len(CATEGORIES)],
+                        ["1.1.1"]] for i, code in enumerate(codes)}
+    names = synthetic(args.names, codes)
+    pages = [names[start:start + args.page_size]
+             for start in range(0, len(names), args.page_size)]
+
+    reader = DriveReader(backend_factory=FakeDriveBackend)
+    reader.code_list = code_list
+    reader.data, exempt = {}, []
+    start = perf_counter()
+    for page in pages:
+        for name in page:
+            if_failed = reader.classify_file(name)
+            if if_failed:
+                exempt.append(if_failed)
+    reader.finalize_data()
+    per_call = perf_counter() - start
+
+    start = perf_counter()
+    classifier, counts, batch_exempt = FileClassifier(code_list), Counter(), []
+    for page in pages:
+        batch_exempt.extend(classifier.classify(page, counts)[1])
+    data = FileClassifier.nested(counts)
+    batch = perf_counter() - start
+
+    identical = dumps(data) == dumps(reader.data) and batch_exempt == exempt
+    print(f"pages of {args.page_size} names")
+    print(f"per-call {per_call:7.2f}s {args.names / per_call:12.0f} names/s")
+    print(f"batch    {batch:7.2f}s {args.names / batch:12.0f} names/s")
+    print(f"speedup  {per_call / batch:7.2f}x "
+          f"{'identical' if identical else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark the default and the streaming writers of `ExcelWorker` on a
+synthetic report.
+
+Each writer runs in a fresh process so that its peak RSS can be read on its
+own. Run with:
+
+    python benchmarks/bench_excel.py --rows 500000
+"""
+
+from argparse import ArgumentParser
+from json import dumps, loads
+from os import makedirs
+from resource import RUSAGE_SELF, getrusage
+from subprocess import DEVNULL, run
+from sys import executable, platform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from openpyxl import Workbook
+
+from drivereader.classifier import BAD_SPLIT
+from drivereader.exempt import ExemptLog
+
+CATEGORIES = ["RESEARCH", "PUBLICATION", "EXTENSION", "STUDENT", "FACULTY"]
+
+
+def peak_rss_mb():
+    """The peak resident set size of this process in MB."""
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if platform == "darwin" else 1024)
+
+
+def prepare(rows: int, codes: int):
+    """Write a classification sheet and return synthetic report data."""
+    makedirs("data", exist_ok=True)
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = "NAAC Quantitative"
+    worksheet.append(["NAAC"])
+    worksheet.append(["Category", "Classification", "Code", "Name"])
+    for number in range(codes):
+        worksheet.append([CATEGORIES[number % len(CATEGORIES)],
+                          f"{number % 7 + 1}.{number % 5 + 1}.{number}",
+                          f"C{number:04d}", f"Document type number {number}"])
+    workbook.save("data/doc_classification.xlsx")
+
+    years = max(1, rows // codes)
+    data = {category: {} for category in CATEGORIES}
+    for year in range(2022, 2022 - years, -1):
+        for number in range(codes):
+            category = CATEGORIES[number % len(CATEGORIES)]
+            data[category].setdefault(f"{year}-{year+1}", {})[
+                f"C{number:04d}"] = number % 97 + 1
+    exempt = ExemptLog()
+    exempt.extend((f"unnamed scan {number}.pdf", f"Folder {number % 300}",
+                   BAD_SPLIT) for number in range(rows // 100))
+    return data, exempt
+
+
+def run_writer(streaming: bool, rows: int, codes: int):
+    """Write both reports once and print the time and peak RSS as JSON."""
+    from drivereader.drivereader import ExcelWorker
+
+    data, exempt = prepare(rows, codes)
+    before = peak_rss_mb()
+    worker = ExcelWorker(streaming)
+    start = perf_counter()
+    worker.write_data_to_excel(data, exempt)
+    worker.write_naac_data_to_excel(data)
+    elapsed = perf_counter() - start
+    print(dumps({"seconds": elapsed, "peak_rss_mb": peak_rss_mb(),
+                 "data_rss_mb": before}))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--codes", type=int, default=1000)
+    parser.add_argument("--run", choices=["default", "streaming"],
+                        help="run a single writer in this process")
+    args = parser.parse_args()
+
+    if args.run:
+        run_writer(args.run == "streaming", args.rows, args.codes)
+        return
+
+    for writer in ("default", "streaming"):
+        with TemporaryDirectory() as directory:
+            result = run([executable, __file__, "--run", writer,
+                          "--rows", str(args.rows), "--codes", str(args.codes)],
+                         cwd=directory, capture_output=True, text=True,
+                         stdin=DEVNULL)
+            stats = loads(result.stdout.strip().splitlines()[-1])
+            print(f"{writer:<10} {stats['seconds']:8.2f}s "
+                  f"peak RSS {stats['peak_rss_mb']:8.1f} MB "
+                  f"(data alone {stats['data_rss_mb']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
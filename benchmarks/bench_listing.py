@@ -0,0 +1,99 @@
+"""
+Benchmark the concurrent folder listing of `DriveReader.categorize_files`.
+
+The crawl runs against `FakeDriveBackend` with a fixed latency per request,
+so the numbers show how much of a run is network wait and how much of it
+the listing workers hide. With `--error-rate` some requests fail with a
+rate limit and are retried by the scheduler, and with `--batch` the first
+pages are listed with batch requests. With `--depth` every folder gets a
+tree of sub-folders, which is crawled recursively. Run with:
+
+    python benchmarks/bench_listing.py --folders 60 --latency 0.02
+"""
+
+from argparse import ArgumentParser
+from json import dumps
+from os import chdir, makedirs
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from drivereader.drivereader import DriveReader
+from drivereader.fakedrive import FakeDriveBackend
+from drivereader.scheduler import RequestScheduler
+
+CODE_LIST = {
+    "RPIF": ["Research paper", "RESEARCH", ["3.3.1"]],
+    "CONF": ["Conference", "RESEARCH", ["3.3.2"]],
+    "JOUR": ["Journal", "PUBLICATION", ["3.4.1"]],
+}
+
+
+def crawl(backend: FakeDriveBackend, workers: int, rate: float,
+          batch: bool, recursive: bool):
+    """Run one crawl and return the reader and the elapsed seconds."""
+    reader = DriveReader(backend_factory=backend.connect, workers=workers,
+                         folder_cache_ttl=0,
+                         scheduler=RequestScheduler(rate, base_delay=0.01),
+                         batch=batch, recursive=recursive)
+    reader.code_list = CODE_LIST
+    reader.categories = ["RESEARCH", "PUBLICATION"]
+    start = perf_counter()
+    reader.categorize_files()
+    return reader, perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--folders", type=int, default=60)
+    parser.add_argument("--files", type=int, default=500,
+                        help="files per folder")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds per request")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rate", type=float, default=1e6,
+                        help="requests per second allowed by the quota")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of requests failing with a 429")
+    parser.add_argument("--batch", action="store_true",
+                        help="list the first pages with batch requests")
+    parser.add_argument("--depth", type=int, default=0,
+                        help="levels of sub-folders below every folder")
+    parser.add_argument("--subfolders", type=int, default=3,
+                        help="sub-folders of every folder with --depth")
+    args = parser.parse_args()
+
+    backend = FakeDriveBackend.generate(args.folders, args.files,
+                                        page_size=args.page_size,
+                                        latency=args.latency,
+                                        error_rate=args.error_rate,
+                                        error_status=429,
+                                        subfolders=args.subfolders,
+                                        depth=args.depth)
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        makedirs("data")
+        with open("data/folders.json", "w") as file:
+            file.write(dumps([f"Folder {i}" for i in range(args.folders)]))
+
+        baseline = None
+        for workers in args.workers:
+            backend.calls = backend.bytes = 0
+            reader, elapsed = crawl(backend, workers, args.rate, args.batch,
+                                    args.depth > 0)
+            result = dumps([reader.data, list(reader.exempt)])
+            baseline = baseline or result
+            folders = args.folders * sum(args.subfolders ** level
+                                         for level in range(args.depth + 1))
+            files = folders * args.files
+            print(f"workers={workers:<3} {elapsed:8.2f}s "
+                  f"{files / elapsed:10.0f} files/s "
+                  f"{backend.calls:6d} calls "
+                  f"{backend.bytes / files:6.1f} bytes/file "
+                  f"{reader.scheduler.retries:5d} retries "
+                  f"{reader.scheduler.throttled_seconds:6.2f}s throttled "
+                  f"{'identical' if result == baseline else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the local sources of file names, in names per second.
+
+The same names are written as a directory tree, a CSV file and a dump of
+one name per line. Every source is read on its own, then through the
+classifier and the aggregate, as `drivereader classify-local` does. The
+directory tree is scanned with each of `--workers`. Run with:
+
+    python benchmarks/bench_local.py --names 200000 --workers 1 4 8
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import chdir, makedirs
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from drivereader.classifier import FileClassifier
+from drivereader.pipeline import (Aggregate, classify, csv_pages,
+                                  directory_pages, name_pages, run)
+
+CODE_LIST = {
+    "RPIF": ["Research paper", "RESEARCH", ["3.3.1"]],
+    "JOUR": ["Journal", "PUBLICATION", ["3.4.1"]],
+}
+
+
+def prepare(names: int, folders: int, depth: int):
+    """Write the names as a tree, a CSV file and a dump of names."""
+    rows = []
+    for number in range(names):
+        code = ("RPIF", "JOUR", "misc")[number % 3]
+        folder = f"Folder {number % folders}"
+        parts = [f"Part {number // folders % 4}"] * (number % (depth + 1))
+        rows.append((folder, "/".join([folder, *parts]),
+                     f"20{15 + number % 9}0101_{code}_{number}.pdf"))
+    for _, directory, name in rows:
+        makedirs(f"archive/{directory}", exist_ok=True)
+        open(f"archive/{directory}/{name}", "w").close()
+    with open("names.csv", "w") as file:
+        file.write("folder,name\n")
+        # Rows of the same folder in a row make up a page.
+        file.writelines(f"{folder},{name}\n" for folder, _, name in sorted(
+            rows, key=lambda row: row[0]))
+    with open("names.txt", "w") as file:
+        file.writelines(f"{name}\n" for _, _, name in rows)
+
+
+def measure(pages):
+    """Read the pages, returning the names and seconds taken."""
+    start = perf_counter()
+    names = sum(len(page.files) for page in pages)
+    return names, perf_counter() - start
+
+
+def measure_classified(pages):
+    """Classify and count the pages, returning the names and seconds."""
+    start = perf_counter()
+    aggregate = Aggregate()
+    run(classify(pages, FileClassifier(CODE_LIST)), [aggregate])
+    names = aggregate.counts.total() + len(aggregate.exempt)
+    return names, perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--folders", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=2,
+                        help="levels of sub-directories in the tree")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        prepare(args.names, args.folders, args.depth)
+        sources = {
+            "csv": (lambda executor: csv_pages("names.csv"), 1),
+            "names": (lambda executor: name_pages("names.txt"), 1),
+        }
+        for workers in args.workers:
+            sources[f"scan workers={workers}"] = (
+                lambda executor: directory_pages("archive", executor),
+                workers)
+        for name, (pages, workers) in sources.items():
+            with ThreadPoolExecutor(workers) as executor:
+                executor = executor if workers > 1 else None
+                read = measure(pages(executor))
+                classified = measure_classified(pages(executor))
+            print(f"{name:<18} read {read[0] / read[1]:10.0f} names/s "
+                  f"classified {classified[0] / classified[1]:10.0f} "
+                  f"names/s")
+
+
+if __name__ == "__main__":
+    main()
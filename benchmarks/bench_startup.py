@@ -0,0 +1,72 @@
+"""
+Benchmark the cold start of the `drivereader` command.
+
+Every command is run in a fresh interpreter, as from a shell, and the best
+of `--repeat` runs is reported. The `eager imports` line loads what the
+module used to import up front, the Google client and auth libraries and
+openpyxl, for comparison. Run with:
+
+    python benchmarks/bench_startup.py --repeat 10
+"""
+
+from argparse import ArgumentParser
+from os import chdir, mkdir
+from subprocess import DEVNULL, run
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from openpyxl import Workbook
+
+EAGER_IMPORTS = ("import google.auth.transport.requests, "
+                 "google.oauth2.credentials, google_auth_oauthlib.flow, "
+                 "googleapiclient.discovery, openpyxl")
+COMMANDS = {
+    "eager imports": ["-c", EAGER_IMPORTS],
+    "--help": ["-m", "drivereader", "--help"],
+    "crawl --help": ["-m", "drivereader", "crawl", "--help"],
+    "classify-local": ["-m", "drivereader", "classify-local", "names.csv",
+                       "--headless", "--streaming"],
+    "report": ["-m", "drivereader", "report", "--headless", "--streaming"],
+}
+
+
+def prepare(names: int):
+    """Write a classification sheet and a CSV file of names."""
+    mkdir("data")
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = "NAAC Quantitative"
+    worksheet.append(["NAAC"])
+    worksheet.append(["Category", "Classification", "Code", "Name"])
+    worksheet.append(["RESEARCH", "3.3.1", "RPIF", "Research paper"])
+    worksheet.append(["PUBLICATION", "3.4.1", "JOUR", "Journal"])
+    workbook.save("data/doc_classification.xlsx")
+    with open("names.csv", "w") as file:
+        file.write("folder,name\n")
+        for number in range(names):
+            code = ("RPIF", "JOUR")[number % 2]
+            file.write(f"Folder,20{15 + number % 9}0101_{code}_{number}.pdf\n")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--names", type=int, default=1000,
+                        help="names in the CSV file classified offline")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        prepare(args.names)
+        for name, command in COMMANDS.items():
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = perf_counter()
+                run([executable, *command], stdout=DEVNULL, check=True)
+                best = min(best, perf_counter() - start)
+            print(f"{name:<16} {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
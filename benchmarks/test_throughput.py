@@ -0,0 +1,71 @@
+"""
+Throughput benchmarks of `DriveReader.categorize_files` on
+`FakeDriveBackend`, runnable with pytest:
+
+    python -m pytest benchmarks -s
+
+Each run reports the files classified per second and the number of API
+calls made. The 1M file run needs about a gigabyte of memory for the fake
+drive, so it only runs when `DRIVEREADER_BENCH_LARGE=1` is set.
+"""
+
+from json import dumps
+from os import environ
+from time import perf_counter
+
+import pytest
+
+from drivereader.drivereader import DriveReader
+from drivereader.fakedrive import FakeDriveBackend
+from drivereader.scheduler import RequestScheduler
+
+CODE_LIST = {
+    "RPIF": ["Research paper", "RESEARCH", ["3.3.1"]],
+    "CONF": ["Conference", "RESEARCH", ["3.3.2"]],
+    "JOUR": ["Journal", "PUBLICATION", ["3.4.1"]],
+}
+LARGE = pytest.mark.skipif(not environ.get("DRIVEREADER_BENCH_LARGE"),
+                           reason="set DRIVEREADER_BENCH_LARGE=1 to run")
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    return tmp_path / "data"
+
+
+@pytest.mark.parametrize("folders, files_per_folder", [
+    pytest.param(10, 100, id="1k"),
+    pytest.param(100, 1000, id="100k"),
+    pytest.param(200, 5000, id="1M", marks=LARGE),
+])
+@pytest.mark.parametrize("workers", [1, 8])
+def test_categorize_throughput(data_dir, capsys, record_property,
+                               folders, files_per_folder, workers):
+    backend = FakeDriveBackend.generate(folders, files_per_folder,
+                                        page_size=1000)
+    (data_dir / "folders.json").write_text(
+        dumps([f"Folder {i}" for i in range(folders)]))
+    # The fake drive has no quota, so the classification is not paced.
+    reader = DriveReader(backend_factory=backend.connect, workers=workers,
+                         folder_cache_ttl=0,
+                         scheduler=RequestScheduler(rate=1e6))
+    reader.code_list = CODE_LIST
+    reader.categories = ["RESEARCH", "PUBLICATION"]
+
+    start = perf_counter()
+    reader.categorize_files()
+    elapsed = perf_counter() - start
+
+    files = folders * files_per_folder
+    counted = sum(count for category in reader.data.values()
+                  for year in category.values() for count in year.values())
+    assert counted + len(reader.exempt) == files
+
+    record_property("files_per_second", files / elapsed)
+    record_property("api_calls", reader.api_calls)
+    with capsys.disabled():
+        print(f"\n{files:>9} files, {workers} workers: "
+              f"{files / elapsed:10.0f} files/s, "
+              f"{reader.api_calls} API calls")
@@ -0,0 +1,7 @@
+"""Run the `drivereader` command with `python -m drivereader`."""
+
+from sys import exit as sysexit
+
+from drivereader.cli import main
+
+sysexit(main())
@@ -0,0 +1,231 @@
+"""
+The drive backends that `DriveReader` talks to.
+
+`DriveBackend` lists the operations the project needs from a drive:
+listing and searching files with a query, reading file metadata, exporting
+a file and following the changes feed. `GoogleDriveBackend` implements them
+with the Google Drive v3 API, and `drivereader.fakedrive.FakeDriveBackend`
+with an in-process tree for tests and benchmarks.
+
+Only the errors of `googleapiclient` are imported up front. The rest of it,
+and of `google-auth`, is imported when a Google Drive backend is first
+built, so commands that work offline start quickly.
+"""
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from json import loads
+from re import escape, search
+from threading import Lock
+from typing import Any, BinaryIO, Optional, Union
+
+from googleapiclient.errors import HttpError
+
+# The most requests the drive accepts in one batch request.
+BATCH_LIMIT = 100
+
+
+def name_match(term: str, name: str):
+    """How a name matches a term of a `name contains` query.
+
+    Drive matches the term case-insensitively at the start of a word of the
+    name only, e.g. `Phys` matches `Physics Dept` but not `Astrophysics`.
+
+    Returns
+    -------
+    - rank`int`: 0 when the name is the term, 1 when a word of the name
+    starts with it, as drive matches, 2 when it is only somewhere inside a
+    word, or `None` when the name does not contain it.
+    """
+    term, name = term.casefold(), name.casefold()
+    if term == name:
+        return 0
+    if search(r"(?<![^\W_])" + escape(term), name):
+        return 1
+    if term in name:
+        return 2
+    return None
+
+
+class DriveBackend(ABC):
+    """The operations `DriveReader` needs from a drive.
+
+    Every method that makes a request to the drive adds one to `calls`, and
+    the size of the response bodies to `bytes`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        self.calls = 0
+        self.bytes = 0
+        self._calls_lock = Lock()
+
+    def count_call(self, number: int = 1):
+        """Record requests made to the drive."""
+        with self._calls_lock:
+            self.calls += number
+
+    def count_bytes(self, number: int):
+        """Record bytes received from the drive."""
+        with self._calls_lock:
+            self.bytes += number
+
+    @abstractmethod
+    def list_files(self, query: str, fields: Optional[str] = None,
+                   page_token: Optional[str] = None,
+                   page_size: Optional[int] = None) -> dict[str, Any]:
+        """Return one page of the files matching a drive query.
+
+        Searching for files and folders by name goes through this too.
+        The response has the `files` and, if there are more pages, the
+        `nextPageToken`.
+        """
+
+    def batch_list_files(self, requests: list[dict[str, Any]]
+                         ) -> list[Union[dict[str, Any], Exception]]:
+        """List the first pages of several queries in one request.
+
+        Each request holds the keyword arguments of `list_files`, and at most
+        `BATCH_LIMIT` can be sent together. The result has the response of
+        every request in order, or the error that request failed with.
+        Backends without batching list one query after the other.
+        """
+        results: list[Union[dict[str, Any], Exception]] = []
+        for request in requests:
+            try:
+                results.append(self.list_files(**request))
+            except HttpError as error:
+                results.append(error)
+        return results
+
+    @abstractmethod
+    def get_file(self, file_id: str,
+                 fields: Optional[str] = None) -> dict[str, Any]:
+        """Return the metadata of a file."""
+
+    @abstractmethod
+    def export_file(self, file_id: str, mime_type: str, file: BinaryIO,
+                    chunksize: int = 1024 * 1024) -> int:
+        """Export a file into `file` chunk by chunk, returning its size."""
+
+    @abstractmethod
+    def start_page_token(self) -> str:
+        """Return the token for the changes made from now on."""
+
+    @abstractmethod
+    def list_changes(self, page_token: str, fields: Optional[str] = None,
+                     page_size: Optional[int] = None) -> dict[str, Any]:
+        """Return one page of the changes feed.
+
+        The response has the `changes` and either the `nextPageToken` or,
+        on the last page, the `newStartPageToken`.
+        """
+
+
+@lru_cache(maxsize=None)
+def drive_document():
+    """The Drive v3 discovery document shipped with `googleapiclient`.
+
+    It is read and parsed once per process, instead of once per service.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+    return loads(get_static_doc("drive", "v3"))
+
+
+def drive_service(credentials=None, http=None):
+    """Build a Drive v3 service from the static discovery document.
+
+    The service makes its requests with the `credentials`, or through an
+    already authorized `http`.
+    """
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(drive_document(), credentials=credentials,
+                               http=http)
+
+
+class GoogleDriveBackend(DriveBackend):
+    """A backend on the Google Drive v3 API.
+
+    Parameters
+    ----------
+    - service: A drive service, e.g. from `drive_service`. The
+    service is not thread safe, so every thread needs its own backend.
+    """
+
+    def __init__(self, service) -> None:
+        """Initialize the class."""
+        super().__init__()
+        self.service = service
+
+    def measured(self, request):
+        """Count the bytes of the response body of a request."""
+        postproc = request.postproc
+
+        def count(response, content):
+            self.count_bytes(len(content))
+            return postproc(response, content)
+        request.postproc = count
+        return request
+
+    def list_request(self, query, fields=None, page_token=None,
+                     page_size=None):
+        """Build the request for one page of files."""
+        return self.measured(self.service.files().list(
+            q=query,
+            spaces="drive",
+            fields=fields,
+            pageToken=page_token,
+            pageSize=page_size
+        ))
+
+    def list_files(self, query, fields=None, page_token=None, page_size=None):
+        self.count_call()
+        return self.list_request(query, fields, page_token,
+                                 page_size).execute()
+
+    def batch_list_files(self, requests):
+        results: list[Union[dict[str, Any], Exception]] = [None] * len(
+            requests)
+
+        def callback(request_id, response, exception):
+            results[int(request_id)] = exception or response
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for number, request in enumerate(requests):
+            batch.add(self.list_request(**request), request_id=str(number))
+        self.count_call()
+        batch.execute()
+        return results
+
+    def get_file(self, file_id, fields=None):
+        self.count_call()
+        return self.measured(self.service.files().get(
+            fileId=file_id, fields=fields)).execute()
+
+    def export_file(self, file_id, mime_type, file, chunksize=1024 * 1024):
+        from googleapiclient.http import MediaIoBaseDownload
+        request = self.service.files().export_media(fileId=file_id,
+                                                    mimeType=mime_type)
+        downloader = MediaIoBaseDownload(file, request, chunksize=chunksize)
+        done = False
+        while done is False:
+            self.count_call()
+            status, done = downloader.next_chunk()
+        self.count_bytes(status.resumable_progress)
+        return status.resumable_progress
+
+    def start_page_token(self):
+        self.count_call()
+        response = self.measured(
+            self.service.changes().getStartPageToken()).execute()
+        return response.get("startPageToken")
+
+    def list_changes(self, page_token, fields=None, page_size=None):
+        self.count_call()
+        return self.measured(self.service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            includeRemoved=True,
+            fields=fields,
+            pageSize=page_size
+        )).execute()
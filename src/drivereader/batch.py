@@ -0,0 +1,195 @@
+"""
+Run `DriveReader` for several institutions at once.
+
+Every tenant has its own directory with its `credentials.json`,
+`token.json` and `data/` folder, and is run in a process of its own, so the
+runs are isolated and the batch takes about as long as its slowest share
+of tenants on the available cores. The tenants are read from a JSON list:
+
+    [
+        {"name": "college-a", "directory": "tenants/a", "workers": 8},
+        {"name": "college-b", "directory": "tenants/b", "incremental": true}
+    ]
+
+Besides `name` and `directory`, a tenant takes the options of
+`DriveReader` (`workers`, `folder_cache_ttl`, `index`, `batch`,
+`recursive`, `max_depth`, `frontier`, `rate`, `max_retries`,
+`checkpoint_interval`) and of `DriveReader.main` (`incremental`,
+`full_rebuild`, `streaming`, `from_csv`, `profile`, `resume`). `backend`
+names a factory of drive backends as `module:attribute`, called with the
+keyword arguments in `backend_options`, e.g. to run against a fake drive.
+A tenant whose token is missing, expired or revoked fails rather than
+waiting for a browser. The logs of a tenant are written to its `data/`
+folder. Run with:
+
+    drivereader batch tenants.json --processes 4
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from importlib import import_module
+from json import dumps, load
+from os import chdir, cpu_count, getcwd, makedirs, path
+from time import perf_counter
+from typing import Any, Optional
+
+from drivereader.cli import LOG_PATH, log_to
+from drivereader.drivereader import DriveReader, logger_monitor
+from drivereader.scheduler import RequestScheduler
+
+
+def load_tenants(config_path: str):
+    """Read the tenants of a batch, resolving their directories.
+
+    Relative directories are taken from the folder of the config file.
+    """
+    with open(config_path, "r") as file:
+        tenants: list[dict[str, Any]] = load(file)
+    base = path.dirname(path.abspath(config_path))
+    names = set()
+    for tenant in tenants:
+        if "name" not in tenant or "directory" not in tenant:
+            raise ValueError(f"Tenant {tenant} needs a name and a directory.")
+        if tenant["name"] in names:
+            raise ValueError(f"Tenant {tenant['name']} is listed twice.")
+        names.add(tenant["name"])
+        tenant["directory"] = path.join(base, tenant["directory"])
+    return tenants
+
+
+def backend_factory(spec: str, options: Optional[dict[str, Any]] = None):
+    """Import the backend factory named by `module:attribute`."""
+    module_name, _, attribute = spec.partition(":")
+    factory: Any = import_module(module_name)
+    for name in attribute.split("."):
+        factory = getattr(factory, name)
+    return partial(factory, **(options or {}))
+
+
+def run_tenant(tenant: dict[str, Any]):
+    """Run one tenant in its directory and time it.
+
+    Errors are caught and reported in the result, so that one tenant
+    failing does not stop the others.
+
+    Returns
+    -------
+    - result`dict[str, Any]`: The `name`, `status`, `error`, `seconds`,
+    `api_calls` and `files` counted for the tenant, and the seconds of the
+    `stages` of its run.
+    """
+    start = perf_counter()
+    result: dict[str, Any] = {"name": tenant["name"], "status": "ok",
+                              "error": None, "api_calls": 0, "files": 0,
+                              "stages": {}}
+    working_directory = getcwd()
+    try:
+        chdir(tenant["directory"])
+        makedirs("data", exist_ok=True)
+        # Keep the logs of the tenant with its reports.
+        with log_to(path.join(tenant["directory"], "data", LOG_PATH)):
+            try:
+                run_reader(tenant, result)
+            except Exception:
+                logger_monitor.exception("The run of the tenant failed.")
+                raise
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = f"{type(error).__name__}: {error}"
+    finally:
+        chdir(working_directory)
+        result["seconds"] = round(perf_counter() - start, 3)
+    return result
+
+
+def run_reader(tenant: dict[str, Any], result: dict[str, Any]):
+    """Run the reader of a tenant, in its directory, counting into `result`."""
+    factory = None
+    if tenant.get("backend"):
+        factory = backend_factory(tenant["backend"],
+                                  tenant.get("backend_options"))
+    # Authorizing opens a browser, which a batch cannot wait for.
+    reader = DriveReader(
+        backend_factory=factory,
+        workers=tenant.get("workers", 1),
+        folder_cache_ttl=tenant.get("folder_cache_ttl", 24 * 60 * 60),
+        index_path=tenant.get("index"),
+        scheduler=RequestScheduler(tenant.get("rate", 100.0),
+                                   max_retries=tenant.get("max_retries", 8)),
+        batch=tenant.get("batch", False),
+        recursive=tenant.get("recursive", False),
+        max_depth=tenant.get("max_depth"),
+        frontier_size=tenant.get("frontier", 1000),
+        checkpoint_interval=tenant.get("checkpoint_interval", 30.0),
+        interactive=False
+    )
+    reader.main(incremental=tenant.get("incremental", False),
+                full_rebuild=tenant.get("full_rebuild", False),
+                streaming=tenant.get("streaming", False),
+                source_csv=tenant.get("from_csv"),
+                headless=True,
+                profile_path=tenant.get("profile"),
+                resume=tenant.get("resume", False))
+    result["api_calls"] = reader.api_calls
+    result["stages"] = reader.profile.report()["stages"]
+    if reader.data is None:
+        raise FileNotFoundError("data/folders.json is missing.")
+    result["files"] = len(reader.exempt) + sum(
+        count for category in reader.data.values()
+        for year in category.values() for count in year.values())
+
+
+def run_batch(tenants: list[dict[str, Any]], processes: Optional[int] = None,
+              summary_path: Optional[str] = "batch_summary.json"):
+    """Run the tenants in a pool of processes.
+
+    Parameters
+    ----------
+    - tenants`list[dict[str, Any]]`: The tenants, see `load_tenants`.
+    - processes`int`: The number of tenants run at once, defaults to the
+    number of cores.
+    - summary_path`str`: Where to write the timing summary as JSON.
+
+    Returns
+    -------
+    - summary`dict[str, Any]`: The wall time of the batch, the summed time
+    of the tenants and the result of every tenant, in the given order.
+    """
+    processes = processes or cpu_count() or 1
+    started = datetime.now()
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=min(processes,
+                                             max(len(tenants), 1))) as pool:
+        results = list(pool.map(run_tenant, tenants))
+    summary = {
+        "started": started.isoformat(timespec="seconds"),
+        "processes": processes,
+        "seconds": round(perf_counter() - start, 3),
+        "tenant_seconds": round(sum(i["seconds"] for i in results), 3),
+        "failed": [i["name"] for i in results if i["status"] != "ok"],
+        "tenants": results
+    }
+    if summary_path:
+        with open(summary_path, "w") as file:
+            file.write(dumps(summary, indent=4))
+    return summary
+
+
+def print_summary(summary: dict[str, Any]):
+    """Print the result of every tenant and the time of the batch."""
+    for tenant in summary["tenants"]:
+        print(f"{tenant['name']:<24} {tenant['status']:<6} "
+              f"{tenant['seconds']:8.2f}s {tenant['files']:>9} files"
+              + (f"  {tenant['error']}" if tenant["error"] else ""))
+    print(f"{len(summary['tenants'])} tenants in {summary['seconds']:.2f}s "
+          f"on {summary['processes']} processes "
+          f"({summary['tenant_seconds']:.2f}s summed).")
+
+
+if __name__ == "__main__":
+    # The same as `drivereader batch`.
+    from sys import argv, exit as sysexit
+
+    from drivereader.cli import main as cli_main
+    sysexit(cli_main(["batch", *argv[1:]]))
@@ -0,0 +1,167 @@
+"""
+Classification of file names that follow the `YYYYMM_CODE_extra` naming
+convention.
+
+`FileClassifier.parse` reads a single name, while `FileClassifier.classify`
+takes a whole page (or any iterable) of names and counts them in one pass,
+and `FileClassifier.keys` classifies a page keeping the result per name.
+`FileClassifier.reason` tells why a name could not be classified.
+Every name is looked up by its date prefix and code in an interned table,
+so each distinct pair is only parsed once, and the totals are kept in a
+flat `Counter` that is turned into the nested report layout only at the
+end. At the page size of a listing, looking the names up one by one is
+faster than splitting the page with one pattern and counting its distinct
+pairs first, see `benchmarks/bench_classifier.py`.
+"""
+
+from collections import Counter
+from sys import intern
+from typing import Iterable, Optional, TypeVar
+
+Category = TypeVar("Category", bound=str)
+Code = TypeVar("Code", bound=str)
+Year = TypeVar("Year", bound=str)
+Key = tuple[Category, Year, Code]
+
+# Why a name could not be classified: it has no `DATE_CODE_` prefix, its
+# code is not in the classification sheet, or its date is not a year and a
+# month.
+BAD_SPLIT, UNKNOWN_CODE, BAD_DATE = "bad_split", "unknown_code", "bad_date"
+REASONS = (BAD_SPLIT, UNKNOWN_CODE, BAD_DATE)
+
+
+def academic_year(year: int, month: int):
+    """The academic year (June to May) that a month falls in."""
+    if month > 0 and month < 5:
+        return f"{year-1}-{year}"
+    return f"{year}-{year+1}"
+
+
+class FileClassifier():
+    """Classify file names against the codes of the classification sheet.
+
+    Parameters
+    ----------
+    - code_list`dict[Code, list]`: The codes read by `ExcelWorker`, each
+    mapped to its name, category and NAAC classifications.
+    """
+
+    def __init__(self, code_list: dict[Code, list]) -> None:
+        """Initialize the class."""
+        self.code_list = code_list
+        # (date prefix, code as written) -> (category, year, code). Only the
+        # pairs that classify are kept: they are bounded by the months and
+        # codes, while the names that do not classify can all differ.
+        self._keys: dict[tuple[str, str], Key] = {}
+
+    def _key(self, pair: tuple[str, str]):
+        """Classify a distinct (date prefix, code) pair, remembering it if
+        it classifies."""
+        try:
+            return self._keys[pair]
+        except KeyError:
+            key = self.parse(f"{pair[0]}_{pair[1]}_")
+            if key is not None:
+                key = self._keys[pair] = tuple(map(intern, key))
+            return key
+
+    def parse(self, name: str):
+        """Read the category, year and code out of a single file name.
+
+        Returns `None` when the name does not follow the naming structure.
+        """
+        try:
+            date, code, extra = name.split("_", 2)
+            code = code.upper()
+            if code not in self.code_list:
+                raise KeyError
+        except ValueError:
+            return None
+        except KeyError:
+            return None
+        else:
+            try:
+                year, month = int(date[:4]), int(date[4:6])
+            except ValueError:
+                return None
+            else:
+                return (self.code_list[code][1], academic_year(year, month),
+                        code)
+
+    def key(self, name: str):
+        """Like `parse`, but answered from the lookup table when it can."""
+        parts = name.split("_", 2)
+        if len(parts) < 3:
+            return None
+        return self._key((parts[0][:6], parts[1]))
+
+    def reason(self, name: str):
+        """Why a name could not be classified, one of `REASONS`, or `None`
+        when it can be."""
+        parts = name.split("_", 2)
+        if len(parts) < 3:
+            return BAD_SPLIT
+        pair = (parts[0][:6], parts[1])
+        if self._key(pair) is not None:
+            return None
+        if pair[1].upper() not in self.code_list:
+            return UNKNOWN_CODE
+        return BAD_DATE
+
+    def reasons(self, names: list[str], keys: list[Optional[Key]]):
+        """The reason of every name of `keys` that could not be classified,
+        or `None` for the ones that were."""
+        return [None if key is not None else self.reason(name)
+                for name, key in zip(names, keys)]
+
+    def keys(self, names: Iterable[str]):
+        """Classify many names, keeping the result of each.
+
+        Returns the category, year and code of every name in order, or
+        `None` for the names that could not be classified.
+        """
+        return list(map(self.key, names))
+
+    def classify(self, names: Iterable[str],
+                 counts: Optional[Counter] = None):
+        """Classify many names in one pass.
+
+        Parameters
+        ----------
+        - names`Iterable[str]`: The file names, e.g. one page of a listing.
+        - counts`Counter`: Counts to add to, a new one is made if omitted.
+
+        Returns
+        -------
+        - counts`Counter[tuple[Category, Year, Code]]`: The number of files
+        for every category, year and code.
+        - exempt`list[str]`: The names that could not be classified, in
+        the order given.
+        """
+        counts = Counter() if counts is None else counts
+        names = names if isinstance(names, list) else list(names)
+        keys = self.keys(names)
+        counts.update(filter(None, keys))
+        exempt = [name for name, key in zip(names, keys) if key is None]
+        return counts, exempt
+
+    @staticmethod
+    def nested(counts: Counter, categories: Iterable[Category] = ()):
+        """Turn flat counts into `{category: {year: {code: count}}}`.
+
+        The given categories come first, even if empty, then any other
+        category in the order first counted. Years are sorted newest first
+        and codes alphabetically.
+        """
+        data: dict[Category, dict[Year, dict[Code, int]]] = {
+            category: {} for category in categories}
+        for category, year, code in counts:
+            data.setdefault(category, {})
+        for (category, year, code), count in sorted(
+                counts.items(), key=lambda item: (item[0][1], item[0][2])):
+            if count > 0:
+                data[category].setdefault(year, {})[code] = count
+        for category, category_data in data.items():
+            data[category] = dict(sorted(category_data.items(),
+                                         reverse=True))
+        return data
@@ -0,0 +1,397 @@
+"""
+The `drivereader` command.
+
+    drivereader crawl --workers 8 --incremental
+    drivereader report
+    drivereader classify-local names.csv
+    drivereader classify-local archive/ --workers 8
+    drivereader crawl --shard 0/4
+    drivereader merge data/partial-*.json
+    drivereader serve --interval 300 --port 8765
+    drivereader batch tenants.json --processes 4
+
+`crawl` reads the folders in `data/folders.json` on drive and writes the
+reports. `report` writes the reports again from the `data/data.json` and
+`data/exempt.jsonl` of the last crawl. `classify-local` classifies the file
+names in a CSV file, a dump of one name per line or a directory tree with
+the classification sheet already in `data/`, without connecting to drive.
+`crawl --shard` crawls part of the folders and writes a partial, and
+`merge` writes the reports from the partials of all the shards, see
+`drivereader.shards`. `serve` keeps the reports fresh from the changes on
+drive and serves the counts as JSON, see `drivereader.daemon`. `batch`
+runs a crawl for every tenant of a config file, see `drivereader.batch`.
+
+The modules a command needs are imported when it runs, so `--help` and the
+offline commands do not load the Google client libraries.
+"""
+
+import logging
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from sys import exit as sysexit
+from typing import Optional, Sequence
+
+LOG_PATH = "drive_reader_logs.log"
+
+
+@contextmanager
+def log_to(filename: Optional[str]):
+    """Write the logs of the package to `filename` within the block.
+
+    The file is only opened once something is logged, and nothing is
+    written when `filename` is empty.
+    """
+    if not filename:
+        yield
+        return
+    handler = logging.FileHandler(filename, delay=True)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
+    logger = logging.getLogger("drivereader")
+    logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def connect(args: Namespace, **options):
+    """A reader with the crawl options, or `None` without credentials."""
+    from drivereader.drivereader import DriveReader
+    from drivereader.scheduler import RequestScheduler
+
+    reader = DriveReader(workers=args.workers,
+                         folder_cache_ttl=args.folder_cache_ttl,
+                         index_path=args.index,
+                         scheduler=RequestScheduler(
+                             args.rate, max_retries=args.max_retries),
+                         batch=args.batch,
+                         recursive=args.recursive,
+                         max_depth=args.max_depth,
+                         frontier_size=args.frontier,
+                         checkpoint_interval=args.checkpoint_interval,
+                         **options)
+    if not (reader.creds and reader.creds.valid):
+        print("Could not run the program due to invalid credentials.")
+        print("Fix credentials and try again.")
+        return None
+    return reader
+
+
+def crawl(args: Namespace):
+    """Categorize the files in drive and write the reports."""
+    from drivereader.shards import select_shard
+
+    if args.shard is not None:
+        try:
+            select_shard([], args.shard)
+        except ValueError as error:
+            print(error)
+            return 1
+    reader = connect(args, shard=args.shard, partial_path=args.partial)
+    if reader is None:
+        return 1
+    reader.main(args.incremental, args.full_rebuild, args.streaming,
+                args.from_csv, args.headless, args.profile, args.cprofile,
+                args.resume)
+    return 0
+
+
+def serve(args: Namespace):
+    """Keep the reports fresh and serve the counts until interrupted."""
+    from drivereader.daemon import ReportDaemon
+
+    reader = connect(args)
+    if reader is None:
+        return 1
+    ReportDaemon(reader, args.interval, args.streaming,
+                 args.headless).run(args.host, args.port)
+    return 0
+
+
+def report(args: Namespace):
+    """Write the reports again from the counts of the last crawl."""
+    from json import load
+
+    from drivereader.drivereader import ExcelWorker
+    from drivereader.exempt import EXEMPT_PATH, ExemptLog
+    from drivereader.index import FileIndex
+
+    try:
+        with open("data/data.json", "r") as file:
+            data = load(file)
+        exempt = ExemptLog.read(EXEMPT_PATH)
+    except FileNotFoundError as error:
+        print(f"{error.filename} is missing, run `drivereader crawl` first.")
+        return 1
+    worker = ExcelWorker(args.streaming, headless=args.headless)
+    index = None
+    if args.index:
+        index = FileIndex(args.index)
+        index.set_code_list(worker.code_list)
+    worker.write_data_to_excel(data, exempt)
+    worker.write_naac_data_to_excel(data, index)
+    return 0
+
+
+def classify_local(args: Namespace):
+    """Classify the names in a local source and write the reports."""
+    from concurrent.futures import ThreadPoolExecutor
+    from os import path
+
+    from drivereader.classifier import FileClassifier
+    from drivereader.drivereader import ExcelWorker
+    from drivereader.pipeline import (Aggregate, classify, csv_pages,
+                                      directory_pages, name_pages, run)
+    from drivereader.profiler import RunProfile
+
+    profile = RunProfile()
+    with profile.stage("classification"):
+        worker = ExcelWorker(args.streaming, headless=args.headless)
+    aggregate = Aggregate()
+    with ThreadPoolExecutor(args.workers) as executor, \
+            profile.stage("crawl"):
+        if path.isdir(args.source):
+            pages = directory_pages(
+                args.source, executor if args.workers > 1 else None)
+        elif args.source.lower().endswith(".csv"):
+            pages = csv_pages(args.source)
+        else:
+            pages = name_pages(args.source)
+        run(classify(pages, FileClassifier(worker.code_list), profile),
+            [aggregate], profile)
+    files = aggregate.counts.total() + len(aggregate.exempt)
+    profile.count("files", files)
+    data = aggregate.emit(worker.classification_list.values())
+    worker.write_reports(data, aggregate.exempt, profile=profile,
+                         counts=aggregate.counts)
+    summary = profile.report()
+    print(f"Classified {files} names, {len(aggregate.exempt)} exempted, "
+          f"at {summary['files_per_second'] or 0:.0f} names/s.")
+    if args.profile:
+        RunProfile.save(summary, args.profile)
+    return 0
+
+
+def merge(args: Namespace):
+    """Merge the partials of shards and write the reports, or a partial."""
+    from json import dumps
+
+    from drivereader.counts import CountStore
+    from drivereader.drivereader import ExcelWorker, write_atomically
+    from drivereader.exempt import EXEMPT_PATH
+    from drivereader.shards import (exempt_log_path, load_partial,
+                                    merge_partials)
+
+    try:
+        merged, exempt = merge_partials(
+            (load_partial(filename) for filename in args.partials),
+            exempt_log_path(args.output) if args.output else EXEMPT_PATH)
+    except (OSError, ValueError) as error:
+        print(f"Could not merge the partials: {error}")
+        return 1
+    crawled = set(merged["folders"])
+    missing = [name for name in merged["folderNames"]
+               if name not in crawled]
+    if missing:
+        print("No partial has the folders: " + ", ".join(missing))
+    if merged["failedFolders"]:
+        print("Incomplete listings, the counts are too low for: "
+              + ", ".join(merged["failedFolders"]))
+    if args.output:
+        write_atomically(dumps(merged), args.output)
+        return 0
+    worker = ExcelWorker(args.streaming, headless=args.headless)
+    counts = CountStore.load(merged["counts"])
+    worker.write_reports(counts.nested(worker.classification_list.values()),
+                         exempt, counts=counts)
+    return 0
+
+
+def batch(args: Namespace):
+    """Crawl drive for every tenant of a batch."""
+    from drivereader.batch import load_tenants, print_summary, run_batch
+
+    try:
+        tenants = load_tenants(args.config)
+    except (OSError, ValueError) as error:
+        print(f"Could not read the tenants: {error}")
+        return 1
+    summary = run_batch(tenants, args.processes, args.summary)
+    print_summary(summary)
+    return 1 if summary["failed"] else 0
+
+
+def crawl_options(parser: ArgumentParser):
+    """Add the options of how drive is crawled."""
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of folders listed concurrently")
+    parser.add_argument("--folder-cache-ttl", type=float, default=24*60*60,
+                        help="seconds to reuse resolved folder ids, 0 to "
+                             "disable the cache")
+    parser.add_argument("--index", nargs="?", const="data/index.sqlite3",
+                        help="keep a SQLite index of the crawled files and "
+                             "build the reports from it")
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="requests per second allowed by the quota")
+    parser.add_argument("--max-retries", type=int, default=8,
+                        help="retries of a rate limited or failed request")
+    parser.add_argument("--batch", action="store_true",
+                        help="list the first page of the folders with batch "
+                             "requests")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also count the files in sub-folders")
+    parser.add_argument("--max-depth", type=int,
+                        help="levels of sub-folders to crawl with "
+                             "--recursive")
+    parser.add_argument("--frontier", type=int, default=1000,
+                        help="most folders listed at once with --recursive, "
+                             "whole levels are still kept in memory")
+    parser.add_argument("--checkpoint-interval", type=float, default=30.0,
+                        metavar="SECONDS",
+                        help="seconds between saves of the progress of a "
+                             "crawl, 0 to not save it")
+
+
+def report_options(parser: ArgumentParser):
+    """Add the options of the report writers."""
+    parser.add_argument("--streaming", action="store_true",
+                        help="write the reports with write-only workbooks")
+    parser.add_argument("--headless", action="store_const", const=True,
+                        help="save the reports atomically without closing or "
+                             "opening Excel, the default except on Windows")
+
+
+def parser():
+    """The parser of the `drivereader` command and its subcommands."""
+    command = ArgumentParser(
+        prog="drivereader",
+        description="Categorize the files in drive for NAAC reports.")
+    command.add_argument("--log", default=LOG_PATH, metavar="PATH",
+                         help="where to write the logs, default "
+                              f"{LOG_PATH}, none when empty")
+    commands = command.add_subparsers(title="commands", required=True,
+                                      metavar="COMMAND")
+
+    crawl_parser = commands.add_parser(
+        "crawl", help="categorize the files in drive and write the reports",
+        description="Categorize the files in drive.")
+    crawl_parser.set_defaults(command=crawl)
+    crawl_options(crawl_parser)
+    report_options(crawl_parser)
+    crawl_parser.add_argument("--incremental", action="store_true",
+                              help="only apply the changes since the last "
+                                   "run")
+    crawl_parser.add_argument("--full-rebuild", action="store_true",
+                              help="crawl every folder, even with "
+                                   "--incremental")
+    crawl_parser.add_argument("--from-csv", metavar="PATH",
+                              help="classify the names in a CSV file with "
+                                   "`name` and `folder` columns instead of "
+                                   "drive")
+    crawl_parser.add_argument("--resume", action="store_true",
+                              help="go on from where an interrupted crawl "
+                                   "stopped")
+    crawl_parser.add_argument("--shard", metavar="INDEX/COUNT|START:STOP",
+                              help="crawl the folders hashed to one of COUNT "
+                                   "shards, or a range of folders.json, and "
+                                   "write a partial for `drivereader merge`")
+    crawl_parser.add_argument("--partial", metavar="PATH",
+                              help="where to write the partial of --shard, "
+                                   "data/partial-<shard>.json by default")
+    crawl_parser.add_argument("--profile", nargs="?",
+                              const="data/profile.jsonl", metavar="PATH",
+                              help="append the timings and counters of the "
+                                   "run to a JSON lines log")
+    crawl_parser.add_argument("--cprofile", metavar="PATH",
+                              help="dump a cProfile of the run, read it with "
+                                   "`python -m pstats PATH`")
+
+    serve_parser = commands.add_parser(
+        "serve", help="keep the reports fresh and serve the counts",
+        description="Crawl drive, then apply the changes on drive every "
+                    "interval, writing only the report sheets that changed, "
+                    "and serve the counts as JSON on /counts, /naac, "
+                    "/exempt and /status.")
+    serve_parser.set_defaults(command=serve)
+    crawl_options(serve_parser)
+    report_options(serve_parser)
+    serve_parser.add_argument("--interval", type=float, default=300.0,
+                              metavar="SECONDS",
+                              help="seconds between two checks for changes")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+                              help="the address to serve the counts on")
+    serve_parser.add_argument("--port", type=int, default=8765,
+                              help="the port to serve the counts on")
+
+    report_parser = commands.add_parser(
+        "report", help="write the reports again from the last crawl",
+        description="Write the reports from data/data.json and "
+                    "data/exempt.jsonl.")
+    report_parser.set_defaults(command=report)
+    report_parser.add_argument("--index", metavar="PATH",
+                               help="build the NAAC report from this index")
+    report_options(report_parser)
+
+    local_parser = commands.add_parser(
+        "classify-local", help="classify the names in local files, offline",
+        description="Classify the file names in a local source, using the "
+                    "classification sheet in data/. The source is a CSV file "
+                    "with `name` and, optionally, `folder` columns, a file "
+                    "with one name per line, or a directory whose "
+                    "sub-directories stand for the folders in drive.")
+    local_parser.set_defaults(command=classify_local)
+    local_parser.add_argument("source",
+                              help="a .csv file, a file of names or a "
+                                   "directory")
+    local_parser.add_argument("--workers", type=int, default=1,
+                              help="number of directories scanned "
+                                   "concurrently")
+    local_parser.add_argument("--profile", nargs="?",
+                              const="data/profile.jsonl", metavar="PATH",
+                              help="append the timings of the run to a JSON "
+                                   "lines log")
+    report_options(local_parser)
+
+    merge_parser = commands.add_parser(
+        "merge", help="write the reports from the partials of shards",
+        description="Merge the partials written by `crawl --shard` and "
+                    "write the reports, using the classification sheet in "
+                    "data/.")
+    merge_parser.set_defaults(command=merge)
+    merge_parser.add_argument("partials", nargs="+", metavar="PARTIAL",
+                              help="the partials to merge")
+    merge_parser.add_argument("--output", metavar="PATH",
+                              help="write the merged partial to PATH, to "
+                                   "merge again later, instead of the "
+                                   "reports")
+    report_options(merge_parser)
+
+    batch_parser = commands.add_parser(
+        "batch", help="crawl drive for several tenants at once",
+        description="Run a crawl for every tenant of a JSON list, each in "
+                    "its own directory and process.")
+    batch_parser.set_defaults(command=batch)
+    batch_parser.add_argument("config", help="JSON list of tenants")
+    batch_parser.add_argument("--processes", type=int,
+                              help="tenants run at once, defaults to the "
+                                   "cores")
+    batch_parser.add_argument("--summary", default="batch_summary.json",
+                              help="where to write the timing summary")
+    return command
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """Run the `drivereader` command, returning its exit status."""
+    args = parser().parse_args(argv)
+    try:
+        with log_to(args.log):
+            return args.command(args)
+    except KeyboardInterrupt:
+        print("\n\nExiting program by interrupt.")
+        return 130
+
+
+if __name__ == "__main__":
+    sysexit(main())
@@ -0,0 +1,173 @@
+"""
+Compact counts of the classified files.
+
+`CountStore` interns every category, year and code into an integer id and
+keeps the counts of each year in one `array` of machine integers, indexed
+by the (category, code) cell. Counting a key already seen is a dictionary
+lookup and an array increment, and counts made apart, e.g. by parallel
+workers or shards, are added together with `merge`. The nested layout of
+`data/data.json` is made only on export by `nested`, and the NAAC rollup
+is summed straight from the arrays by `rollup`.
+"""
+
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from typing import Iterable, Union
+
+from drivereader.classifier import Category, Code, Key, Year
+
+# The type of the counts, signed 64 bit integers.
+TYPECODE = "q"
+
+
+class CountStore():
+    """The number of files of every category, year and code."""
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        # The interned names, in the order first counted, and their ids.
+        self.categories: list[Category] = []
+        self.years: list[Year] = []
+        self.codes: list[Code] = []
+        self._category_ids: dict[Category, int] = {}
+        self._year_ids: dict[Year, int] = {}
+        self._code_ids: dict[Code, int] = {}
+        # The category and code id of every cell, and the cell of each pair.
+        self.cells: list[tuple[int, int]] = []
+        self._cells: dict[tuple[int, int], int] = {}
+        # The counts of every year, one array indexed by cell.
+        self.counts: list[array] = []
+        # The array and cell of every key seen, so it is interned once.
+        self._slots: dict[Key, tuple[array, int]] = {}
+
+    @staticmethod
+    def _intern(ids: dict[str, int], names: list[str], name: str):
+        number = ids.get(name)
+        if number is None:
+            number = ids[name] = len(names)
+            names.append(name)
+        return number
+
+    def _slot(self, key: Key):
+        """Intern a key, adding a cell or a year as needed."""
+        category, year, code = key
+        pair = (self._intern(self._category_ids, self.categories, category),
+                self._intern(self._code_ids, self.codes, code))
+        cell = self._cells.get(pair)
+        if cell is None:
+            cell = self._cells[pair] = len(self.cells)
+            self.cells.append(pair)
+            for counts in self.counts:
+                counts.append(0)
+        year_id = self._intern(self._year_ids, self.years, year)
+        if year_id == len(self.counts):
+            self.counts.append(array(TYPECODE, bytes(
+                array(TYPECODE).itemsize * len(self.cells))))
+        slot = self._slots[key] = (self.counts[year_id], cell)
+        return slot
+
+    def add(self, key: Key, count: int = 1):
+        """Add `count` files to a category, year and code."""
+        counts, cell = self._slots.get(key) or self._slot(key)
+        counts[cell] += count
+
+    def update(self, keys: Union[Mapping[Key, int], Iterable[Key]]):
+        """Add counts, given by key like a `Counter`, or one per key."""
+        if not isinstance(keys, Mapping):
+            keys = Counter(keys)
+        slots = self._slots
+        for key, count in keys.items():
+            counts, cell = slots.get(key) or self._slot(key)
+            counts[cell] += count
+
+    def merge(self, other: "CountStore"):
+        """Add the counts of another store to this one, and return it.
+
+        Merging is associative and commutative, so partial counts can be
+        merged in any grouping and order.
+        """
+        self.update(dict(other.items()))
+        return self
+
+    def items(self):
+        """Every key with a count, and the count."""
+        categories, years, codes = self.categories, self.years, self.codes
+        for year, counts in zip(years, self.counts):
+            for (category, code), count in zip(self.cells, counts):
+                if count:
+                    yield (categories[category], year, codes[code]), count
+
+    def values(self):
+        """The counts of every key with a count."""
+        return (count for _, count in self.items())
+
+    def total(self):
+        """The number of files counted."""
+        return sum(sum(counts) for counts in self.counts)
+
+    def dump(self):
+        """The counts as `[category, year, code, count]` rows for JSON."""
+        return [[*key, count] for key, count in self.items()]
+
+    @classmethod
+    def load(cls, rows: Iterable[list]):
+        """A store with the counts of `dump`."""
+        store = cls()
+        for *key, count in rows:
+            store.add(tuple(key), count)
+        return store
+
+    def _years_newest_first(self):
+        return sorted(range(len(self.years)), key=self.years.__getitem__,
+                      reverse=True)
+
+    def nested(self, categories: Iterable[Category] = ()):
+        """The counts as `{category: {year: {code: count}}}`.
+
+        The same layout and order as `FileClassifier.nested`: the given
+        categories first, even if empty, then any other in the order first
+        counted, years newest first and codes alphabetically.
+        """
+        data: dict[Category, dict[Year, dict[Code, int]]] = {
+            category: {} for category in categories}
+        for category in self.categories:
+            data.setdefault(category, {})
+        cells = sorted(range(len(self.cells)),
+                       key=lambda cell: self.codes[self.cells[cell][1]])
+        for year_id in self._years_newest_first():
+            year, counts = self.years[year_id], self.counts[year_id]
+            for cell in cells:
+                count = counts[cell]
+                if count > 0:
+                    category, code = self.cells[cell]
+                    data[self.categories[category]].setdefault(
+                        year, {})[self.codes[code]] = count
+        return data
+
+    def rollup(self, classification_index: Mapping[Code, Iterable[str]]):
+        """The counts of every year under each NAAC classification.
+
+        Parameters
+        ----------
+        - classification_index`dict[Code, tuple[Classification, ...]]`: The
+        classifications every code counts towards.
+
+        Returns
+        -------
+        - rollup`dict[Year, dict[Classification, int]]`: The counts for
+        every year with classified files, newest first, as
+        `ExcelWorker.naac_rollup` makes them from the nested counts.
+        """
+        specs = [tuple(classification_index.get(self.codes[code], ()))
+                 for _, code in self.cells]
+        rollup: dict[Year, dict[str, int]] = {}
+        for year_id in self._years_newest_first():
+            spec_data: dict[str, int] = {}
+            for cell_specs, count in zip(specs, self.counts[year_id]):
+                if count > 0:
+                    for spec in cell_specs:
+                        spec_data[spec] = spec_data.get(spec, 0) + count
+            if spec_data:
+                rollup[self.years[year_id]] = spec_data
+        return rollup
@@ -0,0 +1,295 @@
+"""
+Reports kept fresh by a long running process.
+
+    drivereader serve --interval 300 --port 8765
+
+A `ReportDaemon` keeps the drive session of its `DriveReader`, the parsed
+classification sheet, the state of the crawl and the counts in memory.
+Every `interval` seconds it checks the sheet for a new version, applies the
+changes feed to the state it holds, and writes again only the report sheets
+whose contents changed. A refresh with no changes in the crawled folders
+writes nothing. The counts are served as JSON on a local port:
+
+- `/counts`: the counts of every category, year and code.
+- `/naac`: the counts of every year under each NAAC classification.
+- `/exempt`: the summary of the files that were not classified, see
+  `ExemptLog.summary`. Every file is in `data/exempt.jsonl`.
+- `/status`: when the counts were last refreshed, and what it wrote.
+
+The responses are serialized once per refresh, so answering a request only
+copies bytes.
+"""
+
+from datetime import datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Event, Thread
+from time import perf_counter
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+from drivereader.drivereader import (CLASSIFICATION_SHEET_ID, DriveReader,
+                                     ExcelWorker, logger_monitor,
+                                     write_atomically)
+from drivereader.exempt import EXEMPT_PATH, ExemptLog
+
+ENDPOINTS = ("/counts", "/naac", "/exempt", "/status")
+CATEGORIZED_PATH = "data/categorized.xlsx"
+NAAC_PATH = "data/naac.xlsx"
+
+
+def changed_sheets(before: Optional[dict[str, Any]],
+                   after: dict[str, Any]):
+    """The titles of the sheets whose contents changed.
+
+    Returns `None` when the report has to be written whole, because it was
+    not written before or sheets were added, removed or reordered.
+    """
+    if before is None or list(before) != list(after):
+        return None
+    return [title for title, contents in after.items()
+            if before[title] != contents]
+
+
+class CountsHandler(BaseHTTPRequestHandler):
+    """Answer with the responses of the daemon of the server."""
+
+    def do_GET(self):
+        endpoint = urlsplit(self.path).path.rstrip("/")
+        body = self.server.reports.responses.get(endpoint)
+        status = 200
+        if body is None and endpoint in ENDPOINTS:
+            status, body = 503, dumps(
+                {"error": "The counts are not ready yet."}).encode()
+        elif body is None:
+            status, body = 404, dumps(
+                {"error": f"No such endpoint, try {', '.join(ENDPOINTS)}."}
+            ).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        logger_monitor.debug(format % args)
+
+
+class ReportDaemon():
+    """Refresh the reports of a reader on an interval, and serve them.
+
+    Parameters
+    ----------
+    - reader`DriveReader`: Crawls drive, and keeps the session and state.
+    - interval`float`: Seconds between two refreshes.
+    - streaming`bool`: Write the reports with write-only workbooks. These
+    are not kept, so a report with a changed sheet is written whole.
+    Otherwise the workbooks are kept in memory between refreshes, and only
+    their changed sheets are written again before they are saved.
+    - headless`bool`: Save the reports without opening Excel, see
+    `ExcelWorker`. Defaults to headless everywhere but Windows.
+    - sheet_id`str`: The drive id of the classification sheet.
+    """
+
+    def __init__(self, reader: DriveReader, interval: float = 300.0,
+                 streaming: bool = False, headless: Optional[bool] = None,
+                 sheet_id: str = CLASSIFICATION_SHEET_ID) -> None:
+        """Initialize the class."""
+        self.reader = reader
+        self.interval = interval
+        self.streaming = streaming
+        self.headless = headless
+        self.sheet_id = sheet_id
+        self.worker: Optional[ExcelWorker] = None
+        # The version of the sheet `worker` was read from.
+        self.fingerprint: Optional[str] = None
+        # The counts and exempted files of the last refresh.
+        self.data: Optional[dict[str, Any]] = None
+        self.exempt: Optional[ExemptLog] = None
+        # The contents of every sheet last written, and the workbook they
+        # are in, by report.
+        self.written: dict[str, Optional[dict[str, Any]]] = {
+            CATEGORIZED_PATH: None, NAAC_PATH: None}
+        self.workbooks: dict[str, Any] = {}
+        self.status: dict[str, Any] = {
+            "refreshes": 0,
+            "changes": 0,
+            "sheetsWritten": 0,
+            "reportsWritten": 0,
+            "refreshed": None,
+            "seconds": None,
+            "files": None,
+            "error": None
+        }
+        # The body of every endpoint, replaced whole on every refresh.
+        self.responses: dict[str, bytes] = {
+            "/status": dumps(self.status).encode()}
+        self.server: Optional[ThreadingHTTPServer] = None
+        self._stop = Event()
+
+    def refresh(self):
+        """Bring the counts and the reports up to date, once.
+
+        Returns
+        -------
+        - written`int`: The number of report sheets written.
+        """
+        start = perf_counter()
+        reader = self.reader
+        with reader.profile.stage("download_sheet"):
+            reader.download_sheet(self.sheet_id)
+        sheet_changed = self.worker is None or (
+            reader.sheet_fingerprint is not None
+            and reader.sheet_fingerprint != self.fingerprint)
+        if sheet_changed:
+            with reader.profile.stage("classification"):
+                self.worker = ExcelWorker(self.streaming,
+                                          reader.sheet_fingerprint,
+                                          self.headless)
+            reader.code_list = self.worker.code_list
+            reader.categories = self.worker.classification_list.values()
+            # The names of the codes in the reports may have changed too.
+            self.written = dict.fromkeys(self.written)
+            self.workbooks = {}
+
+        if sheet_changed or reader.state is None or reader.counts is None:
+            # A new sheet classifies every file again.
+            reader.categorize_files(
+                incremental=True,
+                full_rebuild=sheet_changed and self.fingerprint is not None)
+            changes = None
+        else:
+            with reader.profile.stage("changes"):
+                changes = reader.apply_changes(reader.state)
+            if changes:
+                reader.save_state(reader.state)
+        self.fingerprint = reader.sheet_fingerprint
+        if reader.data is None:
+            raise RuntimeError("No folders to crawl in data/folders.json.")
+
+        if changes == 0:
+            data, exempt = self.data, self.exempt
+        else:
+            data, exempt = reader.data, reader.exempt
+            if reader.index is not None:
+                with reader.profile.stage("index_rollup"):
+                    reader.index.set_code_list(reader.code_list)
+                    data = reader.index.category_counts(reader.categories)
+        self.data, self.exempt = data, exempt
+        written = self.write_reports(data, exempt)
+
+        self.status.update({
+            "refreshes": self.status["refreshes"] + 1,
+            "changes": self.status["changes"] + (changes or 0),
+            "sheetsWritten": self.status["sheetsWritten"] + written,
+            "refreshed": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(perf_counter() - start, 4),
+            "files": reader.counts.total() + len(reader.exempt),
+            "error": None
+        })
+        self.responses = {
+            "/counts": dumps(data).encode(),
+            "/naac": dumps(self.written[NAAC_PATH]).encode(),
+            "/exempt": dumps(self.written[CATEGORIZED_PATH]["exempted"]
+                             ).encode(),
+            "/status": dumps(self.status).encode()
+        }
+        return written
+
+    def write_reports(self, data: dict[str, Any], exempt: ExemptLog):
+        """Write the sheets whose contents changed since the last refresh.
+
+        Returns
+        -------
+        - written`int`: The number of sheets written.
+        """
+        worker, reader = self.worker, self.reader
+        categorized = {**data, "exempted": exempt.summary()}
+        naac = worker.naac_years(data, reader.index, reader.counts)
+        before = self.written[CATEGORIZED_PATH]
+        if before is None or before != categorized:
+            write_atomically(dumps(data, indent=4), "data/data.json")
+            exempt.save(EXEMPT_PATH)
+
+        written = 0
+        for filename, sheets in ((CATEGORIZED_PATH, categorized),
+                                 (NAAC_PATH, naac)):
+            changed = changed_sheets(self.written[filename], sheets)
+            if changed == []:
+                continue
+            if filename == CATEGORIZED_PATH:
+                writers = {title: partial(worker.write_exempt_sheet,
+                                          exempted=exempt)
+                           if title == "exempted" else
+                           partial(worker.write_category_sheet,
+                                   category_data=data[title])
+                           for title in changed or ()}
+            else:
+                writers = {title: partial(worker.write_naac_sheet,
+                                          spec_data=naac[title])
+                           for title in changed or ()}
+            workbook = self.workbooks.get(filename)
+            if changed is not None and workbook is not None:
+                worker.replace_sheets(workbook, filename, writers)
+            else:
+                if filename == CATEGORIZED_PATH:
+                    workbook = worker.write_data_to_excel(data, exempt)
+                else:
+                    workbook = worker.write_naac_data_to_excel(
+                        data, reader.index, reader.counts)
+                self.workbooks[filename] = workbook
+                changed = list(sheets)
+            self.written[filename] = sheets
+            self.status["reportsWritten"] += 1
+            written += len(changed)
+        return written
+
+    def start_server(self, host: str = "127.0.0.1", port: int = 8765):
+        """Serve the counts from a background thread.
+
+        Returns
+        -------
+        - address`tuple[str, int]`: The host and port served on.
+        """
+        self.server = ThreadingHTTPServer((host, port), CountsHandler)
+        self.server.daemon_threads = True
+        self.server.reports = self
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def close(self):
+        """Stop serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stop(self):
+        """Make `run` return after the refresh in progress, if any."""
+        self._stop.set()
+
+    def run(self, host: str = "127.0.0.1", port: int = 8765):
+        """Serve the counts and refresh them until stopped.
+
+        A refresh that fails is reported in `/status` and tried again at
+        the next interval, while the last counts are still served.
+        """
+        address = self.start_server(host, port)
+        print(f"Serving the counts on http://{address[0]}:{address[1]}, "
+              f"refreshed every {self.interval:g} seconds.")
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception as error:
+                    print(f"An error occurred: {error}")
+                    logger_monitor.exception("Refresh failed.")
+                    self.status["error"] = str(error)
+                    self.responses = dict(
+                        self.responses,
+                        **{"/status": dumps(self.status).encode()})
+                self._stop.wait(self.interval)
+        finally:
+            self.close()
@@ -14,40 +14,64 @@ from __future__ import print_function
 
 # Import in-built modules.
 import logging
-from io import BytesIO
+from cProfile import Profile
+from hashlib import md5
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import chain
 from json import dumps, load
-from os import path, system as ossystem, remove
-from pprint import PrettyPrinter
-from sys import exit as sysexit
-from typing import Optional, TypeVar
-
-# Import project specific modules.
-from google.auth.transport.requests import Request
-from google.auth.exceptions import RefreshError
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from os import (chmod, fdopen, fsync, path, replace, system as ossystem,
+                remove, umask)
+from sys import argv, exit as sysexit, platform
+from tempfile import mkstemp
+from threading import Lock, local
+from time import time
+from typing import Any, Callable, Generator, Iterable, Optional, TypeVar
+
+# Import project specific modules. The google-auth and oauthlib modules
+# are imported when connecting, so offline commands do not load them.
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
 from openpyxl import load_workbook
-from openpyxl.styles import Alignment, Font
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
 from openpyxl.utils import get_column_letter as get_col_let
 from openpyxl.workbook.workbook import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 
+from drivereader.backend import (BATCH_LIMIT, DriveBackend, GoogleDriveBackend,
+                                 drive_service, name_match)
+from drivereader.classifier import FileClassifier, academic_year
+from drivereader.counts import CountStore
+from drivereader.exempt import EXEMPT_PATH, ExemptLog, summary_rows
+from drivereader.index import FileIndex
+from drivereader.pipeline import (Aggregate, Checkpoint, IndexWriter, Page,
+                                  StateRecorder, classify, csv_pages, ordered,
+                                  run)
+from drivereader.profiler import RunProfile, timed
+from drivereader.scheduler import RequestScheduler
+from drivereader.shards import (default_partial_path, exempt_log_path,
+                                make_partial, select_shard)
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
     "https://www.googleapis.com/auth/drive"
 ]
 
-pp = PrettyPrinter(indent=4)
-
-# Using the logs.
+FOLDER_MIME = "application/vnd.google-apps.folder"
+SHORTCUT_MIME = "application/vnd.google-apps.shortcut"
+CLASSIFICATION_SHEET_ID = "1b5yJfOIWCHXdr7VbFxoNLs_SI5zPR7CL0MsCI1zqWaM"
+# Bytes requested per chunk when downloading the classification sheet.
+DOWNLOAD_CHUNK = 1024 * 1024
+# Number of folder names OR'd together in a single resolution query.
+RESOLVE_CHUNK = 30
+# Where the progress of an interrupted crawl is kept.
+CHECKPOINT_PATH = "data/checkpoint.json"
+
+# Using the logs, written where `drivereader.cli.log_to` is given.
 logger_monitor = logging.getLogger(__name__)
 logger_monitor.setLevel(logging.ERROR)
-handler = logging.FileHandler("drive_reader_logs.log")
-handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
-logger_monitor.addHandler(handler)
 
 
 # * Declare a few types to help with understanding.
@@ -73,18 +97,200 @@ def sort_dictionary(unsorted_dict: dict[str, ], reverse=False):
     sorted_dictionary = dict({i: unsorted_dict[i] for i in order_list})
     return sorted_dictionary
 
+def quote(value: str):
+    """Escape a value for use inside a quoted drive query literal."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+def file_hash(file_path: str):
+    """The md5 hash of a file's contents, read in chunks."""
+    digest = md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_mode():
+    """The permissions `open` gives a new file under the current umask."""
+    mask = umask(0)
+    umask(mask)
+    return 0o666 & ~mask
+
+
+def save_atomically(workbook: Workbook, filename: str):
+    """Save a workbook to a temporary file and rename it into place.
+
+    Readers never see a half written report, and jobs saving the same
+    report at once each leave a whole one. When the report is locked, e.g.
+    open in Excel on Windows, it is saved next to it with a timestamp in
+    its name instead. No processes are started.
+
+    Returns
+    -------
+    - filename`str`: The path the workbook was saved to.
+    """
+    directory = path.dirname(filename) or "."
+    stem, extension = path.splitext(path.basename(filename))
+    descriptor, temp_path = mkstemp(prefix=f".{stem}.", suffix=".part",
+                                    dir=directory)
+    try:
+        with fdopen(descriptor, "wb") as file:
+            workbook.save(file)
+        # The temporary file is only readable by its owner, unlike a report.
+        chmod(temp_path, file_mode())
+        try:
+            replace(temp_path, filename)
+        except PermissionError:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            filename = path.join(directory, f"{stem}-{stamp}{extension}")
+            replace(temp_path, filename)
+    finally:
+        if path.exists(temp_path):
+            remove(temp_path)
+    return filename
+
+def write_atomically(text: str, filename: str, mode: Optional[int] = None):
+    """Write a text file through a temporary file renamed into place.
+
+    The file is flushed to disk before the rename, so it is either the old
+    or the new version, even if the run is killed while writing it. It gets
+    the permissions `mode`, by default those `open` would give it.
+    """
+    descriptor, temp_path = mkstemp(
+        prefix=f".{path.basename(filename)}.", suffix=".part",
+        dir=path.dirname(filename) or ".")
+    try:
+        with fdopen(descriptor, "w") as file:
+            file.write(text)
+            file.flush()
+            fsync(file.fileno())
+        chmod(temp_path, file_mode() if mode is None else mode)
+        replace(temp_path, filename)
+    finally:
+        if path.exists(temp_path):
+            remove(temp_path)
+
+def summary_widths(rows: list[tuple[bool, list]]):
+    """The widths of the columns of the summary of the exempted files."""
+    widths = [13, 13, 13]
+    for _, row in rows:
+        for column, value in enumerate(row):
+            widths[column] = max(widths[column], len(str(value)))
+    return widths
+
+def header_style():
+    """The shared style of the header cells."""
+    style = NamedStyle("drivereader header")
+    style.alignment = Alignment(horizontal="center", vertical="center")
+    style.font = Font(bold=True, size=12)
+    return style
+
+def merged_style():
+    """The shared style of merged cells in the first column."""
+    style = NamedStyle("drivereader merged")
+    style.alignment = Alignment(horizontal="center", vertical="center")
+    return style
+
 class ExcelWorker():
-    """The class that will handle interaction with the excel workbooks."""
+    """The class that will handle interaction with the excel workbooks.
+
+    Parameters
+    ----------
+    - streaming`bool`: Write the reports with write-only workbooks that
+    stream rows to disk, for reports too large to build cell by cell.
+    - fingerprint`str`: Identifies the version of the classification sheet,
+    e.g. its drive `modifiedTime`. A hash of the file is used if omitted.
+    - headless`bool`: Save the reports without closing or opening Excel,
+    see `save_atomically`. Defaults to headless everywhere but Windows.
+    """
 
-    def __init__(self) -> None:
+    def __init__(self, streaming: bool = False,
+                 fingerprint: Optional[str] = None,
+                 headless: Optional[bool] = None) -> None:
         """Initialize the class."""
-        self.read_classification_exl()
+        self.streaming = streaming
+        self.headless = platform != "win32" if headless is None else headless
+        self.read_classification_exl(fingerprint)
+        # The NAAC classifications of every code, looked up once per code.
+        self.classification_index: dict[Code, tuple[Classification, ...]] = {
+            code: tuple(value[2]) for code, value in self.code_list.items()}
+
+    def naac_rollup(self,
+            drive_data: dict[Category, dict[Year, dict[Code, int]]]):
+        """Count the files of every year under each NAAC classification.
+
+        Parameters
+        ----------
+        - drive_data: The counts of every category, year and code.
+
+        Returns
+        -------
+        - rollup`dict[Year, dict[Classification, int]]`: The counts for
+        every year with classified files, newest first.
+        """
+        rollup: dict[Year, dict[Classification, int]] = {}
+        index = self.classification_index
+        for category_data in drive_data.values():
+            for year, year_data in category_data.items():
+                spec_data = rollup.get(year)
+                for code, value in year_data.items():
+                    for spec in index.get(code, ()):
+                        if spec_data is None:
+                            spec_data = rollup[year] = {}
+                        spec_data[spec] = spec_data.get(spec, 0) + value
+        return sort_dictionary(rollup, True)
+
+    def naac_years(self,
+            drive_data: dict[Category, dict[Year, dict[Code, int]]],
+            index: Optional[FileIndex] = None,
+            counts: Optional[CountStore] = None):
+        """The rollup of `naac_rollup`, from the index or the count store
+        when there is one.
+
+        A year with no data at all still gets an empty report, the current
+        academic year.
+        """
+        if index is not None:
+            rollup = index.classification_counts_by_year()
+        elif counts is not None:
+            rollup = counts.rollup(self.classification_index)
+        else:
+            rollup = self.naac_rollup(drive_data)
+        if not rollup:
+            today = datetime.now()
+            rollup = {academic_year(today.year, today.month): {}}
+        return rollup
+
+    def read_classification_exl(self, fingerprint: Optional[str] = None):
+        """Read the classification categories.
+
+        The parsed codes are cached in `data/classification_cache.json`
+        along with the fingerprint of the sheet, and the sheet is parsed
+        again only when the fingerprint changes.
+        """
+        # Fingerprint the workbook, if not found exit the program.
+        try:
+            if fingerprint is None:
+                fingerprint = file_hash("data/doc_classification.xlsx")
+        except FileNotFoundError:
+            print("Classification file not found.")
+            logger_monitor.warning("Classification file not found.")
+            sysexit()
+
+        try:
+            with open("data/classification_cache.json", "r") as file:
+                cache = load(file)
+        except (FileNotFoundError, ValueError):
+            cache = {}
+        if cache.get("fingerprint") == fingerprint:
+            self.code_list = cache["code_list"]
+            self.classification_list = cache["classification_list"]
+            logger_monitor.debug("Classification loaded from cache.")
+            return
 
-    def read_classification_exl(self):
-        """Read the classification categories."""
         # Load the workbook, if not exit the program.
         try:
-            self.doc_wb:Workbook = load_workbook("data/doc_classification.xlsx")
+            self.doc_wb:Workbook = load_workbook(
+                "data/doc_classification.xlsx", read_only=True)
             logger_monitor.debug("Classification file found.")
         except FileNotFoundError:
             print("Classification file not found.")
@@ -129,6 +335,7 @@ class ExcelWorker():
                     code, name = row[0].value, row[1].value
                     if code and name and code not in self.code_list:
                         self.code_list[code] = [name, ws.title, ["Unknown"]]
+        self.doc_wb.close()
 
         #Write the generated data to files for evaluation.
         with open("data/code_list.json", "w") as file:
@@ -137,109 +344,182 @@ class ExcelWorker():
         with open("data/classification_list.json", "w") as file:
             class_obj = dumps(self.classification_list, indent=4)
             file.write(class_obj)
+        write_atomically(dumps({
+            "fingerprint": fingerprint,
+            "code_list": self.code_list,
+            "classification_list": self.classification_list
+        }, separators=(",", ":")), "data/classification_cache.json")
         logger_monitor.debug(self.code_list)
         logger_monitor.debug(self.classification_list)
 
+    def write_reports(self,
+            drive_data: dict[Category, dict[Year, dict[Code, int]]],
+            exempt: ExemptLog,
+            index: Optional[FileIndex] = None,
+            profile: Optional[RunProfile] = None,
+            counts: Optional[CountStore] = None):
+        """Save the counts and the exempted files, and write both reports.
+
+        The counts go to `data/data.json` and the log of the exempted files
+        to `data/exempt.jsonl`, from which `drivereader report` can write
+        the reports again.
+
+        Parameters
+        ----------
+        - drive_data: The counts of every category, year and code.
+        - exempt`ExemptLog`: The files that were not classified.
+        - index`FileIndex`: Builds the NAAC report from the index.
+        - profile`RunProfile`: Times the writing of each report.
+        - counts`CountStore`: The counts of `drive_data`, which the NAAC
+        report is rolled up from.
+        """
+        write_atomically(dumps(drive_data, indent=4), "data/data.json")
+        exempt.save(EXEMPT_PATH)
+        with timed(profile, "excel_categorized"):
+            self.write_data_to_excel(drive_data, exempt)
+        with timed(profile, "excel_naac"):
+            self.write_naac_data_to_excel(drive_data, index, counts)
+
     def write_data_to_excel(self,
             drive_data: dict[Category, dict[Year, dict[Code, int]]],
-            exempted: list[tuple[Name, str]]):
+            exempted: ExemptLog):
         """Write data from the drive to the excel sheet.
 
         Parameters
         ----------
         - drive_data: The raw data of the different files that satisfy
         the necessary conditions in all folders.
-        - exempted: The files that are exempted from classification
-        due to any reason.
+        - exempted: The files that are exempted from classification, of
+        which the summary is written.
+
+        Returns
+        -------
+        - workbook`Workbook`: The report, or `None` when it was streamed.
         """
+        if self.streaming:
+            self.stream_data_to_excel(drive_data, exempted)
+            return None
         workbook = Workbook()
         workbook.active.title = "exempted"
 
         # Loop through all the categories to create new sheets.
         for category in drive_data:
             worksheet: Worksheet = workbook.create_sheet(category, -1)
-            category_data = drive_data[category]
-            worksheet.append(["YEAR", "CLASSIFICATION", "COUNT"])
-            # Format headers in each sheet.
-            for i in range(1, 4):
-                worksheet[f"{get_col_let(i)}1"].alignment = Alignment(horizontal="center")
-                worksheet[f"{get_col_let(i)}1"].font = Font(bold=True, size=12)
-
-            # Append data to the sheet.
-            start, stop, width = 2, 2, 16
-            for year, year_data in category_data.items():
-                worksheet[f"A{start}"] = year
-                for code, val in year_data.items():
-                    name = self.code_list[code][0]
-                    worksheet[f"B{stop}"] = name
-                    worksheet[f"C{stop}"] = val
-                    width = max(width, len(name))
-                    stop += 1
-
-                # Merge the cells of same years, and center the alignment.
-                worksheet.merge_cells(f"A{start}:A{stop-1}")
-                worksheet[f"A{start}"].alignment = Alignment(horizontal="center",
-                                                             vertical="center")
-                start = stop
-            # Fix width to readable length.
-            worksheet.column_dimensions["B"].width = width
-            worksheet.column_dimensions["A"].width = 13
+            self.write_category_sheet(worksheet, drive_data[category])
 
         # Handle exempted data.
-        worksheet = workbook["exempted"]
-        worksheet.append(["File Name", "Folder name"])
-        for i in range(1, 3):
+        self.write_exempt_sheet(workbook["exempted"], exempted)
+
+        self.save_report(workbook, "data/categorized.xlsx")
+        return workbook
+
+    def write_category_sheet(self, worksheet: Worksheet,
+                             category_data: dict[Year, dict[Code, int]]):
+        """Write the counts of one category, by year and code."""
+        worksheet.append(["YEAR", "CLASSIFICATION", "COUNT"])
+        # Format headers in each sheet.
+        for i in range(1, 4):
             worksheet[f"{get_col_let(i)}1"].alignment = Alignment(horizontal="center")
             worksheet[f"{get_col_let(i)}1"].font = Font(bold=True, size=12)
-        width1, width2 = 13, 13
+
         # Append data to the sheet.
-        for value in exempted:
-            worksheet.append(value)
-            width1, width2 = max(width1, len(value[0])), max(width2, len(value[1]))
+        start, stop, width = 2, 2, 16
+        for year, year_data in category_data.items():
+            worksheet[f"A{start}"] = year
+            for code, val in year_data.items():
+                name = self.code_list[code][0]
+                worksheet[f"B{stop}"] = name
+                worksheet[f"C{stop}"] = val
+                width = max(width, len(name))
+                stop += 1
+
+            # Merge the cells of same years, and center the alignment.
+            worksheet.merge_cells(f"A{start}:A{stop-1}")
+            worksheet[f"A{start}"].alignment = Alignment(horizontal="center",
+                                                         vertical="center")
+            start = stop
+        # Fix width to readable length.
+        worksheet.column_dimensions["B"].width = width
+        worksheet.column_dimensions["A"].width = 13
+
+    def write_exempt_sheet(self, worksheet: Worksheet,
+                           exempted: ExemptLog):
+        """Write the summary of the files that were not classified: the
+        files of each reason, the folders and unknown codes with the most
+        files, and the first files exempted."""
+        rows = summary_rows(exempted.summary())
+        for header, row in rows:
+            worksheet.append(row)
+            if header:
+                for cell in worksheet[worksheet.max_row]:
+                    cell.alignment = Alignment(horizontal="center")
+                    cell.font = Font(bold=True, size=12)
         # Fix width to readable length
-        worksheet.column_dimensions["A"].width = width1
-        worksheet.column_dimensions["B"].width = width2
+        for column, width in enumerate(summary_widths(rows), 1):
+            worksheet.column_dimensions[get_col_let(column)].width = width
 
-        # Save the workbook, close any instance if saving fails.
-        while True:
-            try:
-                workbook.save("data/categorized.xlsx")
-            except PermissionError:
-                try:
-                    ossystem("taskkill/im EXCEL.EXE categorized.xlsx")
-                except:
-                    pass
-            else:
-                break
-        # * Open the workbook to see the result.
-        ossystem("start EXCEL.EXE data/categorized.xlsx")
+    def replace_sheets(self, workbook: Workbook, filename: str,
+                       writers: dict[str, Callable[[Worksheet], Any]]):
+        """Write some sheets of a report again, keeping the others.
+
+        Every sheet is written by its writer on an empty sheet that takes
+        the place of the old one, and the report is saved.
+
+        Parameters
+        ----------
+        - workbook`Workbook`: The report, as returned by
+        `write_data_to_excel` or `write_naac_data_to_excel`.
+        - filename`str`: Where the report is saved.
+        - writers`dict[str, Callable[[Worksheet], Any]]`: The title of every
+        sheet to write again, and what writes it.
+        """
+        active = workbook.index(workbook.active)
+        for title, write in writers.items():
+            position = workbook.sheetnames.index(title)
+            workbook.remove(workbook[title])
+            write(workbook.create_sheet(title, position))
+        workbook.active = active
+        return self.save_report(workbook, filename)
 
     def write_naac_data_to_excel(self,
-            drive_data: dict[Category, dict[Year, dict[Code, int]]]):
+            drive_data: dict[Category, dict[Year, dict[Code, int]]],
+            index: Optional[FileIndex] = None,
+            counts: Optional[CountStore] = None):
         """Write data to excel sheet in naac required format.
 
         Parameters
         ----------
         - drive_data: The raw data of the different files that satisfy
         the necessary conditions in all folders.
-        """
-        spec_data = {} # Alias for classification data.
+        - index: The file index of the crawl. When given, the counts are
+        taken from it with an aggregate query instead of `drive_data`.
+        - counts: The counts of `drive_data` in a `CountStore`, which the
+        report is rolled up from when there is no index.
 
-        # Take the data for 22-23 and put in naac excel.
-        for category_data in drive_data.values():
-            for year, year_data in category_data.items():
-                if year == "2022-2023":
-                    for code, value in year_data.items():
-                        if self.code_list.get(code):
-                            for spec in self.code_list[code][2]:
-                                spec_data.update({
-                                    spec: spec_data.get(spec, 0) + value
-                                })
-        spec_data = sort_dictionary(spec_data)
+        Every academic year in the data gets its own sheet, newest first.
+        Returns the report, or `None` when it was streamed.
+        """
+        if self.streaming:
+            self.stream_naac_data_to_excel(drive_data, index, counts)
+            return None
 
         naac_wb = Workbook()
-        naac_ws: Worksheet = naac_wb.active
-        naac_ws.title = "2022-2023"
+        for number, (year, spec_data) in enumerate(
+                self.naac_years(drive_data, index, counts).items()):
+            if number == 0:
+                naac_ws: Worksheet = naac_wb.active
+                naac_ws.title = year
+            else:
+                naac_ws = naac_wb.create_sheet(year)
+            self.write_naac_sheet(naac_ws, spec_data)
+
+        self.save_report(naac_wb, "data/naac.xlsx")
+        return naac_wb
+
+    def write_naac_sheet(self, naac_ws: Worksheet,
+                         spec_data: dict[Classification, int]):
+        """Write the counts of one year in naac required format."""
+        spec_data = sort_dictionary(spec_data)
         start, width = 1, 13
         logger_monitor.debug(spec_data)
 
@@ -293,27 +573,253 @@ class ExcelWorker():
             # Improve readability of category column.
             naac_ws.column_dimensions["A"].width = width
 
-        # Save the workbook, close any instances if saving fails.
+    def stream_data_to_excel(self,
+            drive_data: dict[Category, dict[Year, dict[Code, int]]],
+            exempted: ExemptLog,
+            filename: str = "data/categorized.xlsx"):
+        """Write the same report as `write_data_to_excel` with a write-only
+        workbook.
+
+        Rows are streamed to disk as they are appended, styles are shared
+        named styles and the merged year ranges are worked out while the
+        rows are written, so memory does not grow with the report.
+        """
+        workbook = Workbook(write_only=True)
+        header, merged = header_style(), merged_style()
+        workbook.add_named_style(header)
+        workbook.add_named_style(merged)
+
+        def styled(worksheet, value, style):
+            cell = WriteOnlyCell(worksheet, value)
+            cell.style = style.name
+            return cell
+
+        for category, category_data in drive_data.items():
+            worksheet = workbook.create_sheet(category)
+            # Widths have to be known before the first row is written.
+            width = max([16] + [len(self.code_list[code][0])
+                                for year_data in category_data.values()
+                                for code in year_data])
+            worksheet.column_dimensions["A"].width = 13
+            worksheet.column_dimensions["B"].width = width
+            worksheet.append([styled(worksheet, title, header) for title
+                              in ("YEAR", "CLASSIFICATION", "COUNT")])
+
+            start = 2
+            for year, year_data in category_data.items():
+                first = True
+                for code, val in year_data.items():
+                    year_cell = styled(worksheet, year, merged) if first \
+                        else None
+                    worksheet.append([year_cell, self.code_list[code][0], val])
+                    first = False
+                stop = start + len(year_data)
+                if stop - start > 1:
+                    worksheet.merged_cells.add(f"A{start}:A{stop-1}")
+                start = stop
+
+        # Handle exempted data.
+        worksheet = workbook.create_sheet("exempted")
+        rows = summary_rows(exempted.summary())
+        for column, width in enumerate(summary_widths(rows), 1):
+            worksheet.column_dimensions[get_col_let(column)].width = width
+        for is_header, row in rows:
+            worksheet.append([styled(worksheet, title, header)
+                              for title in row] if is_header else row)
+
+        self.save_report(workbook, filename)
+
+    def stream_naac_data_to_excel(self,
+            drive_data: dict[Category, dict[Year, dict[Code, int]]],
+            index: Optional[FileIndex] = None,
+            counts: Optional[CountStore] = None,
+            filename: str = "data/naac.xlsx"):
+        """Write the same report as `write_naac_data_to_excel` with a
+        write-only workbook."""
+        workbook = Workbook(write_only=True)
+        header, merged = header_style(), merged_style()
+        workbook.add_named_style(header)
+        workbook.add_named_style(merged)
+        width = max([13] + [len(category) * 1.2 for category
+                            in self.classification_list.values()])
+        for year, spec_data in self.naac_years(drive_data, index,
+                                               counts).items():
+            self.stream_naac_sheet(workbook.create_sheet(year), spec_data,
+                                   width, header, merged)
+        self.save_report(workbook, filename)
+
+    def stream_naac_sheet(self, worksheet,
+                          spec_data: dict[Classification, int],
+                          width: float, header: NamedStyle,
+                          merged: NamedStyle):
+        """Write the counts of one year to a write-only sheet."""
+        worksheet.column_dimensions["A"].width = width
+
+        def styled(value, style):
+            cell = WriteOnlyCell(worksheet, value)
+            cell.style = style.name
+            return cell
+
+        worksheet.append([styled(title, header)
+                          for title in ("Classification", "Code", "Count")])
+        start, word = 2, None
+        for num, (classification, category) in \
+                enumerate(self.classification_list.items(), 2):
+            # When word changes, merge the cells of the previous one.
+            if word != category:
+                if word is not None and num - start > 1:
+                    worksheet.merged_cells.add(f"A{start}:A{num-1}")
+                start, word = num, category
+                first_cell = styled(category, merged)
+            else:
+                first_cell = None
+            worksheet.append([first_cell, classification,
+                              spec_data.get(classification, 0)])
+        if word is not None and len(self.classification_list) + 2 - start > 1:
+            worksheet.merged_cells.add(
+                f"A{start}:A{len(self.classification_list) + 1}")
+
+    def save_report(self, workbook: Workbook, filename: str):
+        """Save a report and return the path it was saved to.
+
+        Headless, the report is saved with `save_atomically`. Otherwise any
+        Excel instance holding the file is closed until saving works, and
+        the report is opened in Excel.
+        """
+        if self.headless:
+            saved = save_atomically(workbook, filename)
+            if saved != filename:
+                print(f"{filename} is in use, saved to {saved} instead.")
+            return saved
         while True:
             try:
-                naac_wb.save("data/naac.xlsx")
+                workbook.save(filename)
                 break
             except PermissionError:
-                print("Failed to save naac.xlsx")
-                ossystem("taskkill /im EXCEL.EXE naac.xlsx")
-        ossystem("start EXCEL.EXE data/naac.xlsx")
+                print(f"Failed to save {filename}")
+                ossystem(f"taskkill /im EXCEL.EXE {path.basename(filename)}")
+        # * Open the workbook to see the result.
+        ossystem(f"start EXCEL.EXE {filename}")
+        return filename
 
 
 class DriveReader():
-    """This project aims to read files in a drive and categorize them."""
+    """This project aims to read files in a drive and categorize them.
+
+    Parameters
+    ----------
+    - backend_factory`Callable[[], DriveBackend]`: Builds a drive backend.
+    Every listing worker gets its own backend from this factory. When
+    omitted, the connection is authorized with `token.json` and
+    `credentials.json` and Google Drive backends are used.
+    - workers`int`: The number of folders listed concurrently.
+    - folder_cache_ttl`float`: Seconds a resolved folder id is reused from
+    `data/folder_cache.json`. Set to 0 to always resolve again.
+    - index_path`str`: Where to keep a SQLite index of every crawled file.
+    The reports are then built from the index. No index is kept if omitted.
+    - scheduler`RequestScheduler`: Paces and retries the requests to drive,
+    shared by all listing workers. Defaults to the drive quota.
+    - batch`bool`: List the first page of every folder with batch requests,
+    up to `BATCH_LIMIT` folders per round trip.
+    - recursive`bool`: Also count the files in the sub-folders of the
+    folders, walking the tree breadth first.
+    - max_depth`int`: How many levels of sub-folders a recursive crawl goes
+    down. No limit if omitted.
+    - frontier_size`int`: The most folders a recursive crawl lists at once.
+    It does not bound memory: the folders of the level being listed and of
+    the next one, and every folder seen, are kept in memory and in the
+    checkpoint.
+    - profile`RunProfile`: Times the stages of the run and counts its
+    pages and files. A new profile is made if omitted.
+    - checkpoint_interval`float`: Seconds between two saves of the
+    progress of a crawl, so an interrupted one can be resumed. Set to 0 to
+    not save it.
+    - shard`str`: Crawl only part of the folders, `INDEX/COUNT` by hash or
+    `START:STOP` by position, and write a partial to be merged with the
+    other shards instead of the reports, see `drivereader.shards`.
+    - partial_path`str`: Where the partial of a shard is written, by
+    default `data/partial-<shard>.json`.
+    - exempt_path`str`: Where the files that were not classified are
+    logged during a crawl, see `ExemptLog`.
+    - interactive`bool`: Authorize in the browser when `token.json` is
+    missing, expired or revoked. Otherwise a `PermissionError` is raised.
+    """
 
-    def __init__(self) -> None:
+    def __init__(self,
+            backend_factory: Optional[Callable[[], DriveBackend]] = None,
+            workers: int = 1,
+            folder_cache_ttl: float = 24 * 60 * 60,
+            index_path: Optional[str] = None,
+            scheduler: Optional[RequestScheduler] = None,
+            batch: bool = False,
+            recursive: bool = False,
+            max_depth: Optional[int] = None,
+            frontier_size: int = 1000,
+            profile: Optional[RunProfile] = None,
+            checkpoint_interval: float = 30.0,
+            shard: Optional[str] = None,
+            partial_path: Optional[str] = None,
+            exempt_path: str = EXEMPT_PATH,
+            interactive: bool = True) -> None:
         """Initialize the class."""
         self.creds = None
-        self.initialize_connection()
+        self.interactive = interactive
+        self.session = None
+        self.profile = profile or RunProfile()
+        self.checkpoint_interval = checkpoint_interval
+        self.shard = shard
+        self.partial_path = partial_path or (
+            shard and default_partial_path(shard))
+        self.exempt_path = exempt_path
+        # All the folders of `folders.json` when only a shard is crawled.
+        self.all_folder_names: Optional[list[str]] = None
+        # The position in `folders.json` of each crawled folder, by its
+        # name on drive.
+        self.folder_positions: dict[str, int] = {}
+        # The state of the last incremental run, as saved to disk.
+        self.state: Optional[dict[str, Any]] = None
+        # Where a crawl would go on from, see `walk`.
+        self.crawl_cursor: Optional[dict[str, Any]] = None
+        self.workers = workers
+        self.batch = batch
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.frontier_size = frontier_size
+        self.scheduler = scheduler or RequestScheduler()
+        # Folders whose listing still failed after all retries, with the
+        # page token the listing stopped at.
+        self.failed_folders: dict[str, Optional[str]] = {}
+        self.folder_cache_ttl = folder_cache_ttl
+        self.index = FileIndex(index_path) if index_path else None
+        self._classifier: Optional[FileClassifier] = None
+        self._local = local()
+        self._backends: list[DriveBackend] = []
+        self._backends_lock = Lock()
+        if backend_factory is None:
+            self.backend_factory = lambda: GoogleDriveBackend(
+                self.build_service())
+            with self.profile.stage("auth"):
+                self.initialize_connection()
+            self._local.backend = self.add_backend(
+                GoogleDriveBackend(self.service))
+        else:
+            self.backend_factory = backend_factory
+            self._local.backend = self.add_backend(backend_factory())
 
     def initialize_connection(self):
-        """Make the initial connection with drive."""
+        """Make the initial connection with drive.
+
+        The services of every thread are then handed out by a
+        `SessionManager`, which also refreshes the token as it nears expiry
+        and saves the new one to `token.json`.
+        """
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        from drivereader.session import SessionManager
+
         # The file stores user's access and refresh tokens, and is created
         # automatically when first authorization flow is completed.
         if path.exists("token.json"):
@@ -328,10 +834,18 @@ class DriveReader():
                 try:
                     self.creds.refresh(Request())
                 except RefreshError:
+                    if not self.interactive:
+                        raise PermissionError("The token in token.json was "
+                                              "revoked, run drivereader "
+                                              "once to authorize again.")
                     remove("token.json")
                 else:
                     refresh = True
             if refresh is False:
+                if not self.interactive:
+                    raise PermissionError("token.json is missing or expired, "
+                                          "run drivereader once to "
+                                          "authorize it.")
                 flow = InstalledAppFlow.from_client_secrets_file(
                     "credentials.json", SCOPES)
                 self.creds = flow.run_local_server(port=0)
@@ -340,19 +854,64 @@ class DriveReader():
                 token.write(self.creds.to_json())
 
         # Create a connection with drive.
-        self.service = build("drive", "v3", credentials=self.creds)
+        self.session = SessionManager(self.creds, on_refresh=self.save_token)
+        self.service = self.build_service()
 
         if self.creds and self.creds.valid:
             return "Connection made."
         else:
             return "Connection failed."
 
+    def build_service(self):
+        """The drive service of the calling thread.
+
+        `googleapiclient` services are not thread safe, so each listing
+        worker gets its own from the session, on pooled keep-alive
+        connections, built from the discovery document shipped with
+        `googleapiclient` rather than one fetched over the network.
+        """
+        if self.session is None:
+            return drive_service(self.creds)
+        return self.session.service()
+
+    def save_token(self, creds: Any):
+        """Save refreshed credentials for the next run."""
+        # The token is a secret, only its owner may read it.
+        write_atomically(creds.to_json(), "token.json", 0o600)
+
+    def add_backend(self, backend: DriveBackend):
+        """Keep track of a backend, to count its calls."""
+        with self._backends_lock:
+            if all(backend is not known for known in self._backends):
+                self._backends.append(backend)
+        return backend
+
+    def client(self):
+        """Return the drive backend owned by the calling thread."""
+        backend = getattr(self._local, "backend", None)
+        if backend is None:
+            backend = self._local.backend = self.add_backend(
+                self.backend_factory())
+        return backend
+
+    @property
+    def api_calls(self):
+        """The number of requests made to drive by all backends."""
+        return sum(backend.calls for backend in self._backends)
+
+    @property
+    def api_bytes(self):
+        """The number of bytes received from drive by all backends."""
+        return sum(backend.bytes for backend in self._backends)
+
     def search_file(self, file_name: str):
         """Search for a specific file."""
         try:
-            response = self.service.files().list(
-                q=f"name contains '{file_name}'"
-            ).execute()
+            response = self.scheduler.execute(
+                self.client().list_files,
+                f"name contains '{quote(file_name)}'",
+                fields="files(id, name)"
+            )
             return response.get("files", None)
 
         except HttpError as error:
@@ -362,11 +921,13 @@ class DriveReader():
     def search_folder(self, category_name: str):
         """Search for a specific folder."""
         try:
-            response = self.service.files().list(
-                q=f"name contains '{category_name}' and mimeType = \
-                    'application/vnd.google-apps.folder'"
-            ).execute()
-            folders = response.get("files", None)
+            response = self.scheduler.execute(
+                self.client().list_files,
+                f"name contains '{quote(category_name)}' and mimeType = \
+                    '{FOLDER_MIME}'",
+                fields="files(id, name)"
+            )
+            folders = response.get("files", [])
             if len(folders) > 0:
                 return folders[0]
             else: return None
@@ -375,151 +936,887 @@ class DriveReader():
             print(f"An error occurred: {error}")
             return None
 
-    def download_sheet(self):
-        """Download the required excel sheet."""
-        self.excel_sheet_id = "1b5yJfOIWCHXdr7VbFxoNLs_SI5zPR7CL0MsCI1zqWaM"
+    def download_sheet(self, sheet_id: str = CLASSIFICATION_SHEET_ID):
+        """Download the required excel sheet, if it changed.
+
+        The `modifiedTime` and `version` of the sheet are checked first, and
+        the export is skipped when they match the copy on disk. Otherwise
+        the export is streamed in chunks to a temporary file, which then
+        replaces `data/doc_classification.xlsx` in one step.
+
+        Sets `sheet_fingerprint`, which identifies the version on disk.
+        """
+        self.excel_sheet_id = sheet_id
+        self.sheet_fingerprint = None
         try:
+            metadata = self.scheduler.execute(
+                self.client().get_file, self.excel_sheet_id,
+                fields="modifiedTime, version")
+            fingerprint = f"{metadata.get('version')}:" \
+                f"{metadata.get('modifiedTime')}"
+            try:
+                with open("data/doc_classification.meta.json", "r") as file:
+                    cached = load(file)
+            except (FileNotFoundError, ValueError):
+                cached = {}
+            if cached.get("fingerprint") == fingerprint \
+                    and path.exists("data/doc_classification.xlsx"):
+                print("Classification sheet is up to date.")
+                self.sheet_fingerprint = fingerprint
+                return True
+
             mime_type = "application/vnd.openxmlformats-officedocument"
             mime_type += ".spreadsheetml.sheet"
-            request = self.service.files().export_media(fileId=self.excel_sheet_id,
-                                                        mimeType=mime_type)
-            file = BytesIO()
-            downloader = MediaIoBaseDownload(file, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
+            descriptor, temp_path = mkstemp(suffix=".part", dir="data")
+            try:
+                with fdopen(descriptor, "wb") as file:
+                    def export():
+                        # A retried export starts over on an empty file.
+                        file.seek(0)
+                        file.truncate()
+                        return self.client().export_file(
+                            self.excel_sheet_id, mime_type, file,
+                            chunksize=DOWNLOAD_CHUNK)
+                    size = self.scheduler.execute(export)
 
-            while True:
                 try:
-                    with open("data/doc_classification.xlsx", "wb") as write_file:
-                        write_file.write(file.getbuffer())
+                    replace(temp_path, "data/doc_classification.xlsx")
                 except PermissionError:
-                    ossystem("taskkill /im EXCEL.EXE naac.xlsx")
-                else:
-                    break
-
-            print(F'Download {int(status.progress() * 100)}%.')
+                    # Excel on Windows locks the sheet while it is open.
+                    # Excel is not closed for the user, which would close
+                    # every workbook open in it.
+                    if platform != "win32":
+                        raise
+                    print("Close data/doc_classification.xlsx in Excel to "
+                          "update it, the copy on disk is used.")
+                    return False
+            finally:
+                if path.exists(temp_path):
+                    remove(temp_path)
+
+            with open("data/doc_classification.meta.json", "w") as file:
+                file.write(dumps({"fingerprint": fingerprint}))
+            self.sheet_fingerprint = fingerprint
+            print(f"Downloaded {size} bytes.")
             return True
 
         except HttpError as error:
             print(f"{error} has occurred.")
             return False
 
-    def categorize_files(self):
-        """Categorize the files in the various folders according to code."""
-        try:
-            with open("data/folders.json", "r") as file:
-                folder_names: list[str] = load(file)
-        except FileNotFoundError:
-            print("Please specify the folders to search in `folders.json`.")
-            self.data = None
-            return
+    def resolve_folders(self, folder_names: list[str]):
+        """Find the drive folders for all the names in `folders.json`.
+
+        Instead of one `search_folder` call per name, the names are OR'd
+        together into a few queries and the folders returned are matched
+        to the names locally. Resolved folders are cached on disk and
+        reused until they are older than `folder_cache_ttl`.
+
+        Parameters
+        ----------
+        - folder_names`list[str]`: The names of the folders to find.
 
-        self.data: dict[Category, dict[Year, dict[Code, int]]] = {
-            i: {
-                "0": {
-                    "0": 0
-                }
-            } for i in self.categories}
-        self.exempt: list[tuple[Name, str]] = []
-
-        for folder_search in folder_names:
-            folder = self.search_folder(folder_search)
-            folder_id, folder_name = folder.get("id"), folder.get("name")
+        Returns
+        -------
+        - folders`dict[str, dict[str, str]]`: The `id` and `name` of the
+        folder found for each name. Names that were not found are missing.
+        """
+        cache: dict[str, dict[str, Any]] = {}
+        if self.folder_cache_ttl > 0:
+            try:
+                with open("data/folder_cache.json", "r") as file:
+                    cache = load(file)
+            except (FileNotFoundError, ValueError):
+                cache = {}
+
+        now = time()
+        folders: dict[str, dict[str, str]] = {}
+        for name in folder_names:
+            entry = cache.get(name)
+            if entry and now - entry["resolved"] < self.folder_cache_ttl:
+                folders[name] = {"id": entry["id"], "name": entry["name"]}
+        pending = list(dict.fromkeys(
+            name for name in folder_names if name not in folders))
+
+        for start in range(0, len(pending), RESOLVE_CHUNK):
+            chunk = pending[start:start + RESOLVE_CHUNK]
+            clauses = " or ".join(f"name contains '{quote(name)}'"
+                                  for name in chunk)
+            found: list[dict[str, str]] = []
             try:
                 page_token = None
                 while True:
-                    # Search for all files with the folder as parent.
-                    response = self.service.files().list(
-                        q=f"'{folder_id}' in parents and trashed = false",
-                        spaces='drive',
-                        fields='nextPageToken, files(name)',
-                        pageToken=page_token
-                    ).execute()
-
-                    for file in response.get("files"):
-                        # print(file)
-                        if file.get("name") is not None:
-                            if_failed = self.classify_file(file.get("name"))
-                            if if_failed:
-                                self.exempt.append((if_failed, folder_name))
+                    response = self.scheduler.execute(
+                        self.client().list_files,
+                        f"mimeType = '{FOLDER_MIME}' and trashed = false \
+                            and ({clauses})",
+                        fields="nextPageToken, files(id, name)",
+                        page_size=1000,
+                        page_token=page_token
+                    )
+                    found.extend(response.get("files", []))
                     page_token = response.get("nextPageToken", None)
-
                     if page_token is None:
                         break
-
             except HttpError as error:
                 print(f"An error occurred: {error}")
+                continue
+
+            # The folders of a chunk match any of its names, so every name
+            # takes the folder it matches best: by the same name, then
+            # where drive's `name contains` matches, then anywhere.
+            for name in chunk:
+                ranked = [(rank, position) for position, rank in enumerate(
+                    name_match(name, folder.get("name", ""))
+                    for folder in found) if rank is not None]
+                if ranked:
+                    folder = found[min(ranked)[1]]
+                    folders[name] = {"id": folder["id"],
+                                     "name": folder["name"]}
+                    cache[name] = dict(folders[name], resolved=now)
+
+        for name in folder_names:
+            if name not in folders:
+                print(f"Folder `{name}` was not found on drive.")
+                logger_monitor.warning(f"Folder {name} not found.")
+
+        if pending and self.folder_cache_ttl > 0:
+            with open("data/folder_cache.json", "w") as file:
+                file.write(dumps(cache, indent=4))
+        return folders
+
+    def listing_request(self, folder_id: str,
+                        page_token: Optional[str] = None):
+        """The arguments of `list_files` for one page of a folder.
+
+        Pages are as large as drive allows, and only the fields that are
+        used are asked for. The `parents` and `modifiedTime` are only
+        needed by the index, and the `mimeType` by a recursive crawl.
+        """
+        fields = ["id", "name"]
+        if self.recursive:
+            fields.append("mimeType")
+        if self.index is not None:
+            fields.extend(["parents", "modifiedTime"])
+        return {
+            "query": f"'{folder_id}' in parents and trashed = false",
+            "fields": f"nextPageToken, files({', '.join(fields)})",
+            "page_token": page_token,
+            "page_size": 1000
+        }
+
+    def first_pages(self, folders: list[dict[str, str]]):
+        """List the first page of every folder with batch requests.
+
+        Returns the response for each folder, or `None` where the request
+        failed, in which case the folder is listed again on its own.
+        """
+        pages: list[Optional[dict[str, Any]]] = []
+        for start in range(0, len(folders), BATCH_LIMIT):
+            chunk = folders[start:start + BATCH_LIMIT]
+            try:
+                with self.profile.stage("listing"):
+                    responses = self.scheduler.execute(
+                        self.client().batch_list_files,
+                        [self.listing_request(folder["id"])
+                         for folder in chunk]
+                    )
+            except HttpError as error:
+                print(f"An error occurred: {error}")
+                responses = [None] * len(chunk)
+            pages.extend(None if isinstance(response, Exception)
+                         else response for response in responses)
+        return pages
 
-        else:
-            for category in list(self.data.keys()):
-                while "0" in self.data[category]:
-                    del self.data[category]["0"]
-                for year, year_data in self.data[category].items():
-                    while "0" in year_data:
-                        del year_data["0"]
-                    self.data[category][year] = sort_dictionary(year_data)
-                self.data[category] = sort_dictionary(self.data[category], True)
-                if "0" in self.data[category]:
-                    self.data.pop(category)
+    def list_pages(self, folder: dict[str, str],
+                   first_page: Optional[dict[str, Any]] = None):
+        """List the files directly in a folder, a page at a time.
 
-    def classify_file(self, name:str):
-        """Classify the file in categories based on naming structure."""
+        Runs on a listing worker, so all requests go through the worker's
+        own drive service. Failed requests are retried by the scheduler
+        from the same page. If a page still cannot be listed, the folder is
+        recorded in `failed_folders`.
+
+        Parameters
+        ----------
+        - folder`dict[str, str]`: The `id` and `name` of the folder.
+        - first_page`dict`: The first page of the folder, if it was already
+        listed by `first_pages`.
+
+        Returns
+        -------
+        - pages`Iterator[list[dict[str, str]]]`: The files of every page, in
+        listing order, each with its `id` and `name`. With an index, also
+        their `parents` and `modifiedTime`. A folder always has a page,
+        even if it is empty.
+        """
+        for files, _ in self.list_pages_from(folder, first_page):
+            yield files
+
+    def list_pages_from(self, folder: dict[str, str],
+                        first_page: Optional[dict[str, Any]] = None,
+                        page_token: Optional[str] = None):
+        """List the pages of a folder from `page_token` on, see `list_pages`.
+
+        Returns
+        -------
+        - pages`Iterator[tuple[list[dict[str, str]], str]]`: The files of
+        every page, with the token of the page after it, or `None` after
+        the last page.
+        """
+        folder_id = folder.get("id")
         try:
-            date, code, extra = name.split("_", 2)
-            code = code.upper()
-            if code not in self.code_list:
-                raise KeyError
-        except ValueError:
-            return name
-        except KeyError:
-            return name
+            while True:
+                if first_page is not None:
+                    response, first_page = first_page, None
+                else:
+                    # Search for all files with the folder as parent.
+                    with self.profile.stage("listing"):
+                        response = self.scheduler.execute(
+                            self.client().list_files,
+                            **self.listing_request(folder_id, page_token)
+                        )
+
+                self.profile.count("pages")
+                page_token = response.get("nextPageToken", None)
+                yield [file for file in response.get("files")
+                       if file.get("name") is not None], page_token
+
+                if page_token is None:
+                    break
+
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            logger_monitor.error(f"Listing of {folder.get('name')} failed "
+                                 f"at page {page_token}: {error}")
+            self.failed_folders[folder.get("name")] = page_token
+
+    def list_folder(self, folder: dict[str, str],
+                    first_page: Optional[dict[str, Any]] = None):
+        """List all files directly in a folder, see `list_pages`."""
+        return [file for page in self.list_pages(folder, first_page)
+                for file in page]
+
+    def walk(self, folders: list[dict[str, str]],
+             executor: Optional[Executor] = None,
+             cursor: Optional[dict[str, Any]] = None):
+        """List the folders, and in a recursive crawl their sub-folders.
+
+        The tree is walked breadth first. The folders of a level are listed
+        together on the `executor`, at most `frontier_size` at a time, so a
+        crawl takes about as many rounds of requests as the tree is deep.
+        The whole next level is gathered before it is listed, so memory
+        grows with the widest level of the tree. Sub-folders are listed only
+        once, even when they have several parents, and shortcuts are not
+        followed.
+
+        Before every page is yielded, `crawl_cursor` is set to where the
+        crawl would go on from after it. It is `None` while a page is being
+        taken in, so a cursor is only ever seen at a page boundary.
+
+        Parameters
+        ----------
+        - folders`list[dict[str, str]]`: The `id` and `name` of the folders
+        to crawl.
+        - executor`Executor`: Lists the folders of a level concurrently. The
+        folders are listed one after the other if omitted.
+        - cursor`dict[str, Any]`: A `crawl_cursor` saved by an earlier crawl
+        of the same folders, to go on from.
+
+        Returns
+        -------
+        - pages`Iterator[Page]`: The pages of every folder, in breadth first
+        order. Files in sub-folders are reported under the crawled folder.
+        """
+        if cursor is None:
+            seen = {folder["id"] for folder in folders}
+            level = [(folder, folder, None) for folder in folders]
+            next_level: list[tuple[dict[str, str], dict[str, str],
+                                   Optional[str]]] = []
+            depth, position, resume_token = 0, 0, None
         else:
-            try:
-                year, month = int(date[:4]), int(date[4:6])
-                # print(year, month, day)
-                if month > 0 and month < 5:
-                    year = f"{year-1}-{year}"
+            seen = set(cursor["seen"])
+            level = [tuple(entry) for entry in cursor["level"]]
+            next_level = [tuple(entry) for entry in cursor["nextLevel"]]
+            depth, position = cursor["depth"], cursor["position"]
+            resume_token = cursor["pageToken"]
+        self.crawl_cursor = None
+
+        def listing(index, folder, root, parent, first_page, page_token):
+            reported = {"id": folder["id"], "name": root["name"]}
+            for files, next_token in self.list_pages_from(
+                    folder, first_page, page_token):
+                yield (Page(reported, parent, files), folder, root, index,
+                       next_token)
+
+        while position < len(level) or next_level:
+            chunk_size = max(self.frontier_size, 1) if self.recursive \
+                else len(level)
+            for start in range(position, len(level), chunk_size):
+                chunk = level[start:start + chunk_size]
+                # Only the folder the crawl stopped in goes on from a page.
+                tokens = [resume_token if start + i == position else None
+                          for i in range(len(chunk))]
+                if self.batch:
+                    listed = iter(self.first_pages(
+                        [folder for (folder, _, _), token
+                         in zip(chunk, tokens) if token is None]))
+                    first_pages = [next(listed) if token is None else None
+                                   for token in tokens]
+                else:
+                    first_pages = [None] * len(chunk)
+                listings = [partial(listing, start + i, *entry, first_page,
+                                    token)
+                            for i, (entry, first_page, token) in enumerate(
+                                zip(chunk, first_pages, tokens))]
+                if executor is None:
+                    pages = chain.from_iterable(listing()
+                                                for listing in listings)
                 else:
-                    year = f"{year}-{year+1}"
-            except ValueError:
-                return name
+                    pages = ordered(listings, executor)
+
+                for page, folder, root, index, next_token in pages:
+                    self.crawl_cursor = None
+                    if self.recursive:
+                        kept = []
+                        for file in page.files:
+                            mime_type = file.get("mimeType")
+                            if mime_type == FOLDER_MIME:
+                                if file["id"] in seen:
+                                    logger_monitor.warning(
+                                        f"Folder {file['name']} was reached "
+                                        "twice, it is listed once.")
+                                elif self.max_depth is None \
+                                        or depth < self.max_depth:
+                                    seen.add(file["id"])
+                                    next_level.append((
+                                        {"id": file["id"],
+                                         "name": file["name"]},
+                                        root, folder["id"]))
+                            elif mime_type == SHORTCUT_MIME:
+                                logger_monitor.info(
+                                    f"Shortcut {file['name']} is not "
+                                    "followed.")
+                            else:
+                                kept.append(file)
+                        page = page._replace(files=kept)
+                    self.crawl_cursor = {
+                        "depth": depth,
+                        "position": index if next_token else index + 1,
+                        "pageToken": next_token,
+                        "level": level,
+                        "nextLevel": next_level,
+                        "seen": seen
+                    }
+                    yield page
+            level, next_level = next_level, []
+            depth, position, resume_token = depth + 1, 0, None
+
+    def categorize_files(self, workers: Optional[int] = None,
+            incremental: bool = False, full_rebuild: bool = False,
+            source: Optional[Iterable[Page]] = None, resume: bool = False):
+        """Categorize the files in the various folders according to code.
+
+        The files go through the stages of `drivereader.pipeline` a page at
+        a time: listed, classified, then counted and, when asked for, kept
+        in the state and the index. Folders are listed by a pool of
+        `workers` threads, each with its own drive service, while the pages
+        are classified in the order of `folders.json`. The result is the
+        same as a serial run. In a recursive crawl, the files of sub-folders
+        count for the folder of `folders.json` they are in.
+
+        Every `checkpoint_interval` seconds, and when the crawl is
+        interrupted, its progress is saved to `data/checkpoint.json`: the
+        counts so far, and the folder and page the crawl is at. The
+        checkpoint is removed once the crawl is done.
+
+        Parameters
+        ----------
+        - workers`int`: The number of folders listed concurrently, defaults
+        to the value given to the class.
+        - incremental`bool`: Keep a changes checkpoint and the result for
+        every file in `data/state.json`. When the state is present, only the
+        changes made on drive since the last run are applied.
+        - full_rebuild`bool`: Crawl every folder even if a saved state could
+        be updated, e.g. after the classification sheet changed.
+        - source`Iterable[Page]`: Pages of files to classify instead of the
+        folders on drive, e.g. from `csv_pages`. No state is kept for them.
+        - resume`bool`: Go on from the checkpoint of an interrupted crawl of
+        the same folders, if there is one, rather than start over.
+        """
+        aggregate = Aggregate(ExemptLog(self.exempt_path))
+        self.exempt = aggregate.exempt
+        self.counts: Optional[CountStore] = None
+        self.state = None
+        self.failed_folders = {}
+        sinks: list[Any] = [aggregate]
+        state = None
+        saved = None
+        checkpoint = None
+
+        if source is None:
+            try:
+                with open("data/folders.json", "r") as file:
+                    folder_names: list[str] = load(file)
+            except FileNotFoundError:
+                print("Please specify the folders to search in "
+                      "`folders.json`.")
+                self.data = None
+                return
+            if self.shard is not None:
+                self.all_folder_names = folder_names
+                folder_names = select_shard(folder_names, self.shard)
+
+            if resume:
+                saved = self.load_checkpoint(folder_names, incremental)
+            if saved is not None:
+                folders = saved["folders"]
+                self.folder_positions = saved.get("folderPositions", {})
+                state = saved["state"]
+                aggregate.counts.merge(CountStore.load(saved["counts"]))
+                aggregate.exempt = self.exempt = ExemptLog.resume(
+                    saved["exempt"], self.exempt_path)
+                self.failed_folders.update(saved["failedFolders"])
+                if state is not None:
+                    sinks.append(StateRecorder(state))
+                print(f"Resuming the crawl saved at {saved['saved']}.")
             else:
-                category = self.code_list[code][1]
-                category_data = self.data.get(category, {"0": {"0": 0}})
-                year_data = category_data.get(year, {"0": 0})
-                code_val = year_data.get(code, 0)
-                year_data.update({code: code_val + 1})
-                category_data.update({year: year_data})
-                self.data.update({category: category_data})
-
-    def main(self):
-        """The main function of DriveReader class."""
-        self.download_sheet()
-        self.excelWorker = ExcelWorker()
+                if incremental and not full_rebuild:
+                    state = self.load_state(folder_names)
+                    # An index out of step with the state needs a full crawl.
+                    if state is not None and self.index is not None \
+                            and self.index.count() != len(state["files"]):
+                        state = None
+                    if state is not None:
+                        with self.profile.stage("changes"):
+                            self.apply_changes(state)
+                        self.save_state(state)
+                        return
+
+                with self.profile.stage("resolve_folders"):
+                    resolved = self.resolve_folders(folder_names)
+                folders = [resolved[name] for name in folder_names
+                           if name in resolved]
+                self.folder_positions = {}
+                for position, name in enumerate(
+                        self.all_folder_names or folder_names):
+                    if name in resolved:
+                        self.folder_positions.setdefault(
+                            resolved[name]["name"], position)
+
+                if incremental:
+                    # Take the checkpoint before listing, so that changes
+                    # made during the crawl are picked up by the next run.
+                    page_token = self.start_page_token()
+                    if page_token is not None:
+                        state = {
+                            "pageToken": page_token,
+                            "folderNames": folder_names,
+                            "recursive": self.recursive,
+                            "maxDepth": self.max_depth,
+                            "folders": {i["id"]: i["name"] for i in folders},
+                            "parents": {},
+                            "files": {}
+                        }
+                        sinks.append(StateRecorder(state))
+
+            if self.checkpoint_interval > 0:
+                checkpoint = Checkpoint(
+                    partial(self.save_checkpoint, folder_names, folders,
+                            aggregate, state),
+                    lambda: self.crawl_cursor, self.checkpoint_interval)
+
+        if self.index is not None:
+            # A resumed crawl keeps the files indexed before it stopped.
+            if saved is None:
+                self.index.clear()
+            sinks.append(IndexWriter(self.index))
+        if checkpoint is not None:
+            sinks.append(checkpoint)
+
+        workers = workers or self.workers
+        with self.profile.stage("crawl"), \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = source if source is not None else self.walk(
+                folders, executor if workers > 1 else None,
+                saved and saved["cursor"])
+            try:
+                run(classify(pages, self.classifier, self.profile), sinks,
+                    self.profile)
+            except BaseException:
+                # Stop the listings still running before the pool waits on
+                # them.
+                if isinstance(pages, Generator):
+                    pages.close()
+                # Save the progress unless a page was only partly taken in.
+                if checkpoint is not None \
+                        and checkpoint.progress is not None \
+                        and checkpoint.progress is self.crawl_cursor:
+                    checkpoint.save(checkpoint.progress)
+                # Write out the exempted files, so none are left to a buffer
+                # that a resumed crawl would not truncate.
+                aggregate.exempt.close()
+                if checkpoint is not None \
+                        and path.exists(CHECKPOINT_PATH):
+                    print("The crawl was interrupted, run again with "
+                          "--resume to go on from where it stopped.")
+                raise
+
+        if self.index is not None:
+            self.index.commit()
+        self.counts = aggregate.counts
+        self.data: dict[Category, dict[Year, dict[Code, int]]] = \
+            aggregate.emit(self.categories)
+        aggregate.exempt.close()
+        self.profile.count("files", self.counts.total() + len(self.exempt))
+        if self.failed_folders:
+            print("Incomplete listings, the counts are too low for: "
+                  + ", ".join(self.failed_folders))
+            # A partial state would never be completed by the changes feed.
+            state = None
+        if state is not None:
+            self.save_state(state)
+        if checkpoint is not None and path.exists(CHECKPOINT_PATH):
+            remove(CHECKPOINT_PATH)
+
+    def finalize_data(self):
+        """Sort the counts, the newest year first and codes by name."""
+        self.data = {
+            category: {year: sort_dictionary(year_data) for year, year_data
+                       in sort_dictionary(category_data, True).items()}
+            for category, category_data in self.data.items()
+        }
+
+    def write_partial(self, filename: Optional[str] = None):
+        """Save the counts of a shard for `drivereader merge`.
+
+        The exempted files are copied to a log next to the partial, see
+        `exempt_log_path`.
+
+        Returns
+        -------
+        - filename`str`: Where the partial was written.
+        """
+        filename = filename or self.partial_path
+        log_path = exempt_log_path(filename)
+        self.exempt.save(log_path)
+        partial = make_partial(
+            self.all_folder_names, select_shard(self.all_folder_names,
+                                                self.shard),
+            self.counts, path.basename(log_path), self.failed_folders,
+            self.recursive, self.max_depth,
+            getattr(self, "sheet_fingerprint", None), self.folder_positions)
+        write_atomically(dumps(partial), filename)
+        print(f"Wrote the partial of shard {self.shard} to {filename}, "
+              "merge it with `drivereader merge`.")
+        return filename
+
+    def start_page_token(self):
+        """Get the token for changes made on drive from now on."""
+        try:
+            return self.scheduler.execute(self.client().start_page_token)
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+            return None
+
+    def load_state(self, folder_names: list[str]):
+        """Load the state saved by the last incremental run.
+
+        Returns `None` when there is no state, or it was made for another
+        list of folders or another kind of crawl.
+        """
+        try:
+            with open("data/state.json", "r") as file:
+                state = load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state.get("folderNames") != folder_names \
+                or state.get("recursive", False) != self.recursive \
+                or state.get("maxDepth") != self.max_depth:
+            return None
+        return state
+
+    def save_state(self, state: dict[str, Any]):
+        """Save the changes checkpoint, counts and per-file results."""
+        self.state = state
+        state["data"] = self.data
+        write_atomically(dumps(state), "data/state.json")
+
+    def load_checkpoint(self, folder_names: list[str], incremental: bool):
+        """Load the checkpoint saved by an interrupted crawl.
+
+        Returns `None` when there is no checkpoint, or it was saved by a
+        crawl of other folders, of another kind or with another
+        classification sheet.
+        """
+        try:
+            with open(CHECKPOINT_PATH, "r") as file:
+                saved = load(file)
+        except FileNotFoundError:
+            print("There is no crawl to resume, starting over.")
+            return None
+        except ValueError:
+            print("The checkpoint is unreadable, starting over.")
+            return None
+        if saved.get("folderNames") != folder_names \
+                or saved.get("recursive") != self.recursive \
+                or saved.get("maxDepth") != self.max_depth \
+                or (saved.get("state") is not None) != incremental \
+                or saved.get("index") != (self.index and self.index.path) \
+                or saved.get("sheetFingerprint") \
+                != getattr(self, "sheet_fingerprint", None) \
+                or not isinstance(saved.get("exempt"), dict):
+            print("The checkpoint is of another crawl, starting over.")
+            return None
+        if saved["exempt"]["size"] and (
+                not path.exists(self.exempt_path)
+                or path.getsize(self.exempt_path) < saved["exempt"]["size"]):
+            print(f"The exempted files of the checkpoint are missing from "
+                  f"{self.exempt_path}, starting over.")
+            return None
+        return saved
+
+    def save_checkpoint(self, folder_names: list[str],
+                        folders: list[dict[str, str]], aggregate: Aggregate,
+                        state: Optional[dict[str, Any]],
+                        cursor: dict[str, Any]):
+        """Save the progress of a crawl to `data/checkpoint.json`.
+
+        Parameters
+        ----------
+        - folder_names`list[str]`: The names in `folders.json`.
+        - folders`list[dict[str, str]]`: The folders being crawled.
+        - aggregate`Aggregate`: The counts of the pages crawled so far.
+        - state`dict[str, Any]`: The state of an incremental crawl, if any.
+        - cursor`dict[str, Any]`: The `crawl_cursor` to go on from.
+        """
+        if self.index is not None:
+            self.index.commit()
+        write_atomically(dumps({
+            "saved": datetime.now().isoformat(timespec="seconds"),
+            "folderNames": folder_names,
+            "recursive": self.recursive,
+            "maxDepth": self.max_depth,
+            "index": self.index and self.index.path,
+            "sheetFingerprint": getattr(self, "sheet_fingerprint", None),
+            "folders": folders,
+            "folderPositions": self.folder_positions,
+            "cursor": dict(cursor, seen=list(cursor["seen"])),
+            "counts": aggregate.counts.dump(),
+            "exempt": aggregate.exempt.dump(),
+            "failedFolders": self.failed_folders,
+            "state": state
+        }), CHECKPOINT_PATH)
+        self.profile.count("checkpoints")
+
+    def apply_changes(self, state: dict[str, Any]):
+        """Update the counts of the last run with the changes feed.
+
+        Every change replaces the result kept for the file with the result
+        for its current name, or drops it when the file left the folders or
+        was trashed. The counts are then made again from the results of all
+        files. The checkpoint moves forward page by page, so a failed
+        request loses no changes.
+
+        In a recursive crawl, folders created in the crawled folders are
+        followed from then on. Folders moved in or out with their contents
+        need a full rebuild.
+
+        Returns
+        -------
+        - changed`int`: The number of files and folders changed in the
+        crawled folders. When none were and the counts of the last run are
+        still held, they are kept as they are.
+        """
+        changed = 0
+        files: dict[str, list] = state["files"]
+        folders: dict[str, str] = state["folders"]
+        # The parent of every folder, in the order they were crawled.
+        parents: dict[str, Optional[str]] = state.setdefault(
+            "parents", dict.fromkeys(folders))
+        try:
+            while True:
+                response = self.scheduler.execute(
+                    self.client().list_changes,
+                    state["pageToken"],
+                    fields="nextPageToken, newStartPageToken, \
+                        changes(fileId, removed, file(id, name, mimeType, \
+                        parents, trashed, modifiedTime))",
+                    page_size=1000
+                )
+
+                rows, removed = [], []
+                for change in response.get("changes", []):
+                    file_id = change.get("fileId")
+                    file = change.get("file") or {}
+                    parent = next((i for i in file.get("parents", [])
+                                   if i in folders), None)
+                    if change.get("removed") or file.get("trashed") \
+                            or parent is None or file.get("name") is None:
+                        if files.pop(file_id, None) is not None:
+                            removed.append(file_id)
+                            changed += 1
+                        continue
+                    if self.recursive and file.get("mimeType") in (
+                            FOLDER_MIME, SHORTCUT_MIME):
+                        depth, above = 0, parents.get(parent)
+                        while above is not None:
+                            depth, above = depth + 1, parents.get(above)
+                        if file.get("mimeType") == FOLDER_MIME \
+                                and file_id not in folders \
+                                and (self.max_depth is None
+                                     or depth < self.max_depth):
+                            folders[file_id] = folders[parent]
+                            parents[file_id] = parent
+                            changed += 1
+                        continue
+                    key = self.classifier.key(file["name"])
+                    # Keys read back from the state are lists.
+                    if files.get(file_id) != [file["name"], parent,
+                                              key and list(key)]:
+                        changed += 1
+                    # Renamed files keep their place in the listing order.
+                    files[file_id] = [file["name"], parent, key]
+                    if self.index is not None:
+                        rows.append(FileIndex.row(
+                            dict(file, id=file_id),
+                            {"id": parent, "name": folders[parent]}, key
+                        ))
+
+                if self.index is not None:
+                    self.index.remove_files(removed)
+                    self.index.add_files(rows)
+                    self.index.commit()
+
+                if "newStartPageToken" in response:
+                    state["pageToken"] = response["newStartPageToken"]
+                    break
+                state["pageToken"] = response["nextPageToken"]
+
+        except HttpError as error:
+            print(f"An error occurred: {error}")
+
+        if not changed and self.counts is not None:
+            return changed
+        self.counts = CountStore()
+        self.counts.update(Counter(tuple(key) for _, _, key in files.values()
+                                   if key is not None))
+        self.data = self.counts.nested(self.categories)
+        # Rebuild the exempted files in the order of a breadth first crawl.
+        children: dict[Optional[str], list[str]] = {}
+        for folder_id, parent in parents.items():
+            children.setdefault(parent, []).append(folder_id)
+        level, crawled = children.get(None, []), []
+        while level:
+            crawled.extend(level)
+            level = [child for folder_id in level
+                     for child in children.get(folder_id, [])]
+        order = {folder_id: i for i, folder_id in enumerate(crawled)}
+        exempted = [(name, folder_id) for name, folder_id, key
+                    in files.values() if key is None]
+        exempted.sort(key=lambda item: order[item[1]])
+        self.exempt = ExemptLog(self.exempt_path)
+        self.exempt.extend((name, folders[folder_id],
+                            self.classifier.reason(name))
+                           for name, folder_id in exempted)
+        self.exempt.close()
+        return changed
+
+    @property
+    def classifier(self):
+        """The classifier for the current `code_list`."""
+        if self._classifier is None \
+                or self._classifier.code_list is not self.code_list:
+            self._classifier = FileClassifier(self.code_list)
+        return self._classifier
+
+    def parse_file(self, name: str):
+        """Read the category, year and code out of a file name.
+
+        Returns `None` when the name does not follow the naming structure.
+        """
+        return self.classifier.parse(name)
+
+    def count_file(self, key: tuple[Category, Year, Code], delta: int = 1):
+        """Add `delta` to the count of a category, year and code."""
+        category, year, code = key
+        category_data = self.data.setdefault(category, {})
+        year_data = category_data.setdefault(year, {})
+        year_data[code] = year_data.get(code, 0) + delta
+        if year_data[code] <= 0:
+            del year_data[code]
+            if not year_data:
+                del category_data[year]
+
+    def classify_file(self, name:str):
+        """Classify the file in categories based on naming structure."""
+        key = self.parse_file(name)
+        if key is None:
+            return name
+        self.count_file(key)
+
+    def main(self, incremental: bool = False, full_rebuild: bool = False,
+             streaming: bool = False, source_csv: Optional[str] = None,
+             headless: Optional[bool] = None,
+             profile_path: Optional[str] = None,
+             cprofile_path: Optional[str] = None, resume: bool = False):
+        """The main function of DriveReader class.
+
+        With `source_csv`, the file names are read from that CSV file, see
+        `csv_pages`, instead of the folders on drive. `headless` is passed
+        on to `ExcelWorker`. With `resume`, an interrupted crawl goes on
+        from its checkpoint, see `categorize_files`. The profile of the run
+        is appended to `profile_path`, and a cProfile of it dumped to
+        `cprofile_path`, when given.
+        """
+        profiler = None
+        if cprofile_path:
+            profiler = Profile()
+            profiler.enable()
+        try:
+            self.generate_reports(incremental, full_rebuild, streaming,
+                                  source_csv, headless, resume)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(cprofile_path)
+            report = self.profile.report(
+                requests=self.scheduler.stats(), api_calls=self.api_calls,
+                api_bytes=self.api_bytes,
+                failed_folders=len(self.failed_folders),
+                session=self.session and self.session.stats())
+            if profile_path:
+                RunProfile.save(report, profile_path)
+
+    def generate_reports(self, incremental: bool, full_rebuild: bool,
+                         streaming: bool, source_csv: Optional[str],
+                         headless: Optional[bool], resume: bool = False):
+        """Download the sheet, categorize the files and write the reports."""
+        with self.profile.stage("download_sheet"):
+            self.download_sheet()
+        with self.profile.stage("classification"):
+            self.excelWorker = ExcelWorker(streaming, self.sheet_fingerprint,
+                                           headless)
         self.code_list = self.excelWorker.code_list
         self.categories = self.excelWorker.classification_list.values()
-        self.categorize_files()
+        self.categorize_files(
+            incremental=incremental, full_rebuild=full_rebuild,
+            source=csv_pages(source_csv) if source_csv else None,
+            resume=resume)
+        if self.data is not None and self.shard is not None:
+            self.write_partial()
+            return
+        if self.data is not None and self.index is not None:
+            # Build the reports with aggregate queries over the index.
+            with self.profile.stage("index_rollup"):
+                self.index.set_code_list(self.code_list)
+                self.data = self.index.category_counts(self.categories)
         if self.data is not None:
-            with open("data/data.json", "w") as file:
-                data_obj = dumps(self.data, indent=4)
-                file.write(data_obj)
-            with open("data/exempt.json", "w") as file:
-                exempt_obj = dumps(self.exempt, indent=4)
-                file.write(exempt_obj)
-            self.excelWorker.write_data_to_excel(self.data, self.exempt)
-            self.excelWorker.write_naac_data_to_excel(self.data)
-
+            self.excelWorker.write_reports(self.data, self.exempt,
+                                           self.index, self.profile,
+                                           self.counts)
 
 if __name__ == "__main__":
-    # Driver Code
-    try:
-        DR = DriveReader()
-        if DR.creds and DR.creds.valid:
-            DR.main()
-        else:
-            print("Could not run the program due to invalid credentials.")
-            print("Fix credentials and try again.")
-            sysexit()
-    except KeyboardInterrupt:
-        print("\n\nExiting program by interrupt.")
\ No newline at end of file
+    # Driver Code, the same as `drivereader crawl`.
+    from drivereader.cli import main as cli_main
+    sysexit(cli_main(["crawl", *argv[1:]]))
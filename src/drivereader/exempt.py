@@ -0,0 +1,251 @@
+"""
+The files that could not be classified.
+
+An `ExemptLog` appends every exempted file to `data/exempt.jsonl` as the
+pages are classified, one JSON object per line with the name, the folder it
+is reported under and the reason it was exempted:
+
+    {"name": "scan.pdf", "folder": "Folder 1", "reason": "bad_split"}
+
+- `bad_split`: the name has no `DATE_CODE_` prefix.
+- `unknown_code`: the code is not in the classification sheet.
+- `bad_date`: the date does not start with a year and a month.
+
+Only a summary is held in memory: the files of each reason, the folders and
+unknown codes with the most files, and the first files exempted. Memory does
+not grow with the number of files exempted, and the reports show the
+summary rather than a row for every file.
+"""
+
+from collections import Counter
+from heapq import merge, nsmallest
+from json import loads
+from json.encoder import encode_basestring
+from os import makedirs, path, replace
+from shutil import copyfile
+from typing import Any, Callable, Iterable, Iterator
+
+from drivereader.classifier import REASONS, UNKNOWN_CODE
+
+EXEMPT_PATH = "data/exempt.jsonl"
+# The folders, codes and files shown in a summary.
+TOP = 20
+# The most distinct folders and codes counted. Any more are only counted
+# under their reason, so garbled names cannot grow the summary.
+TRACKED = 10000
+# The records encoded before they are written out.
+BLOCK = 1000
+
+
+def read_records(filename: str) -> Iterator[dict[str, str]]:
+    """The records of a log, read one line at a time."""
+    with open(filename, "rb") as file:
+        for line in file:
+            yield loads(line)
+
+
+def top(counter: Counter, number: int):
+    """The `number` items with the most files, ties by name."""
+    return [[name, count] for name, count in nsmallest(
+        number, counter.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def summary_rows(summary: dict[str, Any]):
+    """The rows of the `exempted` sheet of the report.
+
+    Returns
+    -------
+    - rows`list[tuple[bool, list]]`: Whether each row is a header, and its
+    cells: the files of each reason, the folders and unknown codes with the
+    most files, and the first files exempted.
+    """
+    rows: list[tuple[bool, list]] = [(True, ["REASON", "FILES"])]
+    rows.extend((False, [reason, count])
+                for reason, count in summary["reasons"].items())
+    rows.append((False, ["Total", summary["files"]]))
+    for title, items in ((["FOLDER", "FILES"], summary["folders"]),
+                         (["UNKNOWN CODE", "FILES"], summary["codes"]),
+                         (["FILE NAME", "FOLDER NAME", "REASON"],
+                          summary["samples"])):
+        rows.append((False, []))
+        rows.append((True, title))
+        rows.extend((False, list(item)) for item in items)
+    return rows
+
+
+class ExemptLog():
+    """The exempted files, streamed to a JSON Lines log, and their summary.
+
+    The log is replaced when the first file is added. A log with no files
+    added leaves the file alone, and reads as empty.
+
+    Parameters
+    ----------
+    - filename`str`: Where the log is written.
+    - top`int`: How many folders, codes and files the summary shows.
+    """
+
+    def __init__(self, filename: str = EXEMPT_PATH, top: int = TOP) -> None:
+        """Initialize the class."""
+        self.filename = filename
+        self.top = top
+        self.reasons: Counter = Counter()
+        self.folders: Counter = Counter()
+        self.codes: Counter = Counter()
+        self.samples: list[list[str]] = []
+        # The bytes written to the log.
+        self.size = 0
+        self._file = None
+        # How the log is opened next, "ab" once it was started.
+        self._mode = "wb"
+
+    def _handle(self):
+        if self._file is None:
+            directory = path.dirname(self.filename)
+            if directory:
+                makedirs(directory, exist_ok=True)
+            self._file = open(self.filename, self._mode)
+            self._mode = "ab"
+        return self._file
+
+    def _count(self, name: str, folder: str, reason: str):
+        self.reasons[reason] += 1
+        if folder in self.folders or len(self.folders) < TRACKED:
+            self.folders[folder] += 1
+        if reason == UNKNOWN_CODE:
+            code = name.split("_", 2)[1].upper()
+            if code in self.codes or len(self.codes) < TRACKED:
+                self.codes[code] += 1
+        if len(self.samples) < self.top:
+            self.samples.append([name, folder, reason])
+
+    def add(self, name: str, folder: str, reason: str):
+        """Add an exempted file, and the reason it was exempted."""
+        self.extend([(name, folder, reason)])
+
+    def extend(self, records: Iterable[tuple[str, str, str]]):
+        """Add exempted files as `(name, folder, reason)`, in order."""
+        lines: list[str] = []
+        for name, folder, reason in records:
+            self._count(name, folder, reason)
+            # The same line as `dumps` of the record, without its overhead.
+            lines.append(f'{{"name": {encode_basestring(name)}, "folder": '
+                         f'{encode_basestring(folder)}, "reason": '
+                         f'"{reason}"}}')
+            if len(lines) == BLOCK:
+                self._write(lines)
+                lines = []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines: list[str]):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        self._handle().write(data)
+        self.size += len(data)
+
+    def close(self):
+        """Write out the files added so far, and close the log."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def records(self) -> Iterator[dict[str, str]]:
+        """The files of the log as `{name, folder, reason}`, in order."""
+        self.close()
+        if self._mode == "wb":
+            return iter(())
+        return read_records(self.filename)
+
+    def __len__(self):
+        return sum(self.reasons.values())
+
+    def summary(self):
+        """The files of each reason, the folders and unknown codes with
+        the most files, and the first files exempted, for the reports."""
+        return {
+            "files": len(self),
+            "reasons": {reason: self.reasons[reason] for reason in REASONS},
+            "folders": top(self.folders, self.top),
+            "codes": top(self.codes, self.top),
+            "samples": self.samples
+        }
+
+    def save(self, filename: str):
+        """Copy the log to `filename`, unless it is already there."""
+        self.close()
+        if self._mode == "wb":
+            # Nothing was added, so the file left there is not this log.
+            open(f"{filename}.part", "wb").close()
+            replace(f"{filename}.part", filename)
+        elif path.abspath(filename) != path.abspath(self.filename):
+            copyfile(self.filename, filename)
+
+    def dump(self):
+        """The length of the log and its summary, for a checkpoint."""
+        if self._file is not None:
+            self._file.flush()
+        return {
+            "size": self.size,
+            "reasons": dict(self.reasons),
+            "folders": dict(self.folders),
+            "codes": dict(self.codes),
+            "samples": self.samples
+        }
+
+    @classmethod
+    def resume(cls, saved: dict[str, Any], filename: str = EXEMPT_PATH,
+               top: int = TOP):
+        """The log of a checkpoint, cut back to where it was saved.
+
+        Raises a `ValueError` when the log is shorter than it was then.
+        """
+        log = cls(filename, top)
+        log.reasons.update(saved["reasons"])
+        log.folders.update(saved["folders"])
+        log.codes.update(saved["codes"])
+        log.samples = saved["samples"]
+        if not saved["size"]:
+            # Nothing was logged yet, so the log is started on the next file.
+            return log
+        if not path.exists(filename) or path.getsize(filename) < saved["size"]:
+            raise ValueError(f"{filename} is not the log of the checkpoint.")
+        log._file = open(filename, "r+b")
+        log._file.truncate(saved["size"])
+        log._file.seek(saved["size"])
+        log._mode = "ab"
+        log.size = saved["size"]
+        return log
+
+    @classmethod
+    def read(cls, filename: str = EXEMPT_PATH, top: int = TOP):
+        """The log written by an earlier run, with its summary."""
+        log = cls(filename, top)
+        for record in read_records(filename):
+            log._count(record["name"], record["folder"], record["reason"])
+        log._mode = "ab"
+        log.size = path.getsize(filename)
+        return log
+
+    @classmethod
+    def merged(cls, filenames: Iterable[str],
+               position: Callable[[str], Any], filename: str = EXEMPT_PATH,
+               top: int = TOP):
+        """A log of the files of other logs, by the position of their folder.
+
+        The logs are read as streams, so each must be in the order of
+        `position` for the result to be. The files of equal positions keep
+        the order of their log, and of `filenames`.
+        """
+        log = cls(f"{filename}.part", top)
+        log.extend((record["name"], record["folder"], record["reason"])
+                   for record in merge(*map(read_records, filenames),
+                                       key=lambda record:
+                                       position(record["folder"])))
+        log.close()
+        if log._mode == "wb":
+            open(log.filename, "wb").close()
+            log._mode = "ab"
+        replace(log.filename, filename)
+        log.filename = filename
+        return log
+
@@ -0,0 +1,526 @@
+"""
+An in-process drive backend for tests and benchmarks.
+
+`FakeDriveBackend` implements `DriveBackend` on an in-memory tree of
+folders and files, which can be generated at any size. Page sizes, the
+latency of every request and the rate of failed requests are configurable,
+so the throughput of a crawl can be measured offline and reproducibly.
+Like the connections of the workers of a real crawl, `connect` gives each
+worker a backend of its own on the same drive:
+
+    drive = FakeDriveBackend.generate(folders=100)
+    reader = DriveReader(backend_factory=drive.connect, workers=8)
+"""
+
+from datetime import datetime, timedelta
+from json import dumps
+from random import Random
+from re import compile as re_compile
+from threading import Lock
+from time import sleep
+from typing import Any, BinaryIO, Iterable, Optional
+
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+from drivereader.backend import DriveBackend, name_match
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+SHORTCUT_MIME = "application/vnd.google-apps.shortcut"
+FILE_MIME = "application/pdf"
+SHEET_MIME = "application/vnd.google-apps.spreadsheet"
+# Modification times start here and advance a second with every change.
+EPOCH = datetime(2023, 1, 1)
+
+_TOKEN = re_compile(r"\s*(?:(?P<string>'(?:\\.|[^'\\])*')|(?P<op>!=|=|\(|\))"
+                    r"|(?P<word>[A-Za-z_]+))")
+
+
+def _tokenize(query: str) -> list[tuple[str, str]]:
+    """Split a drive query into (kind, value) tokens."""
+    tokens, position, query = [], 0, query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None:
+            raise ValueError(f"Invalid query near: {query[position:]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("\\'", "'").replace("\\\\", "\\")
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _QueryParser():
+    """A recursive descent parser for the subset of the query language
+    used by this project.
+
+    Supported terms are `name contains 'x'`, `<field> = 'x'`,
+    `<field> != 'x'`, `trashed = true|false` and `'id' in parents`,
+    combined with `and`, `or`, `not` and parentheses.
+    """
+
+    def __init__(self, query: str) -> None:
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def parse(self):
+        tree = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected token {self.tokens[self.position]}")
+        return tree
+
+    def _peek(self) -> tuple[str, str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return ("end", "")
+
+    def _take(self) -> tuple[str, str]:
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _or(self):
+        terms = [self._and()]
+        while self._peek() == ("word", "or"):
+            self._take()
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def _and(self):
+        terms = [self._not()]
+        while self._peek() == ("word", "and"):
+            self._take()
+            terms.append(self._not())
+        return terms[0] if len(terms) == 1 else ("and", terms)
+
+    def _not(self):
+        if self._peek() == ("word", "not"):
+            self._take()
+            return ("not", self._not())
+        return self._atom()
+
+    def _atom(self):
+        kind, value = self._take()
+        if (kind, value) == ("op", "("):
+            tree = self._or()
+            if self._take() != ("op", ")"):
+                raise ValueError("Unbalanced parentheses in query.")
+            return tree
+        if kind == "string":
+            if self._take() != ("word", "in"):
+                raise ValueError("Expected `in` after a literal.")
+            _, field = self._take()
+            return ("in", field, value)
+        if kind == "word":
+            _, operator = self._take()
+            _, literal = self._take()
+            if literal in ("true", "false"):
+                literal = literal == "true"
+            return (operator, value, literal)
+        raise ValueError(f"Unexpected token {(kind, value)}")
+
+
+def _matches(tree, file: dict[str, Any]) -> bool:
+    """Evaluate a parsed query against a single file resource."""
+    operator = tree[0]
+    if operator == "or":
+        return any(_matches(term, file) for term in tree[1])
+    if operator == "and":
+        return all(_matches(term, file) for term in tree[1])
+    if operator == "not":
+        return not _matches(tree[1], file)
+    _, field, literal = tree
+    if operator == "in":
+        return literal in file.get(field, [])
+    if operator == "contains":
+        return name_match(literal, file.get(field, "")) in (0, 1)
+    if operator == "=":
+        return file.get(field) == literal
+    if operator == "!=":
+        return file.get(field) != literal
+    raise ValueError(f"Unsupported operator {operator}")
+
+
+def _parent_of(tree) -> Optional[str]:
+    """Find a top level `'id' in parents` term to narrow the search."""
+    if tree[0] == "in" and tree[1] == "parents":
+        return tree[2]
+    if tree[0] == "and":
+        for term in tree[1]:
+            parent = _parent_of(term)
+            if parent is not None:
+                return parent
+    return None
+
+
+def _mime_type_of(tree) -> Optional[str]:
+    """Find a top level `mimeType = 'x'` term to narrow the search."""
+    if tree[0] == "=" and tree[1] == "mimeType":
+        return tree[2]
+    if tree[0] == "and":
+        for term in tree[1]:
+            mime_type = _mime_type_of(term)
+            if mime_type is not None:
+                return mime_type
+    return None
+
+
+def _projection(fields: Optional[str]) -> Optional[list[str]]:
+    """Read the requested file fields out of a `fields` parameter."""
+    if not fields or "files(" not in fields:
+        return None
+    inner = fields.split("files(", 1)[1].rsplit(")", 1)[0]
+    return [field.strip() for field in inner.split(",") if field.strip()]
+
+
+class FakeDriveBackend(DriveBackend):
+    """A thread safe, in-memory drive.
+
+    Parameters
+    ----------
+    - page_size`int`: The largest page returned, like the page size limit
+    of the API. Requests that do not ask for a page size get 100 at most.
+    - latency`float`: Seconds to sleep in every request.
+    - error_rate`float`: The share of requests that fail with an
+    `HttpError` of `error_status`, decided by a generator seeded with `seed`.
+    - error_status`int`: The status of the injected errors.
+
+    The backends made by `connect` share the tree, the page tokens, the
+    settings and the injected errors of this one, and their requests are
+    also counted in its `calls`, `bytes` and `errors`.
+    """
+
+    def __init__(self, page_size: int = 1000, latency: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503,
+                 seed: int = 0) -> None:
+        """Initialize the class."""
+        super().__init__()
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.errors = 0
+        self._errors = Random(seed)
+        self.files_by_id: dict[str, dict[str, Any]] = {}
+        self.children: dict[str, list[str]] = {}
+        self.folders: list[str] = []
+        # The files matched by the listings with more pages, by listing.
+        self._cursors: dict[str, list[str]] = {}
+        # The exported contents of spreadsheets, by file id.
+        self.exports: dict[str, bytes] = {}
+        # Every change made to the tree, as (file id, removed).
+        self.change_log: list[tuple[str, bool]] = []
+        self._next_id = 0
+        self._lock = Lock()
+        # The backend whose tree, settings and counters this one shares.
+        self.drive = self
+
+    def connect(self) -> "FakeDriveBackend":
+        """A new backend on the same drive, for another worker."""
+        backend = FakeDriveBackend()
+        for name in ("files_by_id", "children", "folders", "_cursors",
+                     "exports", "change_log", "_lock"):
+            setattr(backend, name, getattr(self.drive, name))
+        backend.drive = self.drive
+        return backend
+
+    def count_call(self, number: int = 1):
+        super().count_call(number)
+        if self.drive is not self:
+            self.drive.count_call(number)
+
+    def count_bytes(self, number: int):
+        super().count_bytes(number)
+        if self.drive is not self:
+            self.drive.count_bytes(number)
+
+    @classmethod
+    def generate(cls, folders: int = 10, files_per_folder: int = 100,
+                 codes: Iterable[str] = ("RPIF", "CONF", "JOUR"),
+                 exempt_ratio: float = 0.1, seed: int = 0,
+                 subfolders: int = 0, depth: int = 0, **kwargs
+                 ) -> "FakeDriveBackend":
+        """Build a fake drive with a reproducible tree of named files.
+
+        Folders are named `Folder 0`, `Folder 1`, ... and every file follows
+        the `YYYYMMDD_CODE_extra` convention, except for roughly
+        `exempt_ratio` of them, which are given names that cannot be
+        classified. With `depth`, every folder also has `subfolders`
+        sub-folders named `Part 0`, `Part 1`, ..., down to `depth` levels,
+        each with `files_per_folder` files of its own.
+        """
+        backend = cls(seed=seed, **kwargs)
+        random = Random(seed)
+        codes = list(codes)
+
+        def fill(folder_id: str, number: int, level: int):
+            for index in range(files_per_folder):
+                if random.random() < exempt_ratio:
+                    name = f"scan {number}-{index}.pdf"
+                else:
+                    year = random.randint(2015, 2023)
+                    month = random.randint(1, 12)
+                    code = random.choice(codes)
+                    name = f"{year}{month:02d}01_{code}_{index}.pdf"
+                backend.add_file(name, folder_id)
+            if level < depth:
+                for part in range(subfolders):
+                    fill(backend.add_folder(f"Part {part}", folder_id),
+                         number, level + 1)
+
+        for number in range(folders):
+            fill(backend.add_folder(f"Folder {number}"), number, 0)
+        return backend
+
+    def _modified_time(self) -> str:
+        moment = EPOCH + timedelta(seconds=len(self.change_log))
+        return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def _new_id(self) -> str:
+        self.drive._next_id += 1
+        return f"id{self.drive._next_id:08d}"
+
+    def add_folder(self, name: str, parent: Optional[str] = None) -> str:
+        """Create a folder and return its id."""
+        return self.add_file(name, parent, FOLDER_MIME)
+
+    def add_file(self, name: str, parent: Optional[str] = None,
+                 mime_type: str = FILE_MIME) -> str:
+        """Create a file and return its id."""
+        with self._lock:
+            file_id = self._new_id()
+            self.files_by_id[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent] if parent else [],
+                "trashed": False,
+                "modifiedTime": self._modified_time(),
+            }
+            if parent:
+                self.children.setdefault(parent, []).append(file_id)
+            if mime_type == FOLDER_MIME:
+                self.folders.append(file_id)
+            self.change_log.append((file_id, False))
+            return file_id
+
+    def add_shortcut(self, name: str, target: str,
+                     parent: Optional[str] = None) -> str:
+        """Create a shortcut to another file and return its id."""
+        file_id = self.add_file(name, parent, SHORTCUT_MIME)
+        with self._lock:
+            self.files_by_id[file_id]["shortcutDetails"] = {
+                "targetId": target,
+                "targetMimeType": self.files_by_id[target]["mimeType"]
+            }
+        return file_id
+
+    def add_parent(self, file_id: str, parent: str) -> None:
+        """Put a file in one more folder, as older drives allowed."""
+        with self._lock:
+            self.files_by_id[file_id]["parents"].append(parent)
+            self.children.setdefault(parent, []).append(file_id)
+            self.change_log.append((file_id, False))
+
+    def rename(self, file_id: str, name: str) -> None:
+        """Rename a file."""
+        with self._lock:
+            self.files_by_id[file_id]["name"] = name
+            self.files_by_id[file_id]["modifiedTime"] = self._modified_time()
+            self.change_log.append((file_id, False))
+
+    def trash(self, file_id: str) -> None:
+        """Move a file to the trash."""
+        with self._lock:
+            self.files_by_id[file_id]["trashed"] = True
+            self.files_by_id[file_id]["modifiedTime"] = self._modified_time()
+            self.change_log.append((file_id, False))
+
+    def move(self, file_id: str, parent: str) -> None:
+        """Move a file into another folder."""
+        with self._lock:
+            file = self.files_by_id[file_id]
+            for old_parent in file["parents"]:
+                self.children[old_parent].remove(file_id)
+            file["parents"] = [parent]
+            file["modifiedTime"] = self._modified_time()
+            self.children.setdefault(parent, []).append(file_id)
+            self.change_log.append((file_id, False))
+
+    def remove(self, file_id: str) -> None:
+        """Delete a file permanently."""
+        with self._lock:
+            file = self.files_by_id.pop(file_id)
+            for parent in file["parents"]:
+                self.children[parent].remove(file_id)
+            if file["mimeType"] == FOLDER_MIME:
+                self.folders.remove(file_id)
+            self.change_log.append((file_id, True))
+
+    def add_sheet(self, name: str, content: bytes,
+                  parent: Optional[str] = None) -> str:
+        """Create a spreadsheet that exports as `content`."""
+        file_id = self.add_file(name, parent, SHEET_MIME)
+        with self._lock:
+            self.files_by_id[file_id]["version"] = "1"
+            self.exports[file_id] = content
+        return file_id
+
+    def update_sheet(self, file_id: str, content: bytes) -> None:
+        """Replace the contents of a spreadsheet."""
+        with self._lock:
+            file = self.files_by_id[file_id]
+            file["version"] = str(int(file["version"]) + 1)
+            file["modifiedTime"] = self._modified_time()
+            self.exports[file_id] = content
+            self.change_log.append((file_id, False))
+
+    def _failure(self) -> Optional[HttpError]:
+        """Decide whether a request fails, and with which error."""
+        drive = self.drive
+        if not drive.error_rate:
+            return None
+        with self._lock:
+            failed = drive._errors.random() < drive.error_rate
+            drive.errors += failed
+            if drive is not self:
+                self.errors += failed
+        if not failed:
+            return None
+        reason = "rateLimitExceeded" if drive.error_status in (403, 429) \
+            else "backendError"
+        return HttpError(Response({"status": drive.error_status}),
+                         dumps({"error": {
+                             "errors": [{"reason": reason}],
+                             "message": "Injected error."
+                         }}).encode(), uri="fake://drive")
+
+    def _request(self) -> None:
+        """Count a request, wait for its latency and maybe fail it."""
+        self.count_call()
+        if self.drive.latency:
+            sleep(self.drive.latency)
+        error = self._failure()
+        if error is not None:
+            raise error
+
+    def _respond(self, response: dict[str, Any]) -> dict[str, Any]:
+        """Count the size of a response as it would be sent."""
+        self.count_bytes(len(dumps(response)))
+        return response
+
+    def list_files(self, query, fields=None, page_token=None, page_size=None):
+        self._request()
+        return self._respond(self._list_page(query, fields, page_token,
+                                             page_size))
+
+    def batch_list_files(self, requests):
+        # One round trip, in which every request may fail on its own.
+        self._request()
+        results = []
+        for request in requests:
+            error = self._failure()
+            if error is not None:
+                results.append(error)
+            else:
+                results.append(self._respond(self._list_page(**request)))
+        return results
+
+    def _list_page(self, query, fields=None, page_token=None, page_size=None):
+        """One page of the files matching a query."""
+        page_size = min(page_size or 100, self.drive.page_size)
+        with self._lock:
+            if page_token is None:
+                tree = _QueryParser(query).parse() if query else ("and", [])
+                parent = _parent_of(tree)
+                if parent is not None:
+                    candidates = self.children.get(parent, [])
+                elif _mime_type_of(tree) == FOLDER_MIME:
+                    candidates = self.folders
+                else:
+                    candidates = list(self.files_by_id)
+                matched = [file_id for file_id in candidates
+                           if _matches(tree, self.files_by_id[file_id])]
+                listing, offset = f"page{self._new_id()}", 0
+            else:
+                # Failed requests can be repeated with the same token.
+                listing, _, start = page_token.rpartition(":")
+                matched, offset = self._cursors[listing], int(start)
+            page = [self.files_by_id[file_id]
+                    for file_id in matched[offset:offset + page_size]]
+            response: dict[str, Any] = {"kind": "drive#fileList"}
+            if offset + page_size < len(matched):
+                self._cursors[listing] = matched
+                response["nextPageToken"] = f"{listing}:{offset + page_size}"
+            else:
+                # The last page was served, the listing is done with.
+                self._cursors.pop(listing, None)
+
+        projection = _projection(fields) or ["kind", "id", "name", "mimeType"]
+        response["files"] = [
+            {field: file[field] for field in projection if field in file}
+            for file in page
+        ]
+        return response
+
+    def _not_found(self, file_id: str) -> HttpError:
+        """The error drive answers with for an unknown file."""
+        return HttpError(Response({"status": 404}), dumps({"error": {
+            "errors": [{"reason": "notFound"}],
+            "message": f"File not found: {file_id}."
+        }}).encode(), uri="fake://drive")
+
+    def get_file(self, file_id, fields=None):
+        self._request()
+        with self._lock:
+            if file_id not in self.files_by_id:
+                raise self._not_found(file_id)
+            file = dict(self.files_by_id[file_id])
+        if not fields:
+            return self._respond({field: file[field] for field
+                                  in ("id", "name", "mimeType")})
+        return self._respond({field: file[field] for field in
+                              (field.strip() for field in fields.split(","))
+                              if field in file})
+
+    def export_file(self, file_id, mime_type, file: BinaryIO,
+                    chunksize=1024 * 1024):
+        if file_id not in self.exports:
+            self._request()
+            raise self._not_found(file_id)
+        content = self.exports[file_id]
+        for start in range(0, max(len(content), 1), chunksize):
+            self._request()
+            file.write(content[start:start + chunksize])
+        self.count_bytes(len(content))
+        return len(content)
+
+    def start_page_token(self):
+        self._request()
+        with self._lock:
+            return str(len(self.change_log))
+
+    def list_changes(self, page_token, fields=None, page_size=None):
+        self._request()
+        page_size = min(page_size or 100, self.drive.page_size)
+        with self._lock:
+            start = int(page_token)
+            stop = min(start + page_size, len(self.change_log))
+            changes = []
+            for file_id, removed in self.change_log[start:stop]:
+                change = {"kind": "drive#change", "changeType": "file",
+                          "fileId": file_id, "removed": removed}
+                if not removed and file_id in self.files_by_id:
+                    change["file"] = dict(self.files_by_id[file_id])
+                else:
+                    change["removed"] = True
+                changes.append(change)
+            response: dict[str, Any] = {"kind": "drive#changeList",
+                                        "changes": changes}
+            if stop < len(self.change_log):
+                response["nextPageToken"] = str(stop)
+            else:
+                response["newStartPageToken"] = str(stop)
+        return self._respond(response)
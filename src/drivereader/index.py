@@ -0,0 +1,173 @@
+"""
+A persistent SQLite index of the files crawled on drive.
+
+Every file listed by `DriveReader.categorize_files` is stored with its
+parents, modification time and the date, code and category read from its
+name, so that questions about the crawl can be answered with SQL instead of
+crawling drive again. The reports are built from aggregate queries over the
+index.
+"""
+
+from json import dumps
+from sqlite3 import connect
+from typing import Iterable, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    parents TEXT,
+    folder_id TEXT,
+    folder_name TEXT,
+    modified_time TEXT,
+    date TEXT,
+    category TEXT,
+    year TEXT,
+    code TEXT
+);
+CREATE INDEX IF NOT EXISTS files_code ON files (code);
+CREATE INDEX IF NOT EXISTS files_year ON files (year, code);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder_id);
+CREATE TABLE IF NOT EXISTS code_classifications (
+    code TEXT NOT NULL,
+    classification TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS code_classifications_code
+    ON code_classifications (code);
+"""
+
+
+class FileIndex():
+    """An on-disk index of file id, name, parents, modifiedTime, parsed
+    date/code and classification result.
+
+    Parameters
+    ----------
+    - path`str`: The SQLite database file, created if missing.
+    """
+
+    def __init__(self, path: str = "data/index.sqlite3") -> None:
+        """Initialize the class."""
+        self.path = path
+        self.connection = connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """Commit any pending writes and close the database."""
+        self.connection.commit()
+        self.connection.close()
+
+    def count(self):
+        """The number of files in the index."""
+        return self.connection.execute("SELECT COUNT(*) FROM files"
+                                       ).fetchone()[0]
+
+    def clear(self):
+        """Remove every file, before a full crawl."""
+        self.connection.execute("DELETE FROM files")
+
+    @staticmethod
+    def row(file: dict, folder: dict[str, str],
+            key: Optional[tuple[str, str, str]]):
+        """Build the index row for a listed file.
+
+        Parameters
+        ----------
+        - file`dict`: The file resource from drive.
+        - folder`dict[str, str]`: The `id` and `name` of its folder.
+        - key`tuple[str, str, str]`: The category, year and code of the
+        file, or `None` if it is exempted.
+        """
+        name = file["name"]
+        category, year, code = key or (None, None, None)
+        date = name.split("_", 1)[0] if key else None
+        return (file["id"], name, dumps(file.get("parents", [])),
+                folder["id"], folder["name"], file.get("modifiedTime"),
+                date, category, year, code)
+
+    def add_files(self, rows: Iterable[tuple]):
+        """Insert or replace rows built by `row` in one statement."""
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def remove_files(self, file_ids: Iterable[str]):
+        """Remove files from the index."""
+        self.connection.executemany("DELETE FROM files WHERE id = ?",
+                                    ((file_id,) for file_id in file_ids))
+
+    def commit(self):
+        """Commit the writes made so far."""
+        self.connection.commit()
+
+    def set_code_list(self, code_list: dict[str, list]):
+        """Store the NAAC classifications of every code."""
+        self.connection.execute("DELETE FROM code_classifications")
+        self.connection.executemany(
+            "INSERT INTO code_classifications VALUES (?, ?)",
+            ((code, classification)
+             for code, (name, category, classifications) in code_list.items()
+             for classification in classifications)
+        )
+        self.connection.commit()
+
+    def category_counts(self, categories: Iterable[str] = ()):
+        """Count the classified files by category, year and code.
+
+        The result has the same layout and order as `DriveReader.data`:
+        the given categories first, years newest first and codes sorted.
+        """
+        data: dict[str, dict[str, dict[str, int]]] = {
+            category: {} for category in categories}
+        rows = self.connection.execute(
+            """SELECT category, year, code, COUNT(*) FROM files
+               WHERE category IS NOT NULL
+               GROUP BY category, year, code
+               ORDER BY MIN(MIN(rowid)) OVER (PARTITION BY category),
+                        year DESC, code"""
+        )
+        for category, year, code, count in rows:
+            data.setdefault(category, {}).setdefault(year, {})[code] = count
+        return data
+
+    def exempt_files(self):
+        """The names and folders of the files that were not classified."""
+        return [tuple(row) for row in self.connection.execute(
+            """SELECT name, folder_name FROM files WHERE category IS NULL
+               ORDER BY rowid"""
+        )]
+
+    def classification_counts(self, year: str):
+        """Count the files of a year under each NAAC classification."""
+        return dict(self.connection.execute(
+            """SELECT classification, COUNT(*) FROM files
+               JOIN code_classifications USING (code)
+               WHERE year = ?
+               GROUP BY classification ORDER BY classification""",
+            (year,)
+        ))
+
+    def classification_counts_by_year(self):
+        """Count the files of every year under each NAAC classification,
+        newest year first, in one query."""
+        rollup: dict[str, dict[str, int]] = {}
+        for year, classification, count in self.connection.execute(
+                """SELECT year, classification, COUNT(*) FROM files
+                   JOIN code_classifications USING (code)
+                   GROUP BY year, classification
+                   ORDER BY year DESC, classification"""):
+            rollup.setdefault(year, {})[classification] = count
+        return rollup
+
+    def code_counts(self, folder_name: Optional[str] = None,
+                    year: Optional[str] = None):
+        """Count the files by code, optionally for one folder or year."""
+        return dict(self.connection.execute(
+            """SELECT code, COUNT(*) FROM files
+               WHERE code IS NOT NULL
+                 AND (:folder IS NULL OR folder_name = :folder)
+                 AND (:year IS NULL OR year = :year)
+               GROUP BY code ORDER BY code""",
+            {"folder": folder_name, "year": year}
+        ))
@@ -0,0 +1,380 @@
+"""
+The stages that `DriveReader.categorize_files` is built from.
+
+A crawl is a chain of generators, each pulling from the one before it:
+
+    pages -> classify -> run(sinks)
+
+A source yields `Page`s of file records, either from drive through
+`DriveReader.walk`, or from local files: a CSV file through `csv_pages`, a
+dump of one name per line through `name_pages`, or a directory tree, e.g.
+a mirrored archive, through `directory_pages`.
+`classify` adds the category, year and code of every file, or why it has
+none, and `run` hands each classified page to the sinks: `Aggregate` counts
+the files and streams the exempted ones to an `ExemptLog`, while
+`StateRecorder` and `IndexWriter` keep the results for incremental runs and
+the SQLite index, and `Checkpoint` saves the progress of a crawl so that an
+interrupted one can be resumed. Every stage holds one page at a time, and
+`ordered` lets concurrent listings feed the chain through small bounded
+queues, so memory stays bounded by the page size rather than the size of
+the drive.
+"""
+
+from csv import DictReader
+from concurrent.futures import Executor
+from functools import partial
+from itertools import chain
+from mmap import ACCESS_READ, mmap
+from os import path, scandir
+from queue import Empty, Full, Queue
+from threading import Event
+from time import monotonic
+from typing import Any, Callable, Iterable, NamedTuple, Optional, TypeVar
+
+from drivereader.classifier import FileClassifier, Key
+from drivereader.counts import CountStore
+from drivereader.exempt import ExemptLog
+from drivereader.index import FileIndex
+from drivereader.profiler import RunProfile, timed
+
+Category = TypeVar("Category", bound=str)
+Name = TypeVar("Name", bound=str)
+
+# The pages a listing may run ahead of the one being classified.
+QUEUE_PAGES = 2
+
+
+class Page(NamedTuple):
+    """One page of file records.
+
+    - folder`dict[str, str]`: The `id` of the folder the files are in, and
+    the `name` they are reported under, i.e. that of the crawled folder.
+    - parent`str`: The id of the folder's parent in a recursive crawl, or
+    `None` for a crawled folder.
+    - files`list[dict[str, Any]]`: The files, each with an `id` and `name`.
+    """
+    folder: dict[str, str]
+    parent: Optional[str]
+    files: list[dict[str, Any]]
+
+
+class Classified(NamedTuple):
+    """A page with the category, year and code of every file, or `None`
+    where the file could not be classified, and then the reason why.
+    `reasons` is `None` when every file was classified."""
+    folder: dict[str, str]
+    parent: Optional[str]
+    files: list[dict[str, Any]]
+    keys: list[Optional[Key]]
+    reasons: Optional[list[Optional[str]]] = None
+
+
+def ordered(listings: list[Callable[[], Iterable[Any]]],
+            executor: Executor, depth: int = QUEUE_PAGES):
+    """Run listings concurrently, yielding their items in the given order.
+
+    Every listing fills its own queue of `depth` items, so a listing that
+    runs ahead of the consumer waits rather than piling up pages.
+    Listings are started in order, so the one being consumed always has a
+    thread. An error in a listing is raised where its items are consumed.
+    """
+    done, stop = object(), Event()
+    queues = [Queue(depth) for _ in listings]
+
+    def put(queue: Queue, item: Any):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def fill(listing: Callable[[], Iterable[Any]], queue: Queue):
+        # The end of the listing is always queued, even after an error that
+        # is not an `Exception`, so the consumer never waits for it forever.
+        error = None
+        try:
+            for item in listing():
+                if not put(queue, (item, None)):
+                    return
+        except BaseException as raised:
+            error = raised
+        finally:
+            put(queue, (done, error))
+
+    for listing, queue in zip(listings, queues):
+        executor.submit(fill, listing, queue)
+    try:
+        for queue in queues:
+            while True:
+                try:
+                    item, error = queue.get(timeout=0.1)
+                except Empty:
+                    continue
+                if item is done:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+    finally:
+        # Let listings still running give up, e.g. after an error.
+        stop.set()
+
+
+def mapped_blocks(file_path: str, block_size: int = 1 << 20):
+    """Blocks of whole lines of a UTF-8 text file, read through a memory
+    map and decoded one block at a time."""
+    with open(file_path, "rb") as file:
+        try:
+            mapped = mmap(file.fileno(), 0, access=ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            return
+        with mapped:
+            start = 3 if mapped[:3] == b"\xef\xbb\xbf" else 0
+            while start < len(mapped):
+                end = mapped.find(b"\n", start + block_size) + 1 \
+                    or len(mapped)
+                yield mapped[start:end].decode("utf-8")
+                start = end
+
+
+def mapped_lines(file_path: str):
+    """The lines of a UTF-8 text file, with their line endings, as `csv`
+    expects."""
+    for block in mapped_blocks(file_path):
+        lines = block.split("\n")
+        last = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        if last:
+            yield last
+
+
+def csv_pages(csv_path: str, page_size: int = 1000):
+    """Read file names from a local CSV file instead of drive.
+
+    The file has a header with a `name` column and, optionally, a `folder`
+    and an `id` column. Rows of the same folder in a row make up a page.
+    """
+    folder: Optional[str] = None
+    files: list[dict[str, Any]] = []
+    for number, row in enumerate(DictReader(mapped_lines(csv_path)), 2):
+        row_folder = row.get("folder") or ""
+        if files and (row_folder != folder or len(files) >= page_size):
+            yield Page({"id": folder, "name": folder}, None, files)
+            files = []
+        folder = row_folder
+        files.append({"id": row.get("id") or f"{csv_path}:{number}",
+                      "name": row["name"]})
+    if files:
+        yield Page({"id": folder, "name": folder}, None, files)
+
+
+def name_pages(dump_path: str, page_size: int = 1000, folder: str = ""):
+    """Read file names from a dump with one name per line.
+
+    Blank lines are skipped, and every name is reported under `folder`.
+    """
+    reported = {"id": folder, "name": folder}
+    files: list[dict[str, Any]] = []
+    number = 0
+    for block in mapped_blocks(dump_path):
+        lines = block.split("\n")
+        if not lines[-1]:
+            lines.pop()
+        for number, name in enumerate(lines, number + 1):
+            name = name.rstrip("\r")
+            if not name:
+                continue
+            files.append({"id": f"{dump_path}:{number}", "name": name})
+            if len(files) >= page_size:
+                yield Page(reported, None, files)
+                files = []
+    if files:
+        yield Page(reported, None, files)
+
+
+def scan(directory: str):
+    """The names of the files in a directory, and its sub-directories.
+
+    Both are sorted, and links to directories are not followed.
+    """
+    files: list[str] = []
+    directories: list[str] = []
+    with scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.name)
+    files.sort()
+    directories.sort()
+    return files, directories
+
+
+def directory_pages(root: str, executor: Optional[Executor] = None,
+                    page_size: int = 1000):
+    """Read the file names in a directory tree instead of drive.
+
+    The tree is walked breadth first, like a recursive crawl of drive.
+    Every sub-directory of `root` stands for a crawled folder, and the
+    files below it are reported under its name. Files right in `root` are
+    reported under the name of `root`. The directories of a level are
+    scanned together on the `executor`, if given, and the pages come out
+    in the same order either way.
+    """
+    root = path.abspath(root)
+
+    def listing(directory: str, name: str, parent: Optional[str]):
+        files, directories = scan(directory)
+        folder_id = path.relpath(directory, root)
+        folder = {"id": folder_id, "name": name}
+        for start in range(0, max(len(files), 1), page_size):
+            yield Page(folder, parent, [
+                {"id": path.join(folder_id, file), "name": file}
+                for file in files[start:start + page_size]])
+        yield [(child, path.basename(child) if directory == root else name,
+                folder_id) for child in directories]
+
+    level = [(root, path.basename(root), None)]
+    while level:
+        listings = [partial(listing, *entry) for entry in level]
+        if executor is None:
+            items = chain.from_iterable(listing() for listing in listings)
+        else:
+            items = ordered(listings, executor)
+        level = []
+        for item in items:
+            if isinstance(item, Page):
+                yield item
+            else:
+                level.extend(item)
+
+
+def classify(pages: Iterable[Page], classifier: FileClassifier,
+             profile: Optional[RunProfile] = None):
+    """Classify every page of file records, timed as stage `classify`."""
+    for page in pages:
+        with timed(profile, "classify"):
+            names = [file["name"] for file in page.files]
+            keys = classifier.keys(names)
+            reasons = classifier.reasons(names, keys) if None in keys \
+                else None
+        yield Classified(page.folder, page.parent, page.files, keys, reasons)
+
+
+def run(classified: Iterable[Classified], sinks: Iterable[Any],
+        profile: Optional[RunProfile] = None):
+    """Hand every classified page to each of the sinks, in order.
+
+    Each sink is timed as a stage named after its class.
+    """
+    sinks = [(sink, type(sink).__name__) for sink in sinks]
+    for page in classified:
+        for sink, name in sinks:
+            with timed(profile, name):
+                sink.add(page)
+
+
+class Aggregate():
+    """Count the classified files and log the ones that were not.
+
+    Parameters
+    ----------
+    - exempt`ExemptLog`: Where the files that were not classified go, a log
+    at `data/exempt.jsonl` if omitted.
+    """
+
+    def __init__(self, exempt: Optional[ExemptLog] = None) -> None:
+        """Initialize the class."""
+        self.counts = CountStore()
+        self.exempt = exempt if exempt is not None else ExemptLog()
+
+    def add(self, page: Classified):
+        """Add a page to the counts."""
+        self.counts.update(filter(None, page.keys))
+        if page.reasons is not None:
+            name = page.folder["name"]
+            self.exempt.extend((file["name"], name, reason) for file, reason
+                               in zip(page.files, page.reasons)
+                               if reason is not None)
+
+    def emit(self, categories: Iterable[Category] = ()):
+        """The counts as `{category: {year: {code: count}}}`, sorted."""
+        return self.counts.nested(categories)
+
+
+class StateRecorder():
+    """Keep the folders and the result of every file for incremental runs.
+
+    Parameters
+    ----------
+    - state`dict[str, Any]`: The state saved in `data/state.json`.
+    """
+
+    def __init__(self, state: dict[str, Any]) -> None:
+        """Initialize the class."""
+        self.state = state
+
+    def add(self, page: Classified):
+        """Record the folder and files of a page."""
+        folder_id = page.folder["id"]
+        self.state["folders"].setdefault(folder_id, page.folder["name"])
+        self.state["parents"].setdefault(folder_id, page.parent)
+        files = self.state["files"]
+        for file, key in zip(page.files, page.keys):
+            files[file["id"]] = [file["name"], folder_id, key]
+
+
+class IndexWriter():
+    """Write every classified file to the SQLite index.
+
+    Parameters
+    ----------
+    - index`FileIndex`: The index to write to.
+    """
+
+    def __init__(self, index: FileIndex) -> None:
+        """Initialize the class."""
+        self.index = index
+
+    def add(self, page: Classified):
+        """Insert the files of a page."""
+        self.index.add_files([FileIndex.row(file, page.folder, key)
+                              for file, key in zip(page.files, page.keys)])
+
+
+class Checkpoint():
+    """Save the progress of a crawl every `interval` seconds.
+
+    As the last sink, it sees a page once every other sink has taken it
+    in, so the progress it saves is always that of whole pages.
+
+    Parameters
+    ----------
+    - save`Callable[[Any], Any]`: Saves the sinks with the given progress.
+    - progress`Callable[[], Any]`: Where the source would go on from after
+    the page being taken in.
+    - interval`float`: The least seconds between two saves.
+    """
+
+    def __init__(self, save: Callable[[Any], Any],
+                 progress: Callable[[], Any], interval: float,
+                 clock: Callable[[], float] = monotonic) -> None:
+        """Initialize the class."""
+        self.save = save
+        self._progress = progress
+        self.interval = interval
+        self._clock = clock
+        self._saved = clock()
+        # The progress as of the last page taken in by every sink.
+        self.progress = None
+
+    def add(self, page: Classified):
+        """Note the progress, and save it if it is due."""
+        self.progress = self._progress()
+        if self._clock() - self._saved >= self.interval:
+            self.save(self.progress)
+            self._saved = self._clock()
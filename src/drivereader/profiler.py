@@ -0,0 +1,111 @@
+"""
+Instrumentation of a run.
+
+`RunProfile` keeps the wall time spent in each stage of a run and counters
+such as the pages listed and the files classified. Stages that run on
+several listing workers at once add up the time of every worker, so they
+can be longer than the run. `RunProfile.save` appends the profile as one
+line of JSON to a log, so runs of different releases can be compared:
+
+    drivereader crawl --profile
+    drivereader crawl --cprofile data/run.prof
+
+The cProfile dump is read with `python -m pstats data/run.prof`.
+"""
+
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from json import dumps
+from os import makedirs, path
+from platform import python_version
+from sys import platform
+from threading import Lock
+from time import perf_counter
+from typing import Any, Optional
+
+from drivereader import __version__
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:
+    # Not available on Windows, where the peak memory is not reported.
+    getrusage = None
+
+
+def peak_memory():
+    """The peak resident memory of the process in kilobytes, if known."""
+    if getrusage is None:
+        return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak // 1024 if platform == "darwin" else peak
+
+
+class RunProfile():
+    """The time spent in each stage of a run, and its counters."""
+
+    def __init__(self) -> None:
+        """Initialize the class."""
+        self.started = datetime.now()
+        self._start = perf_counter()
+        self._lock = Lock()
+        self.stages: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the code run in the block as part of stage `name`."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def count(self, name: str, amount: int = 1):
+        """Add `amount` to the counter `name`."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self, **extra: Any):
+        """The profile of the run so far, with the `extra` items added.
+
+        Returns
+        -------
+        - report`dict[str, Any]`: The start and length of the run, the
+        seconds of every stage, the counters, the files classified per
+        second of crawling and the peak memory.
+        """
+        with self._lock:
+            stages = {name: round(seconds, 4)
+                      for name, seconds in self.stages.items()}
+            counters = dict(self.counters)
+        crawl = self.stages.get("crawl")
+        files = counters.get("files")
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "version": __version__,
+            "python": python_version(),
+            "seconds": round(perf_counter() - self._start, 4),
+            "stages": stages,
+            "counters": counters,
+            "files_per_second": round(files / crawl, 1)
+                if crawl and files is not None else None,
+            "peak_memory_kb": peak_memory(),
+            **extra
+        }
+
+    @staticmethod
+    def save(report: dict[str, Any], log_path: str):
+        """Append a report to a log with one JSON object per line."""
+        directory = path.dirname(log_path)
+        if directory:
+            makedirs(directory, exist_ok=True)
+        with open(log_path, "a") as file:
+            file.write(dumps(report) + "\n")
+
+
+def timed(profile: Optional[RunProfile], name: str):
+    """Time a block as stage `name` of `profile`, if there is one."""
+    return profile.stage(name) if profile is not None else nullcontext()
@@ -0,0 +1,126 @@
+"""
+Scheduling of the requests made to drive.
+
+Every request goes through `RequestScheduler.execute`, which waits for a
+token from a token bucket sized to the API quota, and retries requests that
+failed with a rate limit or server error with exponential backoff and
+jitter. Retrying the same call means a listing continues from the page
+token it was on, so no pages are dropped.
+"""
+
+from random import Random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Optional
+
+from googleapiclient.errors import HttpError
+
+# Reasons of a 403 response that mean the quota was exceeded.
+RATE_LIMIT_REASONS = (b"rateLimitExceeded", b"userRateLimitExceeded")
+
+
+def retryable(error: Exception):
+    """Whether a failed request should be tried again."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        return status == 403 and any(reason in (error.content or b"")
+                                     for reason in RATE_LIMIT_REASONS)
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class RequestScheduler():
+    """A token bucket quota with retries for the requests made to drive.
+
+    Parameters
+    ----------
+    - rate`float`: Requests allowed per second on average.
+    - burst`int`: Requests that may be made at once, defaults to `rate`.
+    - max_retries`int`: Retries of a failed request before giving up.
+    - base_delay`float`: Seconds to back off after the first failure,
+    doubled after every further failure.
+    - max_delay`float`: The longest back off, in seconds.
+    - seed`int`: Seeds the jitter, for reproducible runs.
+    """
+
+    def __init__(self, rate: float = 100.0, burst: Optional[int] = None,
+                 max_retries: int = 8, base_delay: float = 0.5,
+                 max_delay: float = 64.0, seed: Optional[int] = None,
+                 sleep: Callable[[float], Any] = sleep,
+                 clock: Callable[[], float] = monotonic) -> None:
+        """Initialize the class."""
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._clock = clock
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        # Counters of the run.
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    def acquire(self):
+        """Wait until the quota allows another request.
+
+        The token is taken right away, even if it has to be waited for, so
+        concurrent callers queue up in order rather than race.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens
+                               + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.requests += 1
+            self.throttled_seconds += wait
+        if wait:
+            self._sleep(wait)
+
+    def backoff(self, attempt: int):
+        """Seconds to wait before retry number `attempt`, with full jitter."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self._lock:
+            return self._random.uniform(0, delay)
+
+    def execute(self, function: Callable[..., Any], *args, **kwargs):
+        """Call `function` within the quota, retrying if it fails.
+
+        Raises the last error when the request is not retryable or still
+        fails after `max_retries` retries.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if not retryable(error) or attempt >= self.max_retries:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                delay = self.backoff(attempt)
+                with self._lock:
+                    self.retries += 1
+                    self.backoff_seconds += delay
+                self._sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        """The counters of the run."""
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "backoff_seconds": round(self.backoff_seconds, 3),
+        }
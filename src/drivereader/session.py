@@ -0,0 +1,178 @@
+"""
+Drive services for concurrent listing workers.
+
+`googleapiclient` services and the `httplib2` connections under them are
+not thread safe, so every thread needs a service of its own. A
+`SessionManager` hands each thread a service on a pool of keep-alive
+connections taken from those other threads let go of, so the threads of
+the next crawl reuse the connections, and their TLS sessions, of the last
+one. All the services share one OAuth token, which is refreshed once, under
+a lock, shortly before it expires, rather than by every thread that finds
+it stale or gets a 401 at the same time.
+"""
+
+from datetime import datetime, timedelta, timezone
+from threading import Lock, local
+from typing import Any, Callable, Optional
+from weakref import finalize
+
+import httplib2
+from google.auth.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+
+from drivereader.backend import drive_service
+
+
+def utcnow():
+    """The current time in UTC, naive like the `expiry` of credentials."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SharedCredentials(Credentials):
+    """The credentials of one thread's service, backed by a session.
+
+    Requests carry the token of the session. A refresh asked for after a
+    401 only refreshes the token if no other thread did so since it was
+    sent.
+    """
+
+    def __init__(self, session: "SessionManager") -> None:
+        """Initialize the class."""
+        super().__init__()
+        self.session = session
+
+    @property
+    def valid(self):
+        return self.session.fresh()
+
+    def refresh(self, request):
+        self.session.refresh(stale=self.token)
+
+    def before_request(self, request, method, url, headers):
+        self.session.ensure_fresh()
+        self.apply(headers)
+
+    def apply(self, headers, token=None):
+        # Remember the token sent, to tell whether a refresh is still due.
+        self.token = token or self.session.credentials.token
+        super().apply(headers, self.token)
+
+
+class Lease():
+    """The service of one thread, on connections leased from a session.
+
+    The connections go back to the session once the lease is dropped,
+    which happens when the thread it belongs to ends.
+    """
+
+    def __init__(self, session: "SessionManager") -> None:
+        """Initialize the class."""
+        http = session.acquire()
+        self.service = drive_service(
+            None, http=AuthorizedHttp(SharedCredentials(session), http=http))
+        finalize(self, session.release, http)
+
+
+class SessionManager():
+    """Per-thread drive services sharing pooled connections and a token.
+
+    Parameters
+    ----------
+    - credentials`Credentials`: The authorized credentials of the user.
+    - refresh_margin`float`: Seconds before the token expires that it is
+    refreshed.
+    - timeout`float`: Seconds a request may wait on a connection, after
+    which it fails with a `TimeoutError` and is retried.
+    - on_refresh`Callable[[Credentials], Any]`: Called with the credentials
+    after every refresh, e.g. to save the new token.
+    - request_factory`Callable[[], Request]`: Makes the transport a refresh
+    is sent with, a `google.auth.transport.requests.Request` by default.
+    """
+
+    def __init__(self, credentials: Any, refresh_margin: float = 300.0,
+                 timeout: Optional[float] = 60.0,
+                 on_refresh: Optional[Callable[[Any], Any]] = None,
+                 request_factory: Optional[Callable[[], Any]] = None
+                 ) -> None:
+        """Initialize the class."""
+        self.credentials = credentials
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.timeout = timeout
+        self.on_refresh = on_refresh
+        self._request_factory = request_factory
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+        self._local = local()
+        # Connection pools no thread is using.
+        self._idle: list[httplib2.Http] = []
+        # Counters of the run.
+        self.refreshes = 0
+        self.connections = 0
+        self.services = 0
+
+    def fresh(self):
+        """Whether the token is good for longer than the refresh margin."""
+        credentials = self.credentials
+        if credentials.token is None:
+            return False
+        if credentials.expiry is None:
+            return True
+        return utcnow() < credentials.expiry - self.refresh_margin
+
+    def ensure_fresh(self):
+        """Refresh the token if it is about to expire."""
+        if not self.fresh():
+            self.refresh()
+
+    def refresh(self, stale: Optional[str] = None):
+        """Refresh the token, once for all the threads waiting on it.
+
+        Threads that wait for the lock while another refreshes find the
+        token fresh, or with `stale`, replaced, and make no request.
+
+        Parameters
+        ----------
+        - stale`str`: The token a request was refused with. It is refreshed
+        even if it has not expired, unless it was already replaced.
+        """
+        with self._refresh_lock:
+            if stale is not None and self.credentials.token != stale:
+                return
+            if stale is None and self.fresh():
+                return
+            if self._request_factory is None:
+                from google.auth.transport.requests import Request
+                self._request_factory = Request
+            self.credentials.refresh(self._request_factory())
+            self.refreshes += 1
+            if self.on_refresh is not None:
+                self.on_refresh(self.credentials)
+
+    def acquire(self):
+        """Take an idle pool of connections, or open a new one."""
+        with self._lock:
+            self.services += 1
+            if self._idle:
+                return self._idle.pop()
+            self.connections += 1
+        return httplib2.Http(timeout=self.timeout)
+
+    def release(self, http: httplib2.Http):
+        """Give back a pool of connections for another thread to use."""
+        with self._lock:
+            self._idle.append(http)
+
+    def service(self):
+        """The drive service of the calling thread."""
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            lease = self._local.lease = Lease(self)
+        return lease.service
+
+    def stats(self):
+        """The counters of the run."""
+        return {
+            "refreshes": self.refreshes,
+            "connections": self.connections,
+            "services": self.services,
+        }
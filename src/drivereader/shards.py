@@ -0,0 +1,212 @@
+"""
+Crawls split across machines or processes.
+
+A shard crawls part of the folders in `data/folders.json` and writes a
+partial instead of the reports:
+
+    drivereader crawl --shard 0/4       # folders hashed to shard 0 of 4
+    drivereader crawl --shard 10:20     # folders 10 to 19 of the list
+    drivereader merge data/partial-*.json
+
+A partial holds the counts of its folders as `CountStore` rows and the
+folders it could not list completely. The files it exempted are in an
+`ExemptLog` next to it, e.g. `data/partial-0of4.exempt.jsonl`, which goes
+wherever the partial goes. `merge_partials` adds any number of partials, or
+merges of partials, into one, which `drivereader merge` writes the reports
+from. The merge is associative, commutative and deterministic: folders and
+exempted files come out in the order of `folders.json`, whichever way the
+partials are grouped or ordered. That is the order of a crawl of all the
+folders at once. The files are reported under the names of the folders on
+drive, which can differ from the names searched for in `folders.json`, so
+a partial keeps the position in `folders.json` of every folder it reports.
+The logs are merged as streams, which needs the files exempted in each to
+be in that order, so in a recursive crawl, where the files of sub-folders
+come a level at a time, their order is only deterministic.
+
+Every shard needs the same `folders.json` and classification sheet, and a
+working directory of its own, as the state, checkpoints and caches of a
+crawl are kept in `data/`.
+"""
+
+from json import load
+from os import path
+from re import fullmatch
+from typing import Any, Iterable, Optional
+from zlib import crc32
+
+from drivereader.counts import CountStore
+from drivereader.exempt import EXEMPT_PATH, ExemptLog
+
+# The settings every partial of a merge must share.
+SETTINGS = ("folderNames", "recursive", "maxDepth", "sheetFingerprint")
+
+
+def select_shard(folder_names: list[str], shard: str):
+    """The folders of `folders.json` that a shard crawls.
+
+    Parameters
+    ----------
+    - folder_names`list[str]`: The folders in `folders.json`.
+    - shard`str`: `INDEX/COUNT` for the folders whose name hashes to shard
+    `INDEX` of `COUNT`, or `START:STOP` for a slice of the list, either end
+    of which may be left out.
+
+    Returns
+    -------
+    - folder_names`list[str]`: The folders of the shard, in list order.
+    """
+    hashed = fullmatch(r"(\d+)/(\d+)", shard)
+    if hashed:
+        index, count = int(hashed[1]), int(hashed[2])
+        if index >= count:
+            raise ValueError(f"Shard {shard} is not one of {count} shards.")
+        return [name for name in folder_names
+                if crc32(name.encode("utf-8")) % count == index]
+    ranged = fullmatch(r"(\d*):(\d*)", shard)
+    if ranged:
+        start = int(ranged[1]) if ranged[1] else None
+        stop = int(ranged[2]) if ranged[2] else None
+        return folder_names[start:stop]
+    raise ValueError(f"A shard is INDEX/COUNT or START:STOP, not {shard!r}.")
+
+
+def default_partial_path(shard: str):
+    """The default file of the partial of a shard."""
+    start, ranged, stop = shard.partition(":")
+    name = f"{start or 0}-{stop or 'end'}" if ranged \
+        else shard.replace("/", "of")
+    return f"data/partial-{name}.json"
+
+
+def exempt_log_path(partial_path: str):
+    """The log of the files exempted by a partial, next to it."""
+    return f"{path.splitext(partial_path)[0]}.exempt.jsonl"
+
+
+def make_partial(folder_names: list[str], shard_names: list[str],
+                 counts: CountStore, exempt: str,
+                 failed_folders: dict[str, Optional[str]],
+                 recursive: bool = False, max_depth: Optional[int] = None,
+                 sheet_fingerprint: Optional[str] = None,
+                 folder_positions: Optional[dict[str, int]] = None):
+    """The partial of a shard.
+
+    Parameters
+    ----------
+    - folder_names`list[str]`: All the folders in `folders.json`.
+    - shard_names`list[str]`: The folders the shard crawled.
+    - counts`CountStore`: The counts of the shard.
+    - exempt`str`: The file name of the log of the files the shard
+    exempted, in the directory of the partial.
+    - failed_folders`dict[str, Optional[str]]`: The folders whose listing
+    failed, with the page token it stopped at.
+    - recursive, max_depth: The settings of the crawl.
+    - sheet_fingerprint`str`: The version of the classification sheet.
+    - folder_positions`dict[str, int]`: The position in `folder_names` of
+    every folder the files are reported under, by its name on drive.
+    """
+    return {
+        "folderNames": folder_names,
+        "recursive": recursive,
+        "maxDepth": max_depth,
+        "sheetFingerprint": sheet_fingerprint,
+        "folders": shard_names,
+        "counts": sorted(counts.dump()),
+        "exempt": exempt,
+        "failedFolders": failed_folders,
+        "folderPositions": folder_positions or {}
+    }
+
+
+def load_partial(filename: str):
+    """Read a partial written by a shard or a merge.
+
+    Its `exempt` is made the path of its log.
+    """
+    with open(filename, "r") as file:
+        partial = load(file)
+    if not isinstance(partial, dict) \
+            or not {*SETTINGS, "folders", "counts", "exempt"} <= set(partial) \
+            or not isinstance(partial["exempt"], str):
+        raise ValueError(f"{filename} is not the partial of a crawl.")
+    partial["exempt"] = path.join(path.dirname(filename), partial["exempt"])
+    if not path.exists(partial["exempt"]):
+        raise ValueError(f"The exempted files of {filename} are missing from "
+                         f"{partial['exempt']}.")
+    return partial
+
+
+def merge_partials(partials: Iterable[dict[str, Any]],
+                   exempt_path: str = EXEMPT_PATH):
+    """Add partials into one partial.
+
+    The partials must come from the same settings, and no folder may be
+    in more than one of them, as its files would be counted twice.
+
+    Parameters
+    ----------
+    - partials`Iterable[dict[str, Any]]`: The partials, as `load_partial`
+    reads them.
+    - exempt_path`str`: Where the log of the files they exempted is
+    written.
+
+    Returns
+    -------
+    - partial`dict[str, Any]`: The partial of all the folders, in the order
+    of `folders.json`.
+    - exempt`ExemptLog`: The files they exempted, in crawl order within
+    each folder.
+    """
+    partials = list(partials)
+    if not partials:
+        raise ValueError("There are no partials to merge.")
+    first = partials[0]
+    for setting in SETTINGS:
+        if any(partial[setting] != first[setting] for partial in partials):
+            raise ValueError(f"The partials differ in {setting}, they are "
+                             "not of the same crawl.")
+    folder_names = first["folderNames"]
+    positions: dict[str, int] = {}
+    for position, name in enumerate(folder_names):
+        positions.setdefault(name, position)
+
+    def position(name: str):
+        return positions.get(name, len(folder_names))
+
+    # The folders on drive that the files are reported under.
+    reported: dict[str, int] = {}
+    for partial in partials:
+        for name, at in partial.get("folderPositions", {}).items():
+            reported[name] = min(at, reported.get(name, at))
+
+    def reported_position(name: str):
+        return reported[name] if name in reported else position(name)
+
+    folders: list[str] = []
+    for partial in partials:
+        repeated = set(folders) & set(partial["folders"])
+        if repeated:
+            raise ValueError("Folders in more than one partial: "
+                             + ", ".join(sorted(repeated, key=position)))
+        folders.extend(partial["folders"])
+    folders.sort(key=position)
+
+    counts = CountStore()
+    failed_folders: dict[str, Optional[str]] = {}
+    for partial in partials:
+        counts.merge(CountStore.load(partial["counts"]))
+        failed_folders.update(partial.get("failedFolders", {}))
+    # A folder is only in one partial, so merging the logs by folder keeps
+    # the crawl order of its files.
+    exempt = ExemptLog.merged(
+        [partial["exempt"] for partial in sorted(
+            partials, key=lambda partial: min(map(position,
+                                                  partial["folders"]),
+                                              default=len(folder_names)))],
+        reported_position, exempt_path)
+    return make_partial(
+        folder_names, folders, counts, path.basename(exempt_path),
+        dict(sorted(failed_folders.items(),
+                    key=lambda item: (reported_position(item[0]), item[0]))),
+        first["recursive"], first["maxDepth"],
+        first["sheetFingerprint"], dict(sorted(reported.items()))), exempt
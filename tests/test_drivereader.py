@@ -1 +1,1094 @@
-from drivereader import drivereader
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from itertools import count
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from pstats import Stats
+from subprocess import run
+from sys import executable
+from threading import Barrier, Thread
+from time import sleep
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from googleapiclient.errors import HttpError
+from openpyxl import Workbook, load_workbook
+
+from drivereader import batch, cli, drivereader
+from drivereader.drivereader import DriveReader, ExcelWorker
+from drivereader.classifier import FileClassifier
+from drivereader.counts import CountStore
+from drivereader.daemon import ReportDaemon
+from drivereader.exempt import ExemptLog
+from drivereader.fakedrive import FakeDriveBackend
+from drivereader.index import FileIndex
+from drivereader.pipeline import csv_pages, ordered
+from drivereader.scheduler import RequestScheduler
+from drivereader.session import SessionManager, utcnow
+
+CODE_LIST = {
+    "RPIF": ["Research paper in federal journal", "RESEARCH", ["3.3.1"]],
+    "CONF": ["Conference presentation", "RESEARCH", ["3.3.2"]],
+    "JOUR": ["Journal publication", "PUBLICATION", ["3.4.1", "3.3.1"]],
+}
+
+
+READERS = count()
+
+
+def make_reader(backend: FakeDriveBackend, workers: int = 1,
+                exempt_path: str = None) -> DriveReader:
+    # Every reader logs its exempted files apart, so they can be compared.
+    reader = DriveReader(backend_factory=backend.connect, workers=workers,
+                         scheduler=RequestScheduler(rate=1e6),
+                         exempt_path=exempt_path
+                         or f"data/exempt-{next(READERS)}.jsonl")
+    reader.code_list = CODE_LIST
+    reader.categories = ["RESEARCH", "PUBLICATION"]
+    return reader
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    return tmp_path / "data"
+
+
+def write_folders(data_dir, names):
+    (data_dir / "folders.json").write_text(dumps(names))
+
+
+def write_classification(data_dir):
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = "NAAC Quantitative"
+    worksheet.append(["NAAC"])
+    worksheet.append(["Category", "Classification", "Code", "Name"])
+    worksheet.append(["RESEARCH", "3.3.1", "RPIF", CODE_LIST["RPIF"][0]])
+    worksheet.append([None, None, "JOUR", CODE_LIST["JOUR"][0]])
+    worksheet.append([None, "3.3.2", "CONF", CODE_LIST["CONF"][0]])
+    worksheet.append(["PUBLICATION", "3.4.1", "JOUR", CODE_LIST["JOUR"][0]])
+    workbook.save(data_dir / "doc_classification.xlsx")
+
+
+def test_session_refreshes_once_and_reuses_connections():
+    accepted, connections = ["token 1"], []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self)
+
+        def do_GET(self):
+            ok = self.headers["authorization"] == f"Bearer {accepted[0]}"
+            self.send_response(200 if ok else 401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    class Expiring():
+        def __init__(self):
+            self.token, self.refreshes = "token 0", 0
+            self.expiry = utcnow() + timedelta(seconds=60)
+
+        def refresh(self, request):
+            sleep(0.05)
+            self.refreshes += 1
+            self.token = f"token {self.refreshes}"
+            self.expiry = utcnow() + timedelta(hours=1)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/files"
+    credentials = Expiring()
+    session = SessionManager(credentials, request_factory=lambda: None)
+    barrier = Barrier(8)
+
+    def burst():
+        def get(_):
+            barrier.wait()
+            return session.service()._http.request(url)[0].status
+        with ThreadPoolExecutor(8) as pool:
+            return list(pool.map(get, range(8)))
+
+    try:
+        # The token is about to expire: one thread refreshes it.
+        assert burst() == [200] * 8
+        assert credentials.refreshes == 1
+        # The token was revoked: every thread gets a 401, one refreshes.
+        accepted[0] = "token 2"
+        assert burst() == [200] * 8
+        assert credentials.refreshes == 2
+        # The threads of the bursts reused the first one's connections.
+        assert session.stats() == {"refreshes": 2, "connections": 8,
+                                   "services": 16}
+        assert len(connections) == 8
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fake_backend_pages_and_filters():
+    backend = FakeDriveBackend(page_size=2)
+    folder = backend.add_folder("Physics")
+    for name in ["a", "b", "c"]:
+        backend.add_file(name, folder)
+    backend.add_file("elsewhere")
+
+    first = backend.list_files(f"'{folder}' in parents",
+                               fields="nextPageToken, files(name)")
+    second = backend.list_files(f"'{folder}' in parents",
+                                page_token=first["nextPageToken"])
+    assert [file["name"] for file in first["files"]] == ["a", "b"]
+    assert [file["name"] for file in second["files"]] == ["c"]
+    assert "nextPageToken" not in second
+    assert backend._cursors == {}
+
+    response = backend.list_files(
+        "name contains 'phys' and mimeType = "
+        "'application/vnd.google-apps.folder'")
+    assert response["files"][0]["id"] == folder
+    assert backend.calls == 3
+
+
+def test_fake_backend_injects_errors():
+    backend = FakeDriveBackend(error_rate=0.5, error_status=429, seed=1)
+    failures = 0
+    for _ in range(40):
+        try:
+            backend.list_files("")
+        except HttpError as error:
+            assert error.resp.status == 429
+            failures += 1
+    assert failures == backend.errors and 10 < failures < 30
+
+
+def test_concurrent_listing_matches_serial(data_dir):
+    backend = FakeDriveBackend.generate(folders=12, files_per_folder=45,
+                                        page_size=10, seed=3)
+    write_folders(data_dir, [f"Folder {i}" for i in range(12)])
+
+    serial = make_reader(backend)
+    serial.categorize_files()
+    concurrent = make_reader(backend, workers=6)
+    concurrent.categorize_files()
+
+    assert dumps(concurrent.data) == dumps(serial.data)
+    assert list(concurrent.exempt.records()) == list(serial.exempt.records())
+    # Every worker lists with a backend of its own on the same drive.
+    workers = concurrent._backends
+    assert len(workers) > 1 and backend not in workers
+    assert len({id(worker) for worker in workers}) == len(workers)
+    assert sum(worker.calls for worker in workers) == concurrent.api_calls
+    assert sum(sum(year.values()) for category in serial.data.values()
+               for year in category.values()) + len(serial.exempt) == 12 * 45
+
+
+def test_rate_limited_crawl_loses_no_pages(data_dir):
+    write_folders(data_dir, [f"Folder {i}" for i in range(8)])
+    clean = make_reader(FakeDriveBackend.generate(
+        folders=8, files_per_folder=60, page_size=10, seed=4))
+    clean.categorize_files()
+
+    backend = FakeDriveBackend.generate(folders=8, files_per_folder=60,
+                                        page_size=10, seed=4, error_rate=0.3,
+                                        error_status=403)
+    reader = make_reader(backend, workers=4)
+    reader.folder_cache_ttl = 0
+    reader.scheduler = RequestScheduler(max_retries=50, seed=0,
+                                        sleep=lambda seconds: None)
+    reader.categorize_files()
+    assert dumps(reader.data) == dumps(clean.data)
+    assert list(reader.exempt.records()) == list(clean.exempt.records())
+    assert reader.failed_folders == {}
+    assert reader.scheduler.retries == backend.errors > 0
+
+    backend.error_rate = 1.0
+    reader.scheduler = RequestScheduler(max_retries=2,
+                                        sleep=lambda seconds: None)
+    assert reader.list_folder({"id": backend.folders[0],
+                               "name": "Folder 0"}) == []
+    assert reader.failed_folders == {"Folder 0": None}
+    assert reader.scheduler.stats()["failures"] == 1
+
+
+def test_batched_first_pages_match_paged_listing(data_dir):
+    names = [f"Folder {i}" for i in range(150)]
+    write_folders(data_dir, names)
+    runs = []
+    for batched in (False, True):
+        backend = FakeDriveBackend.generate(folders=150, files_per_folder=12,
+                                            page_size=10, seed=6)
+        reader = make_reader(backend)
+        reader.batch = batched
+        reader.resolve_folders(names)
+        backend.calls = backend.bytes = 0
+        reader.categorize_files()
+        runs.append((reader, backend.calls, backend.bytes))
+
+    (paged, paged_calls, paged_bytes), (batched, calls, size) = runs
+    assert dumps(batched.data) == dumps(paged.data)
+    assert list(batched.exempt.records()) == list(paged.exempt.records())
+    # Two batches instead of 150 first pages, then the second pages.
+    assert (paged_calls, calls) == (150 * 2, 2 + 150)
+    assert size == paged_bytes
+
+    folder = {"id": backend.folders[0], "name": "Folder 0"}
+    backend.bytes = 0
+    reader.list_folder(folder)
+    minimal = backend.bytes
+    reader.index = FileIndex(str(data_dir / "index.sqlite3"))
+    reader.list_folder(folder)
+    assert backend.bytes > 2 * minimal
+
+
+def test_scheduler_keeps_to_the_quota():
+    now, waits = [0.0], []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    scheduler = RequestScheduler(rate=10, burst=2, sleep=sleep,
+                                 clock=lambda: now[0])
+    for _ in range(12):
+        scheduler.acquire()
+    assert now[0] == pytest.approx(1.0)
+    assert scheduler.throttled_seconds == pytest.approx(1.0)
+    assert waits == [pytest.approx(0.1)] * 10
+
+
+def test_folders_resolved_in_batches_and_cached(data_dir):
+    backend = FakeDriveBackend.generate(folders=70, files_per_folder=1)
+    names = [f"Folder {i}" for i in range(70)] + ["Missing"]
+
+    reader = make_reader(backend)
+    folders = reader.resolve_folders(names)
+    assert backend.calls == 3
+    assert folders["Folder 7"]["name"] == "Folder 7"
+    assert "Missing" not in folders
+
+    backend.calls = 0
+    assert make_reader(backend).resolve_folders(names[:-1]) == folders
+    assert backend.calls == 0
+
+    write_folders(data_dir, names)
+    reader.categorize_files()
+    counted = sum(sum(year.values()) for category in reader.data.values()
+                  for year in category.values())
+    assert counted + len(reader.exempt) == 70
+
+
+def test_overlapping_names_resolve_to_their_own_folder(data_dir):
+    backend = FakeDriveBackend()
+    astro = backend.add_folder("Astrophysics Dept")
+    physics = backend.add_folder("physics")
+    history = backend.add_folder("History of Physics")
+    reader = make_reader(backend)
+    reader.folder_cache_ttl = 0
+    folders = reader.resolve_folders(["Physics", "Astro", "Dept", "History"])
+    # One query for the chunk finds every folder, each name keeps its own.
+    assert backend.calls == 1
+    assert folders["Physics"]["id"] == physics
+    assert folders["Astro"]["id"] == astro
+    assert folders["Dept"]["id"] == astro
+    assert folders["History"]["id"] == history
+
+
+def test_incremental_run_matches_full_crawl(data_dir):
+    backend = FakeDriveBackend.generate(folders=4, files_per_folder=30,
+                                        page_size=10, seed=5)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    make_reader(backend).categorize_files(incremental=True)
+
+    files = backend.children["id00000001"]
+    backend.rename(files[0], "202203_JOUR_renamed.pdf")
+    backend.rename(files[1], "not classified")
+    backend.trash(files[2])
+    backend.remove(files[3])
+    backend.move(files[4], "id00000094")
+    backend.add_file("202301_RPIF_new.pdf", "id00000001")
+
+    backend.calls = 0
+    incremental = make_reader(backend)
+    incremental.categorize_files(incremental=True)
+    assert backend.calls == 1
+
+    full = make_reader(backend)
+    full.categorize_files(incremental=True, full_rebuild=True)
+    assert dumps(incremental.data) == dumps(full.data)
+    assert list(incremental.exempt.records()) == list(full.exempt.records())
+
+
+def count_files(reader):
+    return sum(count for category in reader.data.values()
+               for year in category.values() for count in year.values()) \
+        + len(reader.exempt)
+
+
+def test_recursive_crawl_lists_every_folder_once(data_dir):
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=5,
+                                        subfolders=2, depth=2, seed=7)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    roots = backend.folders[::7]
+    parts = [backend.children[root][5] for root in roots]
+    backend.add_shortcut("Shortcut to Folder 1", roots[1], roots[0])
+    backend.add_parent(parts[2], parts[0])
+    backend.add_parent(roots[0], parts[0])
+
+    serial = make_reader(backend)
+    serial.recursive = True
+    serial.categorize_files()
+    assert count_files(serial) == 3 * 7 * 5
+
+    concurrent = make_reader(backend, workers=4)
+    concurrent.recursive = True
+    concurrent.frontier_size = 2
+    concurrent.categorize_files()
+    assert dumps(concurrent.data) == dumps(serial.data)
+    assert list(concurrent.exempt.records()) == list(serial.exempt.records())
+
+    shallow = make_reader(backend)
+    shallow.recursive = True
+    shallow.max_depth = 1
+    shallow.categorize_files()
+    assert count_files(shallow) == 3 * 3 * 5
+
+    serial.categorize_files(incremental=True)
+    new_folder = backend.add_folder("Part 9", parts[1])
+    backend.add_file("202301_RPIF_nested.pdf", new_folder)
+    backend.add_file("scan nested.pdf", new_folder)
+    backend.rename(backend.children[parts[2]][0], "202203_JOUR_moved.pdf")
+    backend.calls = 0
+    incremental = make_reader(backend)
+    incremental.recursive = True
+    incremental.categorize_files(incremental=True)
+    assert backend.calls == 1
+    assert count_files(incremental) == 3 * 7 * 5 + 2
+    full = make_reader(backend)
+    full.recursive = True
+    full.categorize_files()
+    assert dumps(incremental.data) == dumps(full.data)
+    assert list(incremental.exempt.records()) == list(full.exempt.records())
+
+
+def interrupt_listing(backend: FakeDriveBackend, calls: int,
+                      error: BaseException):
+    connect = backend.connect
+
+    def interrupted_connect():
+        connection = connect()
+        list_files = connection.list_files
+
+        def interrupted(*args, **kwargs):
+            if backend.calls >= calls:
+                raise error
+            return list_files(*args, **kwargs)
+        connection.list_files = interrupted
+        return connection
+    backend.connect = interrupted_connect
+
+
+def test_interrupted_crawl_resumes_where_it_stopped(data_dir):
+    write_folders(data_dir, [f"Folder {i}" for i in range(6)])
+    backend = FakeDriveBackend.generate(folders=6, files_per_folder=45,
+                                        page_size=10, seed=5)
+    clean = make_reader(backend)
+    clean.categorize_files()
+
+    backend.calls = 0
+    interrupt_listing(backend, 12, KeyboardInterrupt())
+    with pytest.raises(KeyboardInterrupt):
+        make_reader(backend, exempt_path="data/resumed.jsonl"
+                    ).categorize_files()
+    saved = loads((data_dir / "checkpoint.json").read_text())
+    assert saved["cursor"]["position"] == 2
+    assert saved["cursor"]["pageToken"] is not None
+    del backend.connect
+    backend.calls = 0
+    resumed = make_reader(backend, exempt_path="data/resumed.jsonl")
+    resumed.categorize_files(resume=True)
+    assert backend.calls == 6 * 5 - 12
+    assert dumps(resumed.data) == dumps(clean.data)
+    assert list(resumed.exempt.records()) == list(clean.exempt.records())
+    assert not (data_dir / "checkpoint.json").exists()
+
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=15,
+                                        subfolders=2, depth=2, seed=8,
+                                        page_size=10)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+
+    def recursive_reader(exempt_path="data/resumed.jsonl"):
+        reader = make_reader(backend, workers=3, exempt_path=exempt_path)
+        reader.recursive = True
+        reader.frontier_size = 4
+        reader.index = FileIndex(str(data_dir / "index.sqlite3"))
+        reader.checkpoint_interval = 1e-9
+        reader.folder_cache_ttl = 0
+        return reader
+    clean = recursive_reader("data/clean.jsonl")
+    clean.categorize_files(incremental=True)
+    clean_state = loads((data_dir / "state.json").read_text())
+
+    progress = []
+    for calls in (10, 12, 15):
+        interrupt_listing(backend, backend.calls + calls, ConnectionError())
+        reader = recursive_reader()
+        reader.scheduler = RequestScheduler(rate=1e6, max_retries=0)
+        with pytest.raises(ConnectionError):
+            reader.categorize_files(incremental=True, full_rebuild=True,
+                                    resume=calls > 10)
+        reader.index.close()
+        del backend.connect
+        cursor = loads((data_dir / "checkpoint.json").read_text())["cursor"]
+        progress.append((cursor["depth"], cursor["position"]))
+    assert progress == sorted(set(progress))
+    resumed = recursive_reader()
+    resumed.categorize_files(incremental=True, full_rebuild=True,
+                             resume=True)
+    assert dumps(resumed.data) == dumps(clean.data)
+    assert list(resumed.exempt.records()) == list(clean.exempt.records())
+    state = loads((data_dir / "state.json").read_text())
+    assert state["files"] == clean_state["files"]
+    assert resumed.index.count() == len(clean_state["files"])
+
+    # Nothing exempted before the interruption, so there is no log yet.
+    write_folders(data_dir, [f"Folder {i}" for i in range(6)])
+    backend = FakeDriveBackend.generate(folders=6, files_per_folder=45,
+                                        page_size=10, exempt_ratio=0)
+    interrupt_listing(backend, 12, KeyboardInterrupt())
+    with pytest.raises(KeyboardInterrupt):
+        make_reader(backend, exempt_path="data/none.jsonl").categorize_files()
+    del backend.connect
+    assert not (data_dir / "none.jsonl").exists()
+    backend.calls = 0
+    make_reader(backend, exempt_path="data/none.jsonl"
+                ).categorize_files(resume=True)
+    assert backend.calls < 6 * 5
+
+
+def test_index_aggregates_match_crawl(data_dir):
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=40,
+                                        seed=9)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    reader = make_reader(backend)
+    reader.index = FileIndex(str(data_dir / "index.sqlite3"))
+    reader.categorize_files()
+    reader.index.set_code_list(CODE_LIST)
+
+    assert dumps(reader.index.category_counts(reader.categories)) \
+        == dumps(reader.data)
+    assert reader.index.exempt_files() == [
+        (record["name"], record["folder"])
+        for record in reader.exempt.records()]
+    naac = reader.index.classification_counts("2022-2023")
+    journals = reader.data["PUBLICATION"].get("2022-2023", {}).get("JOUR", 0)
+    research = reader.data["RESEARCH"].get("2022-2023", {}).get("RPIF", 0)
+    assert naac.get("3.4.1", 0) == journals
+    assert naac.get("3.3.1", 0) == journals + research
+    assert sum(reader.index.code_counts("Folder 1").values()) \
+        + reader.exempt.folders["Folder 1"] == 40
+
+
+def test_batch_classifier_matches_per_call_path():
+    names = ["202305_RPIF_a", "202301_jour_b", "202300_CONF_c", "2023_RPIF_d",
+             "20231_RPIF_e", "２０２３０５_RPIF_f", " 202305_CONF_g", "x_y",
+             "202305_UNKN_h", "202313_JOUR_i", "202304RPIF_j", "2023ab_RPIF_k"]
+    reader = DriveReader(backend_factory=FakeDriveBackend)
+    reader.code_list = CODE_LIST
+    reader.data, exempt = {}, []
+    for name in names * 3:
+        if reader.classify_file(name):
+            exempt.append(name)
+    reader.finalize_data()
+
+    classifier = FileClassifier(CODE_LIST)
+    counts, batch_exempt = classifier.classify(names * 3)
+    assert batch_exempt == exempt
+    # Names that do not classify are not remembered.
+    remembered = len(classifier._keys)
+    classifier.keys([f"IMG_{i}_x.jpg" for i in range(1000)])
+    assert len(classifier._keys) == remembered
+    assert dumps(FileClassifier.nested(counts)) == dumps(reader.data)
+
+
+def test_pipeline_reads_names_from_csv(data_dir):
+    names = ["202305_RPIF_a", "scan.pdf", "202301_jour_b", "x_y",
+             "202110_CONF_c", "201906_RPIF_d"]
+    rows = [f"{name},Folder {i % 2}" for i, name in enumerate(names)]
+    csv_path = data_dir / "names.csv"
+    csv_path.write_text("\n".join(["name,folder"] + sorted(
+        rows, key=lambda row: row[-1])))
+
+    reader = make_reader(FakeDriveBackend())
+    reader.categorize_files(source=csv_pages(str(csv_path), page_size=2))
+    counts, exempt = FileClassifier(CODE_LIST).classify(names)
+    assert dumps(reader.data) == dumps(
+        FileClassifier.nested(counts, reader.categories))
+    assert sorted((record["name"], record["folder"])
+                  for record in reader.exempt.records()) == [
+        ("scan.pdf", "Folder 1"), ("x_y", "Folder 1")]
+    assert reader.classifier.keys(names) == [
+        reader.classifier.parse(name) for name in names]
+
+
+def test_exempted_files_are_logged_with_a_reason(data_dir):
+    write_classification(data_dir)
+    rows = ["Folder 0,202305_RPIF_a", "Folder 0,scan.pdf",
+            "Folder 0,202305_UNKN_b", "Folder 1,2023ab_RPIF_c",
+            "Folder 1,x_y", "Folder 1,202301_unkn_d"]
+    (data_dir / "names.csv").write_text("\n".join(["folder,name"] + rows))
+    reader = make_reader(FakeDriveBackend())
+    reader.categorize_files(source=csv_pages("data/names.csv", page_size=2))
+
+    assert list(reader.exempt.records()) == [
+        {"name": "scan.pdf", "folder": "Folder 0", "reason": "bad_split"},
+        {"name": "202305_UNKN_b", "folder": "Folder 0",
+         "reason": "unknown_code"},
+        {"name": "2023ab_RPIF_c", "folder": "Folder 1", "reason": "bad_date"},
+        {"name": "x_y", "folder": "Folder 1", "reason": "bad_split"},
+        {"name": "202301_unkn_d", "folder": "Folder 1",
+         "reason": "unknown_code"}]
+    assert reader.classifier.reason("202305_RPIF_a") is None
+
+    ExcelWorker(headless=True).write_reports(reader.data, reader.exempt,
+                                             counts=reader.counts)
+    assert (data_dir / "exempt.jsonl").read_text() \
+        == (data_dir.parent / reader.exempt_path).read_text()
+    exempted = dict((title, rows) for title, rows, _, _
+                    in sheet_contents(data_dir / "categorized.xlsx"))
+    assert exempted["exempted"][:12] == [
+        ["REASON", "FILES", None], ["bad_split", 2, None],
+        ["unknown_code", 2, None], ["bad_date", 1, None],
+        ["Total", 5, None], [None, None, None], ["FOLDER", "FILES", None],
+        ["Folder 1", 3, None], ["Folder 0", 2, None], [None, None, None],
+        ["UNKNOWN CODE", "FILES", None], ["UNKN", 2, None]]
+    assert exempted["exempted"][13:] == [
+        ["FILE NAME", "FOLDER NAME", "REASON"],
+        *([record["name"], record["folder"], record["reason"]]
+          for record in reader.exempt.records())]
+
+    # The summary is capped, however many files are exempted.
+    log = ExemptLog("data/many.jsonl", top=3)
+    log.extend((f"scan {i}.pdf", f"Folder {i % 50}", "bad_split")
+               for i in range(5000))
+    assert len(log) == 5000
+    summary = log.summary()
+    assert summary["folders"] == [["Folder 0", 100], ["Folder 1", 100],
+                                  ["Folder 10", 100]]
+    assert len(summary["samples"]) == 3
+    assert sum(1 for _ in open("data/many.jsonl")) == 5000
+    # A log with no files added reads as empty, and leaves the file alone.
+    empty = ExemptLog("data/many.jsonl")
+    empty.dump()
+    assert list(empty.records()) == []
+    assert sum(1 for _ in open("data/many.jsonl")) == 5000
+    assert cli.main(["report", "--headless"]) == 0
+    assert sheet_contents(data_dir / "categorized.xlsx")[-1][1] \
+        == exempted["exempted"]
+
+
+def test_local_sources_match_csv(data_dir, tmp_path, capsys):
+    write_classification(data_dir)
+    tree = {
+        "Folder 0": ["202305_RPIF_a", "scan.pdf", "202301_jour_b"],
+        "Folder 1": ["202110_CONF_c", "x_y"],
+        "Folder 0/Old/2019": ["201906_RPIF_d", "notes.txt"],
+        "Folder 1/Empty": [],
+    }
+    for directory, names in tree.items():
+        (tmp_path / "archive" / directory).mkdir(parents=True)
+        for name in names:
+            (tmp_path / "archive" / directory / name).write_text("")
+    # The order of a breadth first walk with sorted entries.
+    rows = [(directory.split("/")[0], name)
+            for directory in sorted(tree, key=lambda d: (d.count("/"), d))
+            for name in sorted(tree[directory])]
+    (tmp_path / "names.csv").write_text("\ufefffolder,name\r\n" + "".join(
+        f"{folder},{name}\r\n" for folder, name in rows))
+    (tmp_path / "names.txt").write_text("\n".join(
+        [name for _, name in rows] + [""]))
+
+    outputs = {}
+    for source in ("names.csv", "archive", "names.txt"):
+        for workers in (1, 4) if source == "archive" else (1,):
+            assert cli.main(["classify-local", str(tmp_path / source),
+                             "--workers", str(workers), "--headless"]) == 0
+            assert "Classified 7 names, 3 exempted" in capsys.readouterr().out
+            outputs[source, workers] = [
+                (data_dir / name).read_text()
+                for name in ("data.json", "exempt.jsonl")] + [
+                sheet_contents(data_dir / name)
+                for name in ("categorized.xlsx", "naac.xlsx")]
+    assert outputs["archive", 1] == outputs["names.csv", 1]
+    assert outputs["archive", 4] == outputs["names.csv", 1]
+    assert outputs["names.txt", 1][0] == outputs["names.csv", 1][0]
+    assert [loads(line) for line in outputs["names.txt", 1][1].splitlines()
+            ] == [{"name": name, "folder": "", "reason": "bad_split"}
+                  for name in ("scan.pdf", "x_y", "notes.txt")]
+
+
+def test_sharded_crawl_merges_to_the_full_reports(data_dir, capsys):
+    write_classification(data_dir)
+    backend = FakeDriveBackend.generate(folders=7, files_per_folder=40,
+                                        exempt_ratio=0.2, seed=3)
+    names = [f"Folder {i}" for i in range(7)]
+    write_folders(data_dir, names)
+
+    def reports():
+        return [(data_dir / name).read_text()
+                for name in ("data.json", "exempt.jsonl")] + [
+            sheet_contents(data_dir / name)
+            for name in ("categorized.xlsx", "naac.xlsx")]
+
+    reader = make_reader(backend)
+    reader.categorize_files()
+    ExcelWorker(headless=True).write_reports(
+        reader.data, reader.exempt, counts=reader.counts)
+    full = reports()
+
+    partials = {}
+    for shard in ("0/3", "1/3", "2/3", ":2", "2:5", "5:"):
+        reader = DriveReader(backend_factory=backend.connect, shard=shard,
+                             scheduler=RequestScheduler(rate=1e6))
+        reader.code_list = CODE_LIST
+        reader.categories = ["RESEARCH", "PUBLICATION"]
+        reader.categorize_files()
+        partials[shard] = reader.write_partial()
+    assert sum(len(loads(open(partials[shard]).read())["folders"])
+               for shard in ("0/3", "1/3", "2/3")) == 7
+
+    merges = [["2/3", "0/3", "1/3"], ["5:", ":2", "2:5"]]
+    for shards in merges:
+        assert cli.main(["merge", *(partials[shard] for shard in shards),
+                         "--headless"]) == 0
+        assert reports() == full
+    # Merging merges gives the same partial in any grouping.
+    assert cli.main(["merge", partials["5:"], partials["2:5"],
+                     "--output", "data/right.json"]) == 0
+    assert cli.main(["merge", partials[":2"], "data/right.json",
+                     "--output", "data/all.json"]) == 0
+    assert cli.main(["merge", *(partials[shard] for shard in merges[0]),
+                     "--output", "data/hashed.json"]) == 0
+    merged = [loads((data_dir / name).read_text())
+              for name in ("all.json", "hashed.json")]
+    assert [partial.pop("exempt") for partial in merged] \
+        == ["all.exempt.jsonl", "hashed.exempt.jsonl"]
+    assert merged[0] == merged[1]
+    assert (data_dir / "all.exempt.jsonl").read_text() \
+        == (data_dir / "hashed.exempt.jsonl").read_text()
+    assert cli.main(["merge", "data/all.json", "--headless"]) == 0
+    assert reports() == full
+
+    capsys.readouterr()
+    assert cli.main(["merge", partials["0/3"], "data/all.json"]) == 1
+    assert "more than one partial" in capsys.readouterr().out
+
+    # The folders on drive are named apart from the names searched for.
+    for number, folder in enumerate(backend.folders):
+        backend.rename(folder, f"Department of Folder {number}")
+    (data_dir / "folder_cache.json").unlink()
+    reader = make_reader(backend)
+    reader.categorize_files()
+    ExcelWorker(headless=True).write_reports(
+        reader.data, reader.exempt, counts=reader.counts)
+    full = reports()
+    for shard in ("0/3", "1/3", "2/3", ":2", "2:5", "5:"):
+        reader = DriveReader(backend_factory=backend.connect, shard=shard,
+                             folder_cache_ttl=0,
+                             scheduler=RequestScheduler(rate=1e6))
+        reader.code_list = CODE_LIST
+        reader.categories = ["RESEARCH", "PUBLICATION"]
+        reader.categorize_files()
+        partials[shard] = reader.write_partial()
+    assert cli.main(["merge", *(partials[shard] for shard in merges[0]),
+                     "--headless"]) == 0
+    assert reports() == full
+    assert cli.main(["merge", partials["5:"], partials["2:5"],
+                     "--output", "data/right.json"]) == 0
+    assert cli.main(["merge", partials[":2"], "data/right.json",
+                     "--headless"]) == 0
+    assert reports() == full
+
+
+def test_offline_commands_do_not_load_the_google_clients(data_dir):
+    write_classification(data_dir)
+    (data_dir / "names.csv").write_text(
+        "folder,name\nFolder 0,202305_RPIF_a\nFolder 0,scan.pdf\n"
+        "Folder 1,202110_CONF_c\n")
+    script = ("import sys; from drivereader.cli import main; "
+              "main(['classify-local', 'data/names.csv', '--headless']); "
+              "main(['report', '--headless', '--streaming']); "
+              "print(sorted({name.split('.')[0] for name in sys.modules "
+              "if name.startswith(('google', 'googleapiclient.discovery', "
+              "'httplib2'))}))")
+    result = run([executable, "-c", script], capture_output=True, text=True,
+                 check=True)
+    assert "Classified 3 names, 1 exempted" in result.stdout
+    assert result.stdout.splitlines()[-1] == "['googleapiclient']"
+    assert loads((data_dir / "data.json").read_text()) == {
+        "RESEARCH": {"2023-2024": {"RPIF": 1}, "2021-2022": {"CONF": 1}},
+        "PUBLICATION": {}}
+    assert loads((data_dir / "exempt.jsonl").read_text()) == {
+        "name": "scan.pdf", "folder": "Folder 0", "reason": "bad_split"}
+    assert sheet_contents(data_dir / "naac.xlsx")[0][0] == "2023-2024"
+
+
+def test_ordered_listings_stay_bounded():
+    produced = [0, 0]
+
+    def listing(number):
+        for page in range(50):
+            produced[number] += 1
+            yield number, page
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pages = ordered([partial(listing, 0), partial(listing, 1)],
+                        executor, depth=2)
+        for number, page in pages:
+            if number == 0:
+                sleep(0.001)
+                assert produced[1] <= 3
+        assert [number for number, _ in ordered(
+            [partial(listing, 0), partial(listing, 1)], executor)] \
+            == [0] * 50 + [1] * 50
+
+    def failing():
+        yield 1
+        raise ValueError("listing failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(ValueError):
+            list(ordered([failing, partial(listing, 0)], executor))
+
+    def interrupted():
+        yield 1
+        raise KeyboardInterrupt
+
+    # Not only an `Exception` ends the listing where it is consumed.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(KeyboardInterrupt):
+            list(ordered([interrupted, partial(listing, 0)], executor))
+
+
+def sheet_contents(filename):
+    workbook = load_workbook(filename)
+    return [(
+        worksheet.title,
+        [list(row) for row in worksheet.iter_rows(values_only=True)],
+        sorted(str(cells) for cells in worksheet.merged_cells.ranges
+               if cells.size != {"columns": 1, "rows": 1}),
+        worksheet["A1"].font.bold
+    ) for worksheet in workbook]
+
+
+def test_streaming_reports_match_default_writer(data_dir):
+    write_classification(data_dir)
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=60)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    reader = make_reader(backend)
+    reader.categorize_files()
+
+    reports = {}
+    for streaming in (False, True):
+        worker = ExcelWorker(streaming)
+        worker.write_data_to_excel(reader.data, reader.exempt)
+        worker.write_naac_data_to_excel(reader.data)
+        reports[streaming] = [sheet_contents(data_dir / name)
+                              for name in ("categorized.xlsx", "naac.xlsx")]
+    assert reports[True] == reports[False]
+
+
+def test_naac_report_has_a_sheet_per_year(data_dir):
+    write_classification(data_dir)
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=80,
+                                        codes=("RPIF", "CONF", "JOUR", "XXXX"))
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    reader = make_reader(backend)
+    reader.index = FileIndex(str(data_dir / "index.sqlite3"))
+    reader.categorize_files()
+    reader.index.set_code_list(CODE_LIST)
+
+    worker = ExcelWorker()
+    rollup = worker.naac_rollup(reader.data)
+    assert rollup == reader.index.classification_counts_by_year()
+    years = sorted({year for category in reader.data.values()
+                    for year in category}, reverse=True)
+    assert list(rollup) == years
+    for year in years:
+        assert rollup[year] == reader.index.classification_counts(year)
+        journals = reader.data["PUBLICATION"].get(year, {}).get("JOUR", 0)
+        assert rollup[year].get("3.4.1", 0) == journals
+
+    worker.write_naac_data_to_excel(reader.data)
+    sheets = sheet_contents(data_dir / "naac.xlsx")
+    assert [sheet[0] for sheet in sheets] == years
+    assert sheets[0][1][1] == ["RESEARCH", "3.3.1",
+                               rollup[years[0]].get("3.3.1", 0)]
+
+
+def test_count_store_matches_nested_counts(data_dir):
+    write_classification(data_dir)
+    names = [f"20{10 + i % 13}{1 + i % 12:02d}01_{code}_{i}"
+             for i, code in enumerate(["RPIF", "JOUR", "CONF", "jour", "XX"]
+                                      * 40)]
+    classifier = FileClassifier(CODE_LIST)
+    counts, _ = classifier.classify(names)
+    store = CountStore()
+    store.update(filter(None, map(classifier.parse, names)))
+    categories = ["PUBLICATION", "RESEARCH", "OTHER"]
+    assert dumps(store.nested(categories)) == dumps(
+        FileClassifier.nested(counts, categories))
+    assert dict(store.items()) == dict(counts)
+    assert store.total() == sum(counts.values())
+
+    worker = ExcelWorker()
+    rollup = store.rollup(worker.classification_index)
+    assert rollup == worker.naac_rollup(store.nested())
+    assert list(rollup) == list(worker.naac_rollup(store.nested()))
+
+    # Parts counted apart merge to the same counts in any grouping.
+    parts = []
+    for start in range(0, len(names), 70):
+        part = CountStore()
+        part.update(filter(None, map(classifier.parse,
+                                     names[start:start + 70])))
+        parts.append(part)
+    left = CountStore().merge(parts[0]).merge(parts[1]).merge(parts[2])
+    right = CountStore().merge(parts[2]).merge(
+        CountStore().merge(parts[1]).merge(parts[0]))
+    for merged in (left, right, CountStore.load(store.dump())):
+        assert dumps(merged.nested(categories)) == dumps(
+            store.nested(categories))
+
+
+def test_headless_reports_are_saved_atomically(data_dir, monkeypatch):
+    write_classification(data_dir)
+    monkeypatch.setattr(drivereader, "ossystem", pytest.fail)
+    worker = ExcelWorker(headless=True)
+    data = {"RESEARCH": {"2022-2023": {"RPIF": 2}}}
+    worker.write_naac_data_to_excel(data)
+    assert sheet_contents(data_dir / "naac.xlsx")[0][0] == "2022-2023"
+    assert (data_dir / "naac.xlsx").stat().st_mode & 0o777 \
+        == drivereader.file_mode()
+    drivereader.write_atomically("{}", "data/data.json")
+    assert (data_dir / "data.json").stat().st_mode & 0o777 \
+        == drivereader.file_mode()
+
+    class Token():
+        def to_json(self):
+            return "{}"
+    make_reader(FakeDriveBackend()).save_token(Token())
+    assert (data_dir.parent / "token.json").stat().st_mode & 0o777 == 0o600
+
+    replace = drivereader.replace
+
+    def locked(source, target):
+        if str(target).endswith("naac.xlsx"):
+            raise PermissionError(target)
+        replace(source, target)
+
+    monkeypatch.setattr(drivereader, "replace", locked)
+    worker.streaming = True
+    worker.write_naac_data_to_excel(data)
+    saved = [file.name for file in data_dir.iterdir()
+             if file.name.startswith("naac")]
+    assert len(saved) == 2 and "naac.xlsx" in saved
+    fallback = next(name for name in saved if name != "naac.xlsx")
+    assert sheet_contents(data_dir / fallback) \
+        == sheet_contents(data_dir / "naac.xlsx")
+    assert not [file for file in data_dir.iterdir()
+                if file.name.endswith(".part")]
+
+
+def test_batch_runs_tenants_in_their_own_directories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tenants = []
+    for number, folders in enumerate((2, 3)):
+        data_dir = tmp_path / f"tenant{number}" / "data"
+        data_dir.mkdir(parents=True)
+        write_classification(data_dir)
+        write_folders(data_dir, [f"Folder {i}" for i in range(folders)])
+        tenants.append({"name": f"tenant{number}",
+                        "directory": f"tenant{number}",
+                        "backend": "drivereader.fakedrive:"
+                                   "FakeDriveBackend.generate",
+                        "backend_options": {"folders": folders,
+                                            "files_per_folder": 20},
+                        "workers": 2})
+    (tmp_path / "missing").mkdir()
+    tenants.append({"name": "missing", "directory": "missing"})
+    (tmp_path / "tenants.json").write_text(dumps(tenants))
+
+    summary = batch.run_batch(batch.load_tenants("tenants.json"), 2,
+                              "summary.json")
+    results = {tenant["name"]: tenant for tenant in summary["tenants"]}
+    assert [results[f"tenant{i}"]["files"] for i in (0, 1)] == [40, 60]
+    assert results["tenant0"]["status"] == "ok"
+    assert "token.json" in results["missing"]["error"]
+    assert summary["failed"] == ["missing"]
+    for number in (0, 1):
+        data_dir = tmp_path / f"tenant{number}" / "data"
+        assert (data_dir / "naac.xlsx").exists()
+        assert (data_dir / "categorized.xlsx").exists()
+    assert (tmp_path / "summary.json").exists()
+    assert not (tmp_path / "data").exists()
+    assert "PermissionError" in (tmp_path / "missing" / "data"
+                                 / "drive_reader_logs.log").read_text()
+
+    # A revoked token fails the tenant instead of opening a browser.
+    from google.auth.exceptions import RefreshError
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    def revoked(credentials, request):
+        raise RefreshError("invalid_grant")
+
+    def browser(*args, **kwargs):
+        raise AssertionError("the browser flow was started")
+
+    monkeypatch.setattr(Credentials, "refresh", revoked)
+    monkeypatch.setattr(InstalledAppFlow, "from_client_secrets_file",
+                        browser)
+    (tmp_path / "missing" / "token.json").write_text(dumps({
+        "token": "stale", "refresh_token": "revoked", "client_id": "id",
+        "client_secret": "secret", "expiry": "2000-01-01T00:00:00Z"}))
+    result = batch.run_tenant(batch.load_tenants("tenants.json")[-1])
+    assert result["status"] == "error"
+    assert result["error"].startswith("PermissionError")
+    assert (tmp_path / "missing" / "token.json").exists()
+
+
+def test_run_profile_is_logged_per_run(data_dir):
+    write_classification(data_dir)
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=25,
+                                        page_size=10)
+    reader = make_reader(backend, workers=2)
+    reader.main(headless=True, profile_path="data/profile.jsonl",
+                cprofile_path="data/run.prof")
+    api_calls = reader.api_calls
+    make_reader(backend).main(headless=True,
+                              profile_path="data/profile.jsonl")
+
+    runs = [loads(line) for line in
+            (data_dir / "profile.jsonl").read_text().splitlines()]
+    assert len(runs) == 2
+    profile = runs[0]
+    for stage in ("download_sheet", "classification", "resolve_folders",
+                  "listing", "classify", "crawl", "excel_categorized",
+                  "excel_naac"):
+        assert profile["stages"][stage] >= 0
+    assert profile["counters"] == {"pages": 9, "files": 75}
+    assert profile["api_calls"] == api_calls
+    assert profile["requests"]["retries"] == 0
+    assert profile["files_per_second"] > 0
+    assert Stats(str(data_dir / "run.prof")).total_calls > 0
+
+
+def test_classification_parse_is_cached_by_fingerprint(data_dir, monkeypatch):
+    write_classification(data_dir)
+    parsed = ExcelWorker()
+    assert parsed.code_list["JOUR"] == [CODE_LIST["JOUR"][0], "RESEARCH",
+                                        ["3.3.1", "3.4.1"]]
+    assert parsed.classification_list == {"3.3.1": "RESEARCH",
+                                          "3.3.2": "RESEARCH",
+                                          "3.4.1": "PUBLICATION"}
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the workbook was parsed again")
+    monkeypatch.setattr(drivereader, "load_workbook", fail)
+    cached = ExcelWorker()
+    assert cached.code_list == parsed.code_list
+    assert cached.classification_list == parsed.classification_list
+
+    with pytest.raises(AssertionError):
+        ExcelWorker(fingerprint="a newer version")
+
+
+def test_daemon_rewrites_only_changed_sheets(data_dir):
+    write_classification(data_dir)
+    backend = FakeDriveBackend.generate(folders=3, files_per_folder=40,
+                                        exempt_ratio=0.2, seed=9)
+    sheet_id = backend.add_sheet(
+        "doc_classification",
+        (data_dir / "doc_classification.xlsx").read_bytes())
+    write_folders(data_dir, [f"Folder {i}" for i in range(3)])
+    daemon = ReportDaemon(make_reader(backend), sheet_id=sheet_id)
+    host, port = daemon.start_server(port=0)
+
+    def get(endpoint):
+        try:
+            with urlopen(f"http://{host}:{port}{endpoint}") as response:
+                return response.status, loads(response.read())
+        except HTTPError as error:
+            return error.code, loads(error.read())
+
+    def full_reports():
+        reader = make_reader(backend)
+        reader.code_list = daemon.worker.code_list
+        reader.categories = daemon.worker.classification_list.values()
+        reader.categorize_files()
+        ExcelWorker(headless=True).write_reports(
+            reader.data, reader.exempt, counts=reader.counts)
+        return reader.data, {writer: sheet_contents(
+            data_dir / f"{writer}.xlsx") for writer in ("categorized", "naac")}
+
+    try:
+        assert get("/counts")[0] == 503
+        first = daemon.refresh()
+        data = loads((data_dir / "data.json").read_text())
+        assert get("/counts") == (200, data)
+        assert get("/missing")[0] == 404
+
+        # Nothing changed in the folders, so nothing is written.
+        backend.calls = 0
+        reports = {path: path.stat().st_mtime_ns
+                   for path in data_dir.glob("*.xlsx")}
+        assert daemon.refresh() == 0
+        assert backend.calls == 2
+        assert reports == {path: path.stat().st_mtime_ns
+                           for path in data_dir.glob("*.xlsx")}
+
+        backend.add_file("202108_CONF_new.pdf", "id00000001")
+        written = daemon.refresh()
+        assert 0 < written < first
+        after = {writer: sheet_contents(data_dir / f"{writer}.xlsx")
+                 for writer in ("categorized", "naac")}
+        full_data, full = full_reports()
+        assert after == full
+        assert get("/counts") == (200, loads(dumps(full_data)))
+        assert get("/status")[1]["changes"] == 1
+    finally:
+        daemon.close()
+
+
+def test_sheet_is_downloaded_only_when_changed(data_dir, monkeypatch):
+    monkeypatch.setattr(drivereader, "DOWNLOAD_CHUNK", 1024)
+    backend = FakeDriveBackend()
+    sheet_id = backend.add_sheet("doc_classification", b"x" * 3000)
+    reader = make_reader(backend)
+
+    assert reader.download_sheet(sheet_id)
+    assert (data_dir / "doc_classification.xlsx").read_bytes() == b"x" * 3000
+    assert backend.calls == 4
+
+    backend.calls = 0
+    assert reader.download_sheet(sheet_id)
+    assert backend.calls == 1
+    first = reader.sheet_fingerprint
+
+    backend.update_sheet(sheet_id, b"y" * 10)
+    assert reader.download_sheet(sheet_id)
+    assert (data_dir / "doc_classification.xlsx").read_bytes() == b"y" * 10
+    assert reader.sheet_fingerprint != first
+    assert [path.name for path in data_dir.iterdir()
+            if path.suffix == ".part"] == []